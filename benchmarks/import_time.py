@@ -0,0 +1,93 @@
+'''
+Startup time of the CLI, to keep lazy imports from regressing.
+
+    python benchmarks/import_time.py --runs 20 --max-ms 300
+
+Every command runs in a fresh interpreter, the median wall time is reported
+together with the modules importing `ipams.cli` pulls in, slowest first.
+Exits with 1 if a median exceeds `--max-ms`.
+'''
+
+import argparse
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+COMMANDS = [['--help'], ['ip', '--help'], ['cache', '--help']]
+# must never be imported before a command needs them
+DEFERRED = [
+    'pynetbox',
+    'requests',
+    'yaml',
+    'sqlite3',
+    'numpy',
+    'ipams.netbox',
+    'ipams.phpipam',
+    'ipams.diff',
+]
+
+
+def run(args: list[str], runs: int) -> float:
+    '''Median wall time in ms of `python -m ipams <args>`'''
+    timings = []
+    for _ in range(runs):
+        started = perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'ipams', *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append((perf_counter() - started) * 1000)
+    return median(timings)
+
+
+def imports() -> list[tuple[str, int]]:
+    '''Top level modules imported by `ipams.cli` with their cumulative time in us'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ipams.cli'],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.append((name.strip(), int(cumulative)))
+    return modules
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    failed = False
+    for command in COMMANDS:
+        elapsed = run(command, args.runs)
+        over = args.max_ms is not None and elapsed > args.max_ms
+        failed |= over
+        print(
+            f'ipams {" ".join(command):<20} {elapsed:8.1f} ms{"  SLOW" if over else ""}'
+        )
+
+    modules = imports()
+    print('\nslowest imports of ipams.cli (cumulative):')
+    slowest = sorted(modules, key=lambda m: -m[1])
+    for name, cumulative in slowest[: args.top]:
+        print(f'  {name:<40} {cumulative / 1000:8.1f} ms')
+
+    imported = {name for name, _ in modules}
+    eager = [name for name in DEFERRED if name in imported]
+    if eager:
+        failed = True
+        print(f'\nimported at startup but should be deferred: {", ".join(eager)}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
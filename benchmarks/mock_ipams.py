@@ -0,0 +1,621 @@
+'''
+Stand-in NetBox and phpIPAM APIs serving synthetic data, for benchmarks.
+
+    python benchmarks/mock_ipams.py --scale 100k --latency-ms 20 --port 8765
+
+NetBox is served under `/api/`, phpIPAM under `/php/api/<app>/`. Records are
+computed from their index instead of being stored, so a million addresses
+cost no memory. Address `i` is `10.x.y.(i % 250 + 1)` in /24 number `i // 250`,
+four out of five addresses are assigned to an interface of device `i // 5 + 1`.
+
+Requests and response bytes are counted per route, `GET /_stats` returns
+them and `POST /_reset` sets them back to zero.
+'''
+
+import argparse
+import gzip
+import json
+import re
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import IPv4Address, IPv4Network, ip_address, ip_network
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable, Optional, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+HOSTS = 250
+BASE = int(IPv4Address('10.0.0.0'))
+SITES = 10
+TENANTS = 5
+VLANS = 20
+ROLES = ('office', 'dc', 'lab')
+LAST_UPDATED = '2024-01-01T00:00:00Z'
+# with --gzip larger responses are compressed, as nginx does by default
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+# fields of NetBox objects no query needs, like in a real NetBox
+NETBOX_EXTRAS = {
+    'created': LAST_UPDATED,
+    'comments': '',
+    'tags': [],
+    'custom_fields': {'owner': None, 'ticket': None, 'monitoring': None},
+}
+EDIT_DATE = '2024-01-01 00:00:00'
+NETBOX_PAGE_SIZE = 50
+NETBOX_MAX_PAGE_SIZE = 1000
+
+
+def parse_scale(value: str) -> int:
+    '''`10k`, `100k`, `1m` or a plain number of addresses'''
+    value = value.strip().lower()
+    factor = {'k': 1000, 'm': 1000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * factor)
+
+
+class Dataset:
+    '''Synthetic addresses, prefixes and devices, all derived from indexes'''
+
+    def __init__(self, addresses: int):
+        self.addresses = addresses
+        self.subnets = -(-addresses // HOSTS)
+        # a /16 above every 256 /24s
+        self.parents = -(-self.subnets // 256)
+        self.devices = addresses // 5 + 1
+
+    # addresses
+
+    def address(self, i: int) -> IPv4Address:
+        return IPv4Address(BASE + (i // HOSTS) * 256 + i % HOSTS + 1)
+
+    def address_index(self, address) -> Optional[int]:
+        offset = int(address) - BASE
+        subnet, host = offset >> 8, offset & 255
+        if offset < 0 or not 1 <= host <= HOSTS:
+            return None
+        i = subnet * HOSTS + host - 1
+        return i if i < self.addresses else None
+
+    def addresses_in(self, network) -> Sequence[int]:
+        first = max(int(network.network_address) - BASE, 0)
+        last = int(network.broadcast_address) - BASE
+        if last < 0:
+            return []
+        indexes: list[int] = []
+        for subnet in range(first >> 8, min(last >> 8, self.subnets - 1) + 1):
+            # host numbers of this /24 inside the network
+            low = max(1, first - subnet * 256)
+            high = min(HOSTS, last - subnet * 256)
+            start = subnet * HOSTS + low - 1
+            stop = min(subnet * HOSTS + high, self.addresses)
+            indexes.extend(range(start, stop))
+        return indexes
+
+    def device_of(self, i: int) -> Optional[int]:
+        return None if i % 5 == 0 else i // 5 + 1
+
+    def hostname(self, i: int) -> str:
+        return f'host{i}.bench'
+
+    # subnets, /24s first, then their /16 parents
+
+    def subnet(self, j: int) -> IPv4Network:
+        if j < self.subnets:
+            return IPv4Network((BASE + j * 256, 24))
+        return IPv4Network((BASE + (j - self.subnets) * 65536, 16))
+
+    def subnet_description(self, j: int) -> str:
+        if j >= self.subnets:
+            return f'parent {j - self.subnets}'
+        return f'subnet {j} {ROLES[j % len(ROLES)]}'
+
+    def subnets_overlapping(self, network, parents: bool = False) -> list[int]:
+        if network.version != 4:
+            return []
+        first = max(int(network.network_address) - BASE, 0) >> 8
+        last = (int(network.broadcast_address) - BASE) >> 8
+        found = list(range(first, min(last, self.subnets - 1) + 1))
+        if parents:
+            found += [
+                self.subnets + k
+                for k in range(self.parents)
+                if self.subnet(self.subnets + k).overlaps(network)
+            ]
+        return found
+
+
+def _matching(count: int, text: Callable[[int], str], query: str) -> list[int]:
+    query = query.lower()
+    return [i for i in range(count) if query in text(i).lower()]
+
+
+class MockIpams:
+    '''Request counters and the renderers of both APIs'''
+
+    def __init__(self, data: Dataset, latency: float = 0.0, gzip: bool = False):
+        self.data = data
+        self.latency = latency
+        # compress responses for clients accepting it, like a typical proxy
+        self.gzip = gzip
+        self._lock = Lock()
+        self.requests: Counter = Counter()
+        self.bytes: Counter = Counter()
+
+    def count(self, route: str, size: int):
+        with self._lock:
+            self.requests[route] += 1
+            self.bytes[route] += size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': sum(self.requests.values()),
+                'bytes': sum(self.bytes.values()),
+                'routes': {
+                    route: {
+                        'requests': self.requests[route],
+                        'bytes': self.bytes[route],
+                    }
+                    for route in sorted(self.requests)
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes.clear()
+
+    # NetBox
+
+    def netbox(self, base: str, path: str, qs: dict) -> tuple[int, object]:
+        data = self.data
+        if path == '/api/status/':
+            return 200, {'netbox-version': '4.1.0'}
+        if path == '/api/core/object-changes/':
+            return 200, self._page([], lambda i: {}, qs, base + path)
+        if path == '/api/ipam/ip-addresses/':
+            return 200, self._page(
+                self._netbox_addresses(qs), lambda i: self._ip(base, i), qs, base + path
+            )
+        indexes: Sequence[int]
+        if path == '/api/ipam/prefixes/':
+            indexes = range(data.subnets + data.parents)
+            if 'q' in qs:
+                indexes = self._netbox_prefixes(qs['q'][0])
+            if 'last_updated__gte' in qs and qs['last_updated__gte'][0] > LAST_UPDATED:
+                indexes = []
+            indexes = _id_range(indexes, qs)
+            return 200, self._page(
+                indexes, lambda j: self._prefix(base, j), qs, base + path
+            )
+        if path == '/api/dcim/devices/':
+            indexes = range(1, data.devices + 1)
+            if 'id' in qs:
+                ids = sorted({int(d) for d in qs['id']})
+                indexes = [d for d in ids if 1 <= d <= data.devices]
+            if 'q' in qs:
+                matches = _matching(data.devices, lambda d: f'dev{d + 1}', qs['q'][0])
+                indexes = [d + 1 for d in matches]
+            return 200, self._page(
+                indexes, lambda d: self._device(base, d), qs, base + path
+            )
+        match = re.fullmatch(r'/api/dcim/devices/(\d+)/', path)
+        if match and 1 <= int(match[1]) <= data.devices:
+            return 200, self._device(base, int(match[1]))
+        return 404, {'detail': 'Not found.'}
+
+    def netbox_graphql(self, base: str, body: dict) -> tuple[int, object]:
+        '''`ip_address_list` with filters and pagination in variables'''
+        if 'ip_address_list' not in body.get('query', ''):
+            return 200, {'data': None, 'errors': [{'message': 'Unsupported query'}]}
+        variables = body.get('variables') or {}
+        qs = {
+            name: [str(value).lower()] if isinstance(value, bool) else value
+            for name, value in (variables.get('filters') or {}).items()
+        }
+        pagination = variables.get('pagination') or {}
+        offset = pagination.get('offset', 0)
+        indexes = self._netbox_addresses(qs)
+        stop = offset + pagination.get('limit', len(indexes))
+        return 200, {
+            'data': {
+                'ip_address_list': [
+                    self._graphql_ip(base, i) for i in indexes[offset:stop]
+                ]
+            }
+        }
+
+    def _netbox_addresses(self, qs: dict) -> Sequence[int]:
+        data = self.data
+        indexes: Sequence[int] = range(data.addresses)
+        if 'address' in qs:
+            found = (
+                data.address_index(ip_address(a.split('/')[0])) for a in qs['address']
+            )
+            indexes = sorted({i for i in found if i is not None})
+        if 'parent' in qs:
+            indexes = _intersect(
+                indexes, data.addresses_in(ip_network(qs['parent'][0]))
+            )
+        if 'id' in qs:
+            ids = {int(i) - 1 for i in qs['id']}
+            indexes = [i for i in indexes if i in ids]
+        if 'q' in qs:
+            indexes = _intersect(indexes, self._netbox_address_search(qs['q'][0]))
+        if qs.get('assigned_to_interface', [''])[0].lower() == 'true':
+            indexes = [i for i in indexes if data.device_of(i) is not None]
+        if 'last_updated__gte' in qs and qs['last_updated__gte'][0] > LAST_UPDATED:
+            indexes = []
+        return _id_range(indexes, qs)
+
+    def _netbox_address_search(self, query: str) -> Sequence[int]:
+        '''NetBox matches the start of the address or dns name and description'''
+        match = re.fullmatch(r'(\d+\.\d+\.\d+)\.(\d*)', query)
+        if match:
+            network = ip_network(f'{match[1]}.0/24', strict=False)
+            return [
+                i
+                for i in self.data.addresses_in(network)
+                if str(self.data.address(i)).startswith(query)
+            ]
+        return _matching(self.data.addresses, self.data.hostname, query)
+
+    def _netbox_prefixes(self, query: str) -> list[int]:
+        data = self.data
+        total = data.subnets + data.parents
+        try:
+            network = ip_network(query, strict=False)
+        except ValueError:
+            return _matching(total, data.subnet_description, query)
+        # NetBox returns prefixes containing or equal to a network query
+        return [
+            j
+            for j in data.subnets_overlapping(network, parents=True)
+            if data.subnet(j).prefixlen <= network.prefixlen
+        ]
+
+    def _page(
+        self, indexes: Sequence[int], render: Callable[[int], dict], qs: dict, url: str
+    ) -> dict:
+        limit = int(qs.get('limit', [NETBOX_PAGE_SIZE])[0]) or NETBOX_MAX_PAGE_SIZE
+        limit = min(limit, NETBOX_MAX_PAGE_SIZE)
+        offset = int(qs.get('offset', [0])[0])
+        stop = offset + limit
+        results = [render(i) for i in indexes[offset:stop]]
+        if 'fields' in qs:
+            fields = qs['fields'][0].split(',')
+            results = [{f: r[f] for f in fields if f in r} for r in results]
+        following = None
+        if offset + limit < len(indexes):
+            query = {k: v for k, v in qs.items() if k not in ('limit', 'offset')}
+            params = '&'.join(f'{k}={v}' for k, values in query.items() for v in values)
+            following = f'{url}?{params}&limit={limit}&offset={offset + limit}'
+        return {
+            'count': len(indexes),
+            'next': following,
+            'previous': None,
+            'results': results,
+        }
+
+    def _nested(self, base: str, kind: str, id: int, name: str) -> dict:
+        return {
+            'id': id,
+            'url': f'{base}/api/{kind}/{id}/',
+            'display': name,
+            'name': name,
+        }
+
+    def _ip(self, base: str, i: int) -> dict:
+        data = self.data
+        address = data.address(i)
+        device = data.device_of(i)
+        assigned = None
+        if device is not None:
+            assigned = self._nested(base, 'dcim/interfaces', i + 1, 'eth0')
+            assigned['device'] = self._nested(
+                base, 'dcim/devices', device, f'dev{device}'
+            )
+        return {
+            'id': i + 1,
+            'url': f'{base}/api/ipam/ip-addresses/{i + 1}/',
+            'display': f'{address}/24',
+            'address': f'{address}/24',
+            'vrf': None,
+            'tenant': self._nested(
+                base, 'tenancy/tenants', i % TENANTS + 1, f'tenant{i % TENANTS + 1}'
+            ),
+            'status': {'value': 'active', 'label': 'Active'},
+            'assigned_object_type': 'dcim.interface' if assigned else None,
+            'assigned_object_id': i + 1 if assigned else None,
+            'assigned_object': assigned,
+            'dns_name': data.hostname(i),
+            'description': f'ip {i}',
+            'family': {'value': address.version, 'label': f'IPv{address.version}'},
+            'role': None,
+            'nat_inside': None,
+            'nat_outside': [],
+            **NETBOX_EXTRAS,
+            'last_updated': LAST_UPDATED,
+        }
+
+    def _graphql_ip(self, base: str, i: int) -> dict:
+        ip = self._ip(base, i)
+        assigned = {}
+        if ip['assigned_object']:
+            device = self._device(base, ip['assigned_object']['device']['id'])
+            assigned['device'] = {
+                'id': str(device['id']),
+                'name': device['name'],
+                'site': {'name': device['site']['name']},
+                'tenant': {'name': device['tenant']['name']},
+            }
+        return {
+            'id': str(ip['id']),
+            'address': ip['address'],
+            'tenant': {'name': ip['tenant']['name']},
+            'assigned_object': assigned or None,
+        }
+
+    def _prefix(self, base: str, j: int) -> dict:
+        return {
+            'id': j + 1,
+            'url': f'{base}/api/ipam/prefixes/{j + 1}/',
+            'display': str(self.data.subnet(j)),
+            'prefix': str(self.data.subnet(j)),
+            'vrf': None,
+            'tenant': None,
+            'description': self.data.subnet_description(j),
+            'scope': None,
+            'vlan': None,
+            'status': {'value': 'active', 'label': 'Active'},
+            'role': None,
+            'is_pool': False,
+            'mark_utilized': False,
+            **NETBOX_EXTRAS,
+            'last_updated': LAST_UPDATED,
+        }
+
+    def _device(self, base: str, d: int) -> dict:
+        return {
+            'id': d,
+            'url': f'{base}/api/dcim/devices/{d}/',
+            'display': f'dev{d}',
+            'name': f'dev{d}',
+            'site': self._nested(
+                base, 'dcim/sites', d % SITES + 1, f'site{d % SITES + 1}'
+            ),
+            'tenant': self._nested(
+                base, 'tenancy/tenants', d % TENANTS + 1, f'tenant{d % TENANTS + 1}'
+            ),
+            'primary_ip': None,
+            'primary_ip4': None,
+            'device_type': self._nested(base, 'dcim/device-types', 1, 'server'),
+            'role': self._nested(base, 'dcim/device-roles', 1, 'server'),
+            'platform': None,
+            'serial': '',
+            'rack': None,
+            'status': {'value': 'active', 'label': 'Active'},
+            **NETBOX_EXTRAS,
+            'last_updated': LAST_UPDATED,
+        }
+
+    # phpIPAM
+
+    def phpipam(self, parts: list[str], qs: dict) -> tuple[int, object]:
+        data = self.data
+        found: object = None
+        if parts == ['sections']:
+            found = [self._section(s) for s in (1, 2)]
+        elif parts[0] == 'sections' and len(parts) == 2 and parts[1] in ('1', '2'):
+            found = self._section(int(parts[1]))
+        elif parts == ['vlans']:
+            found = [self._vlan(v) for v in range(1, VLANS + 1)]
+        elif parts[0] == 'vlans' and len(parts) == 3 and parts[2] == 'subnets':
+            vlan = int(parts[1])
+            found = [self._subnet(j) for j in range(vlan - 1, data.subnets, VLANS)]
+        elif parts == ['subnets']:
+            indexes: Sequence[int] = range(data.subnets)
+            if 'filter_by' in qs:
+                field, value = qs['filter_by'][0], qs['filter_value'][0]
+                indexes = _matching(
+                    data.subnets, lambda j: str(self._subnet(j).get(field, '')), value
+                )
+            found = [self._subnet(j) for j in indexes]
+        elif parts[:2] in (['subnets', 'search'], ['subnets', 'overlapping']):
+            network = ip_network('/'.join(parts[2:]), strict=False)
+            found = [self._subnet(j) for j in data.subnets_overlapping(network)]
+        elif parts[0] == 'subnets' and len(parts) >= 2 and parts[1].isdigit():
+            j = int(parts[1]) - 1
+            if 0 <= j < data.subnets and len(parts) == 2:
+                found = self._subnet(j)
+            elif 0 <= j < data.subnets and parts[2:] == ['addresses']:
+                found = [self._address(i) for i in data.addresses_in(data.subnet(j))]
+                if qs.get('filter_match') == ['regex']:
+                    field, pattern = qs['filter_by'][0], qs['filter_value'][0]
+                    found = [a for a in found if re.search(pattern, a[field])]
+        elif parts[:2] == ['addresses', 'search'] and len(parts) == 3:
+            i = data.address_index(ip_address(parts[2]))
+            found = [self._address(i)] if i is not None else None
+        elif parts[:2] == ['addresses', 'search_hostbase'] and len(parts) == 3:
+            matches = [
+                i
+                for i in range(data.addresses)
+                if data.hostname(i).startswith(parts[2])
+            ]
+            found = [self._address(i) for i in matches]
+        if not found:
+            return 404, {'code': 404, 'success': False, 'message': 'No results'}
+        return 200, {'code': 200, 'success': True, 'data': found}
+
+    def _section(self, s: int) -> dict:
+        return {'id': str(s), 'name': ('Customers', 'Infra')[s - 1]}
+
+    def _vlan(self, v: int) -> dict:
+        return {'vlanId': str(v), 'number': str(100 + v), 'name': f'vlan-{v}'}
+
+    def _subnet(self, j: int) -> dict:
+        network = self.data.subnet(j)
+        return {
+            'id': str(j + 1),
+            'subnet': str(network.network_address),
+            'mask': str(network.prefixlen),
+            'sectionId': str(j % 2 + 1),
+            'description': self.data.subnet_description(j),
+            'vlanId': str(j % VLANS + 1),
+            'isFolder': '0',
+            'editDate': EDIT_DATE,
+        }
+
+    def _address(self, i: int) -> dict:
+        return {
+            'id': str(i + 1),
+            'ip': str(self.data.address(i)),
+            'subnetId': str(i // HOSTS + 1),
+            'hostname': self.data.hostname(i),
+            'description': f'addr {i}',
+            'mac': None,
+            'owner': None,
+            'tag': '2',
+            'deviceId': None,
+            'location': None,
+            'port': None,
+            'note': None,
+            'lastSeen': None,
+            'excludePing': '0',
+            'PTRignore': '0',
+            'PTR': '0',
+            'firewallAddressObject': None,
+            'is_gateway': '0',
+            'customer_id': None,
+            'editDate': EDIT_DATE,
+        }
+
+
+def _intersect(indexes: Sequence[int], other: Sequence[int]) -> Sequence[int]:
+    if isinstance(indexes, range) and indexes == range(len(indexes)):
+        return [i for i in other if i < len(indexes)]
+    keep = set(indexes)
+    return [i for i in other if i in keep]
+
+
+def _id_range(indexes: Sequence[int], qs: dict) -> Sequence[int]:
+    '''`id__gte` and `id__lt` filters, ids are the indexes plus one'''
+    low = int(qs['id__gte'][0]) - 1 if 'id__gte' in qs else None
+    high = int(qs['id__lt'][0]) - 1 if 'id__lt' in qs else None
+    if low is None and high is None:
+        return indexes
+    return [
+        i for i in indexes if (low is None or i >= low) and (high is None or i < high)
+    ]
+
+
+def _route(path: str) -> str:
+    '''Path with ids and addresses replaced, to count requests per endpoint'''
+    parts = path.strip('/').split('/')
+    if parts[:2] == ['php', 'api'] and len(parts) > 2:
+        parts[2] = '{app}'
+    return '/%s/' % '/'.join(
+        '{id}' if part.isdigit() or '.' in part or ':' in part else part
+        for part in parts
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockServer'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        qs = parse_qs(url.query)
+        mock = self.server.mock
+        if url.path == '/_stats':
+            return self._send(200, mock.stats(), count=False)
+        sleep(mock.latency)
+        base = f'http://{self.headers["Host"]}'
+        if url.path.startswith('/php/api/'):
+            parts = url.path.split('/')[4:]
+            status, body = mock.phpipam([p for p in parts if p], qs)
+        elif url.path == '/api/':
+            return self._send(200, {}, headers={'API-Version': '4.1'})
+        elif url.path.startswith('/api/'):
+            status, body = mock.netbox(base, url.path, qs)
+        else:
+            status, body = 404, {}
+        self._send(status, body)
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path == '/_reset':
+            mock.reset()
+            return self._send(200, {}, count=False)
+        sleep(mock.latency)
+        if self.path == '/graphql/':
+            base = f'http://{self.headers["Host"]}'
+            return self._send(*mock.netbox_graphql(base, json.loads(body)))
+        if self.path.startswith('/php/api/') and self.path.rstrip('/').endswith(
+            '/user'
+        ):
+            token = {'token': 'bench', 'expires': '2099-01-01 00:00:00'}
+            return self._send(200, {'code': 200, 'success': True, 'data': token})
+        self._send(404, {})
+
+    def _send(self, status: int, body: object, headers: dict = {}, count: bool = True):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        accepted = self.headers.get('Accept-Encoding', '')
+        if self.server.mock.gzip and 'gzip' in accepted and len(data) > GZIP_MIN_SIZE:
+            data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        if count:
+            self.server.mock.count(
+                f'{self.command} {_route(urlsplit(self.path).path)}', len(data)
+            )
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mock: MockIpams, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), Handler)
+        self.mock = mock
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockServer':
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', default='10k', help='addresses, e.g. 10k, 100k, 1m')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--gzip', action='store_true', help='compress responses')
+    args = parser.parse_args()
+    mock = MockIpams(
+        Dataset(parse_scale(args.scale)), args.latency_ms / 1000, args.gzip
+    )
+    server = MockServer(mock, args.host, args.port)
+    print(f'Serving {mock.data.addresses} addresses on {server.url}', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''
+Request count, bytes, wall time and peak memory of CLI commands and
+connector methods against the mock IPAMs of `mock_ipams.py`.
+
+    python benchmarks/run.py --scale 100k --latency-ms 20 -o results.json
+    python benchmarks/run.py --baseline results.json
+
+Every case runs in a fresh interpreter with its own home directory, so no
+response cache, snapshot, token or daemon of the user is involved. With
+`--baseline` the run fails when a case makes more requests than before or
+gets slower than `--tolerance` allows.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Optional, Union
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_ipams import Dataset, MockIpams, MockServer, parse_scale  # noqa: E402
+
+# name, CLI arguments; {addresses} is a file with BULK_ADDRESSES addresses
+CLI_CASES = [
+    ('cli ip', ['ip', '10.0.1.7']),
+    ('cli ip --file', ['ip', '--file', '{addresses}']),
+    ('cli host by name', ['host', 'dev42']),
+    ('cli host by ip', ['host', '10.0.1.7']),
+    ('cli network by string', ['network', 'office']),
+    ('cli network by address', ['network', '10.0.1.0/24']),
+    ('cli subnet /24', ['subnet', '10.0.1.0/24']),
+    ('cli subnet /20', ['subnet', '10.0.16.0/20']),
+    ('cli subnet /16', ['subnet', '10.0.0.0/16']),
+]
+# name, backend kind, connector method, argument; graphql is NetBox with GraphQL
+CONNECTOR_CASES = [
+    ('netbox query_ip', 'netbox', 'query_ip', '10.0.1.7'),
+    ('netbox query_ips', 'netbox', 'query_ips', '{addresses}'),
+    ('netbox query_subnet_by_cidr', 'netbox', 'query_subnet_by_cidr', '10.0.16.0/20'),
+    ('netbox query_network_by_string', 'netbox', 'query_network_by_string', 'office'),
+    ('netbox iter_addresses', 'netbox', 'iter_addresses', ''),
+    ('graphql query_host_by_ip', 'graphql', 'query_host_by_ip', '10.0.1.7'),
+    ('graphql query_subnet_by_cidr', 'graphql', 'query_subnet_by_cidr', '10.0.16.0/20'),
+    ('phpipam query_ip', 'phpipam', 'query_ip', '10.0.1.7'),
+    ('phpipam query_ips', 'phpipam', 'query_ips', '{addresses}'),
+    ('phpipam query_subnet_by_cidr', 'phpipam', 'query_subnet_by_cidr', '10.0.16.0/20'),
+    ('phpipam query_network_by_string', 'phpipam', 'query_network_by_string', 'office'),
+    ('phpipam iter_addresses', 'phpipam', 'iter_addresses', ''),
+]
+BULK_ADDRESSES = 1000
+# seconds a case may get slower regardless of the tolerance, timer noise
+MIN_SLOWDOWN = 0.05
+
+CONFIG = '''
+netboxes:
+  - name: netbox
+    url: {url}/
+    token: bench
+phpipams:
+  - name: phpipam
+    url: {url}/php
+    app_id: bench
+    username: bench
+    password: bench
+'''
+
+
+def _argument(method: str, value: str):
+    '''Parse a connector method argument like the CLI does'''
+    from ipaddress import ip_address, ip_network
+
+    if method == 'query_ips':
+        return [ip_address(line) for line in Path(value).read_text().split()]
+    if method in ('query_ip', 'query_host_by_ip'):
+        return ip_address(value)
+    if method in ('query_subnet_by_cidr', 'query_network_by_address'):
+        return ip_network(value)
+    return value
+
+
+def child(config: str, kind: str, method: str, value: str):
+    '''Runs a connector method and prints its duration and number of rows'''
+    from ipams.config import parse_config
+    from ipams.netbox import NetBoxConnector
+    from ipams.phpipam import PhpIpamConnector
+
+    parsed_config = parse_config(Path(config))
+    connector: Union[NetBoxConnector, PhpIpamConnector]
+    if kind == 'netbox':
+        connector = NetBoxConnector(parsed_config.netboxes[0])
+    elif kind == 'graphql':
+        netbox = parsed_config.netboxes[0].model_copy(update={'graphql': True})
+        connector = NetBoxConnector(netbox)
+    else:
+        connector = PhpIpamConnector(parsed_config.phpipams[0])
+    args = [_argument(method, value)] if value else []
+    started = perf_counter()
+    result = getattr(connector, method)(*args)
+    if isinstance(result, dict):
+        rows = sum(len(matches) for matches in result.values())
+    else:
+        rows = sum(1 for _ in result)
+    print(json.dumps({'seconds': perf_counter() - started, 'rows': rows}))
+
+
+def _run(argv: list[str], env: dict) -> tuple[float, int, bytes]:
+    '''Wall time, peak RSS in KiB and stdout of a child process'''
+    started = perf_counter()
+    process = subprocess.Popen(
+        argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    assert process.stdout is not None
+    stdout = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f'{" ".join(argv)} exited with {process.returncode}')
+    return elapsed, usage.ru_maxrss, stdout
+
+
+def _stats(url: str, reset: bool = False) -> dict:
+    if reset:
+        urlopen(Request(f'{url}/_reset', data=b'', method='POST')).read()
+        return {}
+    return json.loads(urlopen(f'{url}/_stats').read())
+
+
+def run_cases(url: str, workdir: Path, names: Optional[set[str]]) -> list[dict]:
+    config = workdir.joinpath('config.yml')
+    config.write_text(CONFIG.format(url=url))
+    addresses = workdir.joinpath('addresses.txt')
+    data = Dataset(BULK_ADDRESSES * 5)
+    addresses.write_text(
+        '\n'.join(str(data.address(i * 5)) for i in range(BULK_ADDRESSES))
+    )
+    env = {**os.environ, 'HOME': str(workdir), 'IPAMS_CONFIG_CACHE': '0'}
+    env['PYTHONPATH'] = os.pathsep.join(
+        [str(Path(__file__).parent.parent), env.get('PYTHONPATH', '')]
+    )
+
+    results = []
+    for name, args in CLI_CASES:
+        if names and name not in names:
+            continue
+        args = [arg.format(addresses=addresses) for arg in args]
+        argv = [sys.executable, '-m', 'ipams', *args, '-c', str(config), '-o', 'jsonl']
+        _stats(url, reset=True)
+        elapsed, rss, stdout = _run(argv, env)
+        results.append(
+            {
+                'name': name,
+                'wall_seconds': round(elapsed, 4),
+                'rows': stdout.count(b'\n'),
+                'peak_rss_kb': rss,
+                **_stats(url),
+            }
+        )
+    for name, kind, method, value in CONNECTOR_CASES:
+        if names and name not in names:
+            continue
+        value = value.format(addresses=addresses)
+        argv = [sys.executable, __file__, '--child', str(config), kind, method, value]
+        _stats(url, reset=True)
+        _, rss, stdout = _run(argv, env)
+        measured = json.loads(stdout)
+        results.append(
+            {
+                'name': name,
+                'wall_seconds': round(measured['seconds'], 4),
+                'rows': measured['rows'],
+                'peak_rss_kb': rss,
+                **_stats(url),
+            }
+        )
+    return results
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    '''Regressions against a previous run'''
+    previous = {case['name']: case for case in baseline['results']}
+    regressions = []
+    for case in results:
+        before = previous.get(case['name'])
+        if before is None:
+            continue
+        if case['requests'] > before['requests']:
+            regressions.append(
+                f'{case["name"]}: {case["requests"]} requests, {before["requests"]} before'
+            )
+        slowdown = case['wall_seconds'] - before['wall_seconds']
+        if slowdown > max(before['wall_seconds'] * tolerance, MIN_SLOWDOWN):
+            regressions.append(
+                f'{case["name"]}: {case["wall_seconds"]}s, {before["wall_seconds"]}s before'
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', default='10k', help='addresses, e.g. 10k, 100k, 1m')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--gzip', action='store_true', help='compress responses')
+    parser.add_argument('--case', action='append', help='only run these cases')
+    parser.add_argument('--output', '-o', type=Path, help='write results here')
+    parser.add_argument('--baseline', type=Path, help='fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return 0
+
+    scale = parse_scale(args.scale)
+    mock = MockIpams(Dataset(scale), args.latency_ms / 1000, args.gzip)
+    server = MockServer(mock).start()
+    with tempfile.TemporaryDirectory(prefix='ipams-bench-') as workdir:
+        results = run_cases(server.url, Path(workdir), set(args.case or []))
+    server.shutdown()
+
+    report = {
+        'scale': scale,
+        'latency_ms': args.latency_ms,
+        'gzip': args.gzip,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+    for case in results:
+        print(
+            f'{case["name"]:<34} {case["wall_seconds"]:8.3f}s {case["requests"]:6} req '
+            + f'{case["bytes"] / 1024:10.1f} KiB {case["peak_rss_kb"] / 1024:7.1f} MiB',
+            file=sys.stderr,
+        )
+
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from ipams.logging import logger
+
+default_cache_dir = Path.home().joinpath('.cache/ipams')
+
+
+def create_private(path: Path):
+    '''
+    Create a database file only its owner can read, like the token store.
+    SQLite creates the journal files with the same permissions.
+    '''
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+
+
+class CacheConfig(BaseModel):
+    enabled: bool = False
+    path: Path = default_cache_dir.joinpath('responses.sqlite')
+    max_size_mb: float = 64
+    # default ttl in seconds, 0 disables caching
+    ttl: int = 300
+    # ttl per object type, e.g. `sections`, `subnets`, `ip-addresses`
+    ttls: dict[str, int] = {}
+
+
+class CachedResponse:
+    def __init__(self, status: int, headers: dict, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class ResponseCache:
+    '''
+    SQLite backed cache for API responses, shared between CLI invocations.
+    Entries are evicted least recently used first once `max_size_mb` is exceeded.
+    '''
+
+    def __init__(self, config: CacheConfig, refresh: bool = False):
+        self.config = config
+        # refresh skips cached entries but still stores fresh responses
+        self.refresh = refresh
+        self._lock = Lock()
+        create_private(config.path)
+        self._db = sqlite3.connect(config.path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            '''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )'''
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)'
+        )
+        self._db.commit()
+
+    def ttl(self, backend, endpoint: str) -> int:
+        '''Resolve the ttl for an endpoint, backend settings take precedence'''
+        segments = [s for s in endpoint.split('/') if s]
+        for segment in segments:
+            if segment in backend.cache_ttls:
+                return backend.cache_ttls[segment]
+        if backend.cache_ttl is not None:
+            return backend.cache_ttl
+        for segment in segments:
+            if segment in self.config.ttls:
+                return self.config.ttls[segment]
+        return self.config.ttl
+
+    def get(self, key: str, ttl: int) -> Optional[CachedResponse]:
+        if self.refresh or ttl <= 0:
+            return None
+        now = time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status, headers, body FROM responses WHERE key = ? AND created > ?',
+                (key, now - ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?',
+                (now, key),
+            )
+            self._db.commit()
+        return CachedResponse(row[0], json.loads(row[1]), row[2])
+
+    def set(
+        self,
+        key: str,
+        backend: str,
+        endpoint: str,
+        status: int,
+        headers: dict,
+        body: bytes,
+    ):
+        now = time()
+        with self._lock:
+            self._db.execute(
+                '''INSERT OR REPLACE INTO responses
+                (key, backend, endpoint, status, headers, body, size, created, accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (
+                    key,
+                    backend,
+                    endpoint,
+                    status,
+                    json.dumps(headers),
+                    body,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        max_size = int(self.config.max_size_mb * 1024 * 1024)
+        (size,) = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()
+        if size <= max_size:
+            return
+        # free a bit more than needed so eviction doesn't run on every write
+        to_free = size - int(max_size * 0.9)
+        keys = []
+        for key, entry_size in self._db.execute(
+            'SELECT key, size FROM responses ORDER BY accessed'
+        ):
+            keys.append((key,))
+            to_free -= entry_size
+            if to_free <= 0:
+                break
+        self._db.executemany('DELETE FROM responses WHERE key = ?', keys)
+        logger.debug(f'Evicted {len(keys)} cached responses')
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT backend, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0),
+                MIN(created), MAX(created) FROM responses GROUP BY backend ORDER BY backend'''
+            ).fetchall()
+        return [
+            {
+                'backend': row[0],
+                'entries': row[1],
+                'size': row[2],
+                'hits': row[3],
+                'oldest': row[4],
+                'newest': row[5],
+            }
+            for row in rows
+        ]
+
+    def clear(self, backend: Optional[str] = None) -> int:
+        with self._lock:
+            if backend:
+                cursor = self._db.execute(
+                    'DELETE FROM responses WHERE backend = ?', (backend,)
+                )
+            else:
+                cursor = self._db.execute('DELETE FROM responses')
+            self._db.commit()
+            self._db.execute('VACUUM')
+        return cursor.rowcount
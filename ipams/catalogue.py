@@ -0,0 +1,50 @@
+from typing import Generic, Hashable, Iterator, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+
+def _trigrams(text: str) -> Iterator[str]:
+    return map(''.join, zip(text, text[1:], text[2:]))
+
+
+class TrigramIndex(Generic[K]):
+    '''
+    Case insensitive substring search over many short texts.
+
+    Every query term of three or more characters narrows the candidates to
+    the texts containing all of its trigrams, the remaining candidates are
+    verified with a plain substring check. A text matches if it contains
+    all terms of the query.
+    '''
+
+    def __init__(self) -> None:
+        self._texts: dict[K, str] = {}
+        self._order: dict[K, int] = {}
+        self._postings: dict[str, set[K]] = {}
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, key: K, text: str):
+        text = text.lower()
+        self._texts[key] = text
+        self._order.setdefault(key, len(self._order))
+        for trigram in _trigrams(text):
+            self._postings.setdefault(trigram, set()).add(key)
+
+    def search(self, query: str) -> list[K]:
+        '''Keys of all texts containing every term of `query`, in insertion order'''
+        terms = query.lower().split()
+        candidates: Optional[set[K]] = None
+        for term in terms:
+            for trigram in _trigrams(term):
+                posting = self._postings.get(trigram, set())
+                candidates = posting if candidates is None else candidates & posting
+                if not candidates:
+                    return []
+        if candidates is None:
+            candidates = set(self._texts)
+        matches = [
+            key for key in candidates if all(term in self._texts[key] for term in terms)
+        ]
+        return sorted(matches, key=self._order.__getitem__)
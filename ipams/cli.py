@@ -1,129 +1,1266 @@
-import importlib.metadata
-from ipaddress import ip_address, ip_network
+from __future__ import annotations
+
+import sys
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from functools import cache as memoize
+from functools import partial
+from ipaddress import IPv4Address, IPv6Address, ip_address, ip_network
+from itertools import islice
 from pathlib import Path
+from time import monotonic, time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    Optional,
+    TextIO,
+    Union,
+)
 
 import typer
 from rich.console import Console
+from rich.table import Table
+
+from ipams.executor import BackendTask, QueryExecutor
+from ipams.logging import logger
+from ipams.output import (
+    FIELDS,
+    TABLES,
+    BulkIPTable,
+    DiffTable,
+    FreeTable,
+    OutputFormat,
+    ProfileTable,
+    ResultTable,
+    RowWriter,
+)
+from ipams.tracing import tracer
+from ipams.utils import chunks
 
-from ipams.config import parse_config
-from ipams.netbox import NetBoxConnector
-from ipams.phpipam import PhpIpamConnector
+# backend libraries, pydantic and yaml are imported by the commands using them,
+# so `--help`, `version` and shell completion start fast
+if TYPE_CHECKING:
+    from ipams.cache import ResponseCache
+    from ipams.config import Config
+    from ipams.daemon import DaemonClient
+    from ipams.diff import Inventory
+    from ipams.export import Export
+    from ipams.free import Allocations, Network
+    from ipams.netbox import NetBoxConfig
+    from ipams.phpipam import PhpIpamConfig
+    from ipams.server import ConnectorPool
+    from ipams.snapshot import SnapshotStore, _backend_kind
 
 app = typer.Typer()
+cache_app = typer.Typer(help='Manage the local response cache')
+app.add_typer(cache_app, name='cache')
 console = Console()
+err_console = Console(stderr=True)
 
 default_config_path = Path.home().joinpath('.config/ipams/config.yml')
 
+# input addresses looked up and printed together in bulk mode
+BULK_CHUNK_SIZE = 500
+
+config_option = typer.Option(
+    default_config_path, '--config', '-c', help='Path to config file'
+)
+ordered_option = typer.Option(False, '--ordered', help='Print results in config order')
+no_cache_option = typer.Option(
+    False, '--no-cache', help='Neither read nor write the response cache'
+)
+refresh_option = typer.Option(
+    False, '--refresh', help='Ignore cached responses but store fresh ones'
+)
+offline_option = typer.Option(
+    False, '--offline', help='Answer from the local snapshot, see "ipams sync"'
+)
+output_option = typer.Option(
+    None,
+    '--output',
+    '-o',
+    help='Output format, defaults to tables on a terminal and tsv otherwise',
+)
+merge_option = typer.Option(
+    False,
+    '--merge',
+    '-m',
+    help='Print each address or network once with all IPAMs knowing it, sorted',
+)
+no_daemon_option = typer.Option(
+    False, '--no-daemon', help='Query the IPAMs even if "ipams serve" is running'
+)
+limit_option = typer.Option(
+    None,
+    '--limit',
+    '-n',
+    min=1,
+    help='Stop after this many results and cancel the remaining queries',
+)
+first_option = typer.Option(
+    False,
+    '--first',
+    help='Only print the results of the first IPAM that finds any, cancel the others',
+)
+prioritize_option = typer.Option(
+    False,
+    '--prioritize',
+    help='Query the historically fastest IPAMs first, slower ones once they are late',
+)
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: bool = typer.Option(
+        False, '--profile', help='Print request timings per endpoint to stderr'
+    ),
+    trace: Optional[Path] = typer.Option(
+        None, '--trace', help='Write a span per request as JSON to this file'
+    ),
+):
+    '''
+    Query multiple IPAMs
+    '''
+    if not profile and trace is None:
+        return
+    tracer.start(' '.join(['ipams', *sys.argv[1:]]))
+    ctx.call_on_close(partial(_finish_trace, profile, trace))
+
+
+def _finish_trace(profile: bool, trace: Optional[Path]):
+    finished = tracer.finish()
+    if trace is not None:
+        import json
+
+        trace.write_text(json.dumps(finished, indent=2))
+    if not profile:
+        return
+    table = ProfileTable()
+    for row in tracer.summary():
+        table.add_record(row)
+    err_console.print(table)
+    for backend, seconds in tracer.backends().items():
+        err_console.print(f'{backend}: {seconds:.3f}s')
+    err_console.print(f'Total: {finished["spans"][0]["duration"]:.3f}s')
+
+
+def parse_config(config: Path) -> Config:
+    from ipams.config import parse_config
+
+    return parse_config(config)
+
+
+def _output_format(output: Optional[OutputFormat]) -> OutputFormat:
+    if output is not None:
+        return output
+    return OutputFormat.table if console.is_terminal else OutputFormat.tsv
+
+
+def _open_cache(
+    parsed_config: Config, no_cache: bool = False, refresh: bool = False
+) -> Optional[ResponseCache]:
+    if no_cache or not parsed_config.cache.enabled:
+        return None
+    from ipams.cache import ResponseCache
+
+    return ResponseCache(parsed_config.cache, refresh=refresh)
+
+
+def _backends(
+    parsed_config: Config,
+) -> list[tuple[_backend_kind, Union[NetBoxConfig, PhpIpamConfig]]]:
+    backends: list[tuple[_backend_kind, Union[NetBoxConfig, PhpIpamConfig]]] = [
+        ('netbox', nb) for nb in parsed_config.netboxes
+    ]
+    backends += [('phpipam', php) for php in parsed_config.phpipams]
+    return backends
+
+
+def _connector_factory(
+    kind: _backend_kind,
+    backend: Union[NetBoxConfig, PhpIpamConfig],
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    pool: Optional[ConnectorPool] = None,
+    concurrency: int = 1,
+) -> tuple[type, Callable[[], Any]]:
+    '''
+    Connector class and a factory, connectors are built when their task runs.
+    With a pool connectors are reused instead. `concurrency` is the number of
+    queries sharing a connector at once, its connection pool is sized for them.
+    '''
+    if store is not None:
+        from ipams.snapshot import SnapshotConnector
+
+        return SnapshotConnector, partial(SnapshotConnector, store, backend, kind)
+    connector: type
+    if kind == 'netbox':
+        from ipams.netbox import NetBoxConnector as connector
+    else:
+        from ipams.phpipam import PhpIpamConnector as connector
+    factory = partial(connector, backend, cache=cache, concurrency=concurrency)
+    if pool is not None:
+        if kind == 'phpipam':
+            # pooled connectors live long enough to search a subnet catalogue
+            factory = partial(factory, catalogue=True)
+        return connector, pool.factory(backend.name, factory)
+    return connector, factory
+
+
+def _pool_concurrency(parsed_config: Config, pool: Optional[ConnectorPool]) -> int:
+    '''Pooled connectors are shared by the queries running at the same time'''
+    return parsed_config.concurrency if pool is not None else 1
+
+
+def _query(factory: Callable[[], Any], method: str, *args) -> Any:
+    return getattr(factory(), method)(*args)
+
+
+def _backend_tasks(
+    parsed_config: Config,
+    method: str,
+    *args,
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    pool: Optional[ConnectorPool] = None,
+) -> list[BackendTask[Iterable[dict]]]:
+    '''
+    Build one task per configured backend, NetBoxes first.
+    Backends whose connector doesn't implement `method` are skipped.
+    '''
+    tasks: list[BackendTask[Iterable[dict]]] = []
+    for kind, backend in _backends(parsed_config):
+        connector, factory = _connector_factory(
+            kind, backend, cache, store, pool, _pool_concurrency(parsed_config, pool)
+        )
+        if hasattr(connector, method):
+            tasks.append(
+                BackendTask(
+                    backend.name,
+                    partial(_query, factory, method, *args),
+                    timeout=backend.query_timeout or parsed_config.query_timeout,
+                )
+            )
+    return tasks
+
+
+def _open_snapshot(parsed_config: Config, offline: bool) -> Optional[SnapshotStore]:
+    if not offline:
+        return None
+    from ipams.snapshot import SnapshotStore
+
+    store = SnapshotStore(parsed_config.snapshot)
+    now = time()
+    for _, backend in _backends(parsed_config):
+        synced_at = store.synced_at(backend.name)
+        if synced_at is not None:
+            age = timedelta(seconds=int(now - synced_at))
+            err_console.print(f'Snapshot of "{backend.name}" is {age} old', style='dim')
+    return store
+
+
+def _resolve(
+    command: str, query: str, include_unassigned: bool = False
+) -> tuple[str, tuple]:
+    '''Connector method and its arguments for a query command'''
+    if command == 'ip':
+        return 'query_ip', (ip_address(query),)
+    if command == 'subnet':
+        return 'query_subnet_by_cidr', (ip_network(query), include_unassigned)
+    if command == 'host':
+        try:
+            return 'query_host_by_ip', (ip_address(query),)
+        except ValueError:
+            return 'query_host_by_name', (query,)
+    if command == 'network':
+        try:
+            return 'query_network_by_address', (ip_network(query),)
+        except ValueError:
+            return 'query_network_by_string', (query,)
+    raise ValueError(f'Unknown command "{command}"')
+
+
+def _query_batches(
+    parsed_config: Config,
+    method: str,
+    args: tuple,
+    ordered: bool,
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    pool: Optional[ConnectorPool] = None,
+    limit: Optional[int] = None,
+    first: bool = False,
+    prioritize: bool = False,
+) -> Iterator[tuple[str, str, list[dict]]]:
+    '''
+    Query all backends, batches of rows are yielded as (backend, ipam, rows).
+    The queries still running are cancelled after `limit` rows, or with
+    `first` once the first backend that found rows is done. With
+    `prioritize` backends are started fastest first, each one once the
+    faster ones had their usual time to answer.
+    '''
+    tasks = _backend_tasks(
+        parsed_config, method, *args, cache=cache, store=store, pool=pool
+    )
+    # queries timed for `prioritize` that are still running
+    running: dict[object, tuple[str, float]] = {}
+    if prioritize:
+        _prioritize(tasks, running)
+    kinds = {backend.name: kind for kind, backend in _backends(parsed_config)}
+    executor = QueryExecutor(
+        parsed_config.concurrency,
+        ordered=ordered or parsed_config.ordered,
+        first=first,
+    )
+    batches = executor.stream(tasks)
+    try:
+        for task, rows in batches:
+            if limit is not None:
+                rows = rows[:limit]
+                limit -= len(rows)
+            yield task.name, kinds[task.name], rows
+            if limit == 0:
+                return
+    finally:
+        batches.close()
+        if prioritize:
+            from ipams.latency import latencies
+
+            latencies.abandon(running)
+            latencies.save()
+
+
+def _prioritize(
+    tasks: list[BackendTask[Iterable[dict]]],
+    running: dict[object, tuple[str, float]],
+):
+    '''
+    Time the tasks and order them by the latency of their backend. Backends
+    without measurements start right away, the others are delayed by the
+    usual latency of the next faster one. Running queries are listed in
+    `running`.
+    '''
+    from ipams.latency import latencies
+
+    seconds = {task.name: latencies.get(task.name) for task in tasks}
+    tasks.sort(
+        key=lambda task: (seconds[task.name] is not None, seconds[task.name] or 0)
+    )
+    faster: Optional[float] = None
+    for task in tasks:
+        task.func = partial(latencies.timed, task.name, task.func, running)
+        if seconds[task.name] is not None:
+            task.delay = faster or 0.0
+            faster = seconds[task.name]
+
+
+def _daemon(
+    parsed_config: Config, config: Path, *flags: bool
+) -> Optional[DaemonClient]:
+    '''Client of a running `ipams serve`, unless any of `flags` is set'''
+    # profiling measures the requests of this process
+    if any(flags) or tracer.enabled:
+        return None
+    from ipams.daemon import DaemonClient
+
+    client = DaemonClient(parsed_config.serve, config)
+    return client if client.available() else None
+
+
+def _run_query(
+    parsed_config: Config,
+    command: str,
+    query: str,
+    ordered: bool,
+    output: Optional[OutputFormat],
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    client: Optional[DaemonClient] = None,
+    include_unassigned: bool = False,
+    merge: bool = False,
+    limit: Optional[int] = None,
+    first: bool = False,
+    prioritize: bool = False,
+):
+    '''Print the results of a query command, answered by the daemon if one runs'''
+    try:
+        method, args = _resolve(command, query, include_unassigned)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    batches = None
+    if client is not None:
+        batches = client.query(
+            command, query, ordered, include_unassigned, limit, first, prioritize
+        )
+    if batches is None:
+        batches = _query_batches(
+            parsed_config,
+            method,
+            args,
+            ordered,
+            cache=cache,
+            store=store,
+            limit=limit,
+            first=first,
+            prioritize=prioritize,
+        )
+    if merge:
+        _print_merged(batches, output)
+    else:
+        _print_results(batches, method, output)
+
+
+def _print_results(
+    batches: Iterable[tuple[str, str, list[dict]]],
+    method: str,
+    output: Optional[OutputFormat] = None,
+):
+    '''
+    Print rows as they arrive. Tables are printed per batch and titled on the
+    first one, other formats are written to stdout without any layout.
+    '''
+    output = _output_format(output)
+    if output != OutputFormat.table:
+        writer = RowWriter(output, sys.stdout)
+        for name, ipam, rows in batches:
+            writer.write({'backend': name, 'ipam': ipam, **row} for row in rows)
+        writer.close()
+        return
+    printed: set[str] = set()
+    for name, ipam, rows in batches:
+        table = TABLES[ipam][method](name)
+        if name in printed:
+            table.title = None
+            table.show_header = False
+        printed.add(name)
+        for row in rows:
+            table.add_record(**row)
+        console.print(table)
+
+
+def _print_merged(
+    batches: Iterable[tuple[str, str, list[dict]]],
+    output: Optional[OutputFormat] = None,
+):
+    '''Print the results of all backends once the last one answered, merged'''
+    from ipams.query import merge, results
+
+    merged = merge(results(batches))
+    output = _output_format(output)
+    if output != OutputFormat.table:
+        writer = RowWriter(output, sys.stdout)
+        for chunk in chunks(merged, BULK_CHUNK_SIZE):
+            writer.write(result.to_row() for result in chunk)
+        writer.close()
+        return
+    table = ResultTable()
+    for result in merged:
+        table.add_record(result)
+    console.print(table)
+
+
+def _read_addresses(lines: Iterable[str]) -> Iterator[Union[IPv4Address, IPv6Address]]:
+    '''Parse one address per line, skipping blanks, comments and duplicates'''
+    seen: set[Union[IPv4Address, IPv6Address]] = set()
+    for number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            address = ip_address(line)
+        except ValueError:
+            logger.warning(f'Skipping invalid address "{line}" on line {number}')
+            continue
+        if address not in seen:
+            seen.add(address)
+            yield address
+
+
+def _bulk_resolver(
+    parsed_config: Config,
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    pool: Optional[ConnectorPool] = None,
+) -> Callable[[list], dict[str, list[dict]]]:
+    '''
+    A function looking up a list of addresses in all backends concurrently,
+    returning the matches per address. Connectors are built once and reused
+    by every call, so memoized lookups are shared.
+    '''
+    backends = []
+    for kind, backend in _backends(parsed_config):
+        connector, factory = _connector_factory(
+            kind, backend, cache, store, pool, _pool_concurrency(parsed_config, pool)
+        )
+        if hasattr(connector, 'query_ips'):
+            # one connector per backend for all calls, memoized lookups are reused
+            backends.append((kind, backend, memoize(factory)))
+    kinds = {backend.name: kind for kind, backend, _ in backends}
+    executor = QueryExecutor(parsed_config.concurrency, ordered=True)
+
+    def resolve(addresses: list) -> dict[str, list[dict]]:
+        tasks = [
+            BackendTask(
+                backend.name,
+                partial(_query, factory, 'query_ips', addresses),
+                timeout=backend.query_timeout or parsed_config.query_timeout,
+            )
+            for _, backend, factory in backends
+        ]
+        matches: dict[str, list[dict]] = {str(address): [] for address in addresses}
+        for task, found in executor.run(tasks):
+            for address, records in found.items():
+                matches[address] += [
+                    {'backend': task.name, 'ipam': kinds[task.name], **record}
+                    for record in records
+                ]
+        return matches
+
+    return resolve
+
+
+def _bulk_lookup(
+    parsed_config: Config,
+    addresses: Iterable[Union[IPv4Address, IPv6Address]],
+    cache: Optional[ResponseCache] = None,
+    store: Optional[SnapshotStore] = None,
+    pool: Optional[ConnectorPool] = None,
+) -> Iterator[list[tuple[str, list[dict]]]]:
+    '''
+    Look up addresses in chunks, all backends are queried concurrently per chunk.
+    Yields the matches of every input address per chunk, in input order.
+    '''
+    resolve = _bulk_resolver(parsed_config, cache, store, pool)
+    for chunk in chunks(addresses, BULK_CHUNK_SIZE):
+        yield list(resolve(chunk).items())
+
+
+def _print_bulk_results(
+    results: Iterable[list[tuple[str, list[dict]]]],
+    output: Optional[OutputFormat] = None,
+):
+    '''A table row per input address, or a record per match and unknown address'''
+    output = _output_format(output)
+    if output == OutputFormat.table:
+        for chunk in results:
+            table = BulkIPTable()
+            for address, matches in chunk:
+                table.add_record(address, matches)
+            console.print(table)
+        return
+    writer = RowWriter(output, sys.stdout, fields=('query',) + FIELDS)
+    for chunk in results:
+        writer.write(
+            {'query': address, **match}
+            for address, matches in chunk
+            for match in matches or [{}]
+        )
+    writer.close()
+
 
 @app.command()
 def ip(
-    ip: str = typer.Argument(..., help='IP address'),
-    config: Path = typer.Option(
-        default_config_path, '--config', '-c', help='Path to config file'
+    ip: Optional[str] = typer.Argument(None, help='IP address'),
+    file: Optional[str] = typer.Option(
+        None,
+        '--file',
+        '-f',
+        help='Look up all addresses in a file, one per line, "-" reads stdin',
     ),
+    config: Path = config_option,
+    ordered: bool = ordered_option,
+    no_cache: bool = no_cache_option,
+    refresh: bool = refresh_option,
+    offline: bool = offline_option,
+    output: Optional[OutputFormat] = output_option,
+    merge: bool = merge_option,
+    no_daemon: bool = no_daemon_option,
+    limit: Optional[int] = limit_option,
+    first: bool = first_option,
+    prioritize: bool = prioritize_option,
 ):
     '''
     Query IPAMs for IP address
     '''
-    converted = ip_address(ip)
+    if (ip is None) == (file is None):
+        raise typer.BadParameter('Pass either an IP address or --file')
+    if file is not None and (limit or first):
+        raise typer.BadParameter('--limit and --first need a single address')
     parsed_config = parse_config(config)
-    for nb in parsed_config.netboxes:
-        table = NetBoxConnector(nb).query_ip(converted)
-        if len(table.rows) > 0:
-            console.print(table)
-
-    for phpipam in parsed_config.phpipams:
-        table = PhpIpamConnector(phpipam).query_ip(converted)
-        if len(table.rows) > 0:
-            console.print(table)
+    client = _daemon(parsed_config, config, no_daemon, no_cache, refresh, offline)
+    cache = _open_cache(parsed_config, no_cache, refresh)
+    store = _open_snapshot(parsed_config, offline)
+    if ip is not None:
+        _run_query(
+            parsed_config,
+            'ip',
+            ip,
+            ordered,
+            output,
+            cache,
+            store,
+            client,
+            merge=merge,
+            limit=limit,
+            first=first,
+            prioritize=prioritize,
+        )
+        return
+    if file is not None:
+        # stdin stays open, only files opened here are closed
+        source: ContextManager[TextIO] = nullcontext(sys.stdin)
+        if file != '-':
+            source = open(file)
+        with source as lines:
+            addresses: Iterable[Union[IPv4Address, IPv6Address]]
+            addresses = _read_addresses(lines)
+            results: Optional[Iterable[list[tuple[str, list[dict]]]]] = None
+            if client is not None:
+                # kept for a local lookup in case the daemon doesn't answer
+                addresses = list(addresses)
+                matches = client.lookup(str(address) for address in addresses)
+                if matches is not None:
+                    results = (
+                        list(chunk) for chunk in chunks(matches, BULK_CHUNK_SIZE)
+                    )
+            if results is None:
+                results = _bulk_lookup(
+                    parsed_config, addresses, cache=cache, store=store
+                )
+            _print_bulk_results(results, output)
 
 
 @app.command()
 def host(
     query: str = typer.Argument(..., help='Host name or ip address'),
-    config: Path = typer.Option(
-        default_config_path, '--config', '-c', help='Path to config file'
-    ),
+    config: Path = config_option,
+    ordered: bool = ordered_option,
+    no_cache: bool = no_cache_option,
+    refresh: bool = refresh_option,
+    output: Optional[OutputFormat] = output_option,
+    merge: bool = merge_option,
+    no_daemon: bool = no_daemon_option,
+    limit: Optional[int] = limit_option,
+    first: bool = first_option,
+    prioritize: bool = prioritize_option,
 ):
     '''
     Query IPAMs for host name or IP address
     '''
     parsed_config = parse_config(config)
-    ip = None
+    client = _daemon(parsed_config, config, no_daemon, no_cache, refresh)
+    cache = _open_cache(parsed_config, no_cache, refresh)
+    _run_query(
+        parsed_config,
+        'host',
+        query,
+        ordered,
+        output,
+        cache,
+        client=client,
+        merge=merge,
+        limit=limit,
+        first=first,
+        prioritize=prioritize,
+    )
+
+
+@app.command()
+def network(
+    query: str = typer.Argument(..., help='Network name or address'),
+    config: Path = config_option,
+    ordered: bool = ordered_option,
+    no_cache: bool = no_cache_option,
+    refresh: bool = refresh_option,
+    offline: bool = offline_option,
+    output: Optional[OutputFormat] = output_option,
+    merge: bool = merge_option,
+    no_daemon: bool = no_daemon_option,
+    limit: Optional[int] = limit_option,
+    first: bool = first_option,
+    prioritize: bool = prioritize_option,
+):
+    '''
+    Query IPAMs for network name or address
+    '''
+    parsed_config = parse_config(config)
+    client = _daemon(parsed_config, config, no_daemon, no_cache, refresh, offline)
+    cache = _open_cache(parsed_config, no_cache, refresh)
+    store = _open_snapshot(parsed_config, offline)
+    _run_query(
+        parsed_config,
+        'network',
+        query,
+        ordered,
+        output,
+        cache,
+        store,
+        client,
+        merge=merge,
+        limit=limit,
+        first=first,
+        prioritize=prioritize,
+    )
+
+
+@app.command()
+def subnet(
+    query: str = typer.Argument(..., help='Subnet CIDR to query hosts from'),
+    config: Path = config_option,
+    ordered: bool = ordered_option,
+    no_cache: bool = no_cache_option,
+    refresh: bool = refresh_option,
+    offline: bool = offline_option,
+    output: Optional[OutputFormat] = output_option,
+    merge: bool = merge_option,
+    no_daemon: bool = no_daemon_option,
+    include_unassigned: bool = typer.Option(
+        False,
+        '--include-unassigned',
+        '-u',
+        help='Also list IPs without interface (NetBox) or hostname (phpIPAM)',
+    ),
+):
+    '''
+    Query IPAMs for hosts in a subnet
+    '''
+    parsed_config = parse_config(config)
+    client = _daemon(parsed_config, config, no_daemon, no_cache, refresh, offline)
+    cache = _open_cache(parsed_config, no_cache, refresh)
+    store = _open_snapshot(parsed_config, offline)
+    _run_query(
+        parsed_config,
+        'subnet',
+        query,
+        ordered,
+        output,
+        cache,
+        store,
+        client,
+        include_unassigned,
+        merge,
+    )
+
+
+@app.command()
+def serve(
+    config: Path = config_option,
+    port: Optional[int] = typer.Option(
+        None, '--port', '-p', help='Also serve the HTTP API on this port of 127.0.0.1'
+    ),
+):
+    '''
+    Answer queries from a long running process with warm connections and
+    caches, the other commands use it while it is running
+    '''
+    from ipams.server import serve as run_server
+
+    def ready(addresses: list[str]):
+        err_console.print(f'Serving {config} on {", ".join(addresses)}', style='dim')
+
     try:
-        ip = ip_address(query)
-    except ValueError:
+        run_server(config, port, on_ready=ready)
+    except KeyboardInterrupt:
         pass
+    except (OSError, RuntimeError) as e:
+        err_console.print(f'Could not serve {config}: {e}')
+        raise typer.Exit(1)
 
-    for nb in parsed_config.netboxes:
-        if ip:
-            table = NetBoxConnector(nb).query_host_by_ip(ip)
-        else:
-            table = NetBoxConnector(nb).query_host_by_name(query)
-        if len(table.rows) > 0:
-            console.print(table)
 
-    for phpipam in parsed_config.phpipams:
-        if ip:
-            table = PhpIpamConnector(phpipam).query_host_by_ip(ip)
-        else:
-            table = PhpIpamConnector(phpipam).query_host_by_name(query)
-        if len(table.rows) > 0:
-            console.print(table)
+def _sync(
+    store: SnapshotStore,
+    kind: _backend_kind,
+    name: str,
+    factory: Callable[[], Any],
+    full: bool,
+) -> str:
+    from ipams.snapshot import Changes
+
+    started = monotonic()
+    connector = factory()
+    high_water = None if full else store.high_water(name)
+    if high_water is None:
+        changes = Changes('')
+        prefixes, addresses = store.replace(
+            name,
+            kind,
+            connector.iter_prefixes(changes),
+            connector.iter_addresses(changes),
+            high_water=lambda: changes.high_water,
+        )
+        return (
+            f'Synced "{name}": {prefixes} prefixes, {addresses} addresses '
+            + f'in {monotonic() - started:.1f}s'
+        )
+    if kind == 'phpipam':
+        changes = connector.changes_since(
+            high_water, store.prefix_ids(name), store.address_ids(name)
+        )
+    else:
+        changes = connector.changes_since(high_water)
+    prefixes, addresses = store.apply(name, kind, changes)
+    return (
+        f'Refreshed "{name}": {prefixes} prefix and {addresses} address changes '
+        + f'in {monotonic() - started:.1f}s'
+    )
 
 
 @app.command()
-def network(
-    query: str = typer.Argument(..., help='Network name or address'),
-    config: Path = typer.Option(
-        default_config_path, '--config', '-c', help='Path to config file'
+def sync(
+    config: Path = config_option,
+    backend: Optional[str] = typer.Option(
+        None, '--backend', '-b', help='Only sync this backend'
+    ),
+    full: bool = typer.Option(
+        False,
+        '--full',
+        help='Download everything instead of changes since the last sync',
     ),
 ):
     '''
-    Query IPAMs for network name or address
+    Download prefixes and addresses of all IPAMs into the local snapshot,
+    after the first sync only changes are fetched
     '''
+    from ipams.snapshot import SnapshotStore
+
     parsed_config = parse_config(config)
-    subnet = None
+    store = SnapshotStore(parsed_config.snapshot)
+    tasks: list[BackendTask[str]] = []
+    for kind, backend_config in _backends(parsed_config):
+        if backend and backend_config.name != backend:
+            continue
+        _, factory = _connector_factory(kind, backend_config)
+        tasks.append(
+            BackendTask(
+                backend_config.name,
+                partial(_sync, store, kind, backend_config.name, factory, full),
+            )
+        )
+    synced = 0
+    for _, summary in QueryExecutor(parsed_config.concurrency).run(tasks):
+        console.print(summary)
+        synced += 1
+    # failed backends are logged by the executor, their snapshot is kept
+    if synced < len(tasks):
+        raise typer.Exit(1)
+
+
+def _inventory(
+    name: str, factory: Callable[[], Any], store: Optional[SnapshotStore]
+) -> Inventory:
+    from ipams.diff import Inventory
+
+    inventory = Inventory(name)
+    if store is not None:
+        inventory.add_snapshot(store)
+        return inventory
+    connector = factory()
+    inventory.add_rows('prefix', connector.iter_prefixes())
+    inventory.add_rows('address', connector.iter_addresses())
+    return inventory
+
+
+@app.command()
+def diff(
+    left: Optional[str] = typer.Argument(
+        None, help='Backend name, defaults to the first configured backend'
+    ),
+    right: Optional[str] = typer.Argument(
+        None, help='Backend name, defaults to the second configured backend'
+    ),
+    config: Path = config_option,
+    offline: bool = offline_option,
+    output: Optional[OutputFormat] = output_option,
+):
+    '''
+    Compare the prefixes and addresses of two IPAMs, reports entries missing
+    in one of them and differing hostnames and descriptions
+    '''
+    try:
+        from ipams.diff import DIFF_FIELDS
+        from ipams.diff import diff as diff_inventories
+    except ImportError:
+        err_console.print('"ipams diff" needs numpy: pip install "ipams[diff]"')
+        raise typer.Exit(1)
+
+    parsed_config = parse_config(config)
+    backends = {
+        backend.name: (kind, backend) for kind, backend in _backends(parsed_config)
+    }
+    names = [left or '', right or '']
+    defaults = [name for name in backends if name not in names]
+    for position, name in enumerate(names):
+        if not name and defaults:
+            name = names[position] = defaults.pop(0)
+        if name not in backends:
+            raise typer.BadParameter(f'Unknown backend "{name}"')
+    store = _open_snapshot(parsed_config, offline)
+    tasks = []
+    for name in names:
+        _, factory = _connector_factory(*backends[name])
+        tasks.append(BackendTask(name, partial(_inventory, name, factory, store)))
+    inventories = {
+        task.name: inventory
+        for task, inventory in QueryExecutor(parsed_config.concurrency).run(tasks)
+    }
+    left_inventory, right_inventory = (inventories[name] for name in names)
+    err_console.print(
+        f'Comparing "{names[0]}" ({len(left_inventory)} entries) with '
+        + f'"{names[1]}" ({len(right_inventory)} entries)',
+        style='dim',
+    )
+
+    rows = diff_inventories(left_inventory, right_inventory)
+    issues: dict[str, int] = {}
+    output = _output_format(output)
+    if output == OutputFormat.table:
+        table = DiffTable(*names)
+        for row in rows:
+            issues[row['issue']] = issues.get(row['issue'], 0) + 1
+            table.add_record(row)
+        console.print(table)
+    else:
+        writer = RowWriter(output, sys.stdout, fields=DIFF_FIELDS)
+        for chunk in chunks(rows, BULK_CHUNK_SIZE):
+            for row in chunk:
+                issues[row['issue']] = issues.get(row['issue'], 0) + 1
+            writer.write(chunk)
+        writer.close()
+    for issue, count in issues.items():
+        err_console.print(f'{issue}: {count}', style='dim')
+
+
+def _allocations(
+    parents: list[Network],
+    name: str,
+    factory: Callable[[], Any],
+    store: Optional[SnapshotStore],
+) -> Allocations:
+    from ipams.free import Allocations
+
+    allocations = Allocations(parents)
+    if store is not None:
+        allocations.add_snapshot(store, name)
+        return allocations
+    connector = factory()
+    allocations.add_rows('prefix', connector.iter_prefixes())
+    allocations.add_rows('address', connector.iter_addresses())
+    return allocations
+
+
+@app.command()
+def free(
+    prefixes: list[str] = typer.Argument(..., help='Parent prefixes, e.g. 10.0.0.0/16'),
+    size: Optional[str] = typer.Option(
+        None, '--size', '-s', help='Prefix length of the blocks to find, e.g. /24'
+    ),
+    count: Optional[int] = typer.Option(
+        None,
+        '--count',
+        '-n',
+        help='Blocks to list per parent, by default all, or the next one with --size',
+    ),
+    config: Path = config_option,
+    offline: bool = offline_option,
+    output: Optional[OutputFormat] = output_option,
+):
+    '''
+    Find unallocated blocks in parent prefixes, over the prefixes and
+    addresses of all IPAMs
+    '''
+    from ipams.free import FREE_FIELDS
+
     try:
-        subnet = ip_network(query)
-    except ValueError:
-        subnet = None
+        parents = [ip_network(prefix) for prefix in prefixes]
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    prefixlen = None
+    if size is not None:
+        try:
+            prefixlen = int(size.lstrip('/'))
+        except ValueError:
+            raise typer.BadParameter(f'Invalid prefix length "{size}"')
+        for parent in parents:
+            if not parent.prefixlen <= prefixlen <= parent.max_prefixlen:
+                raise typer.BadParameter(f'/{prefixlen} doesn\'t fit into {parent}')
+        if count is None:
+            count = 1
 
-    for nb in parsed_config.netboxes:
-        if subnet:
-            table = NetBoxConnector(nb).query_network_by_address(subnet)
+    parsed_config = parse_config(config)
+    store = _open_snapshot(parsed_config, offline)
+    tasks = []
+    for kind, backend in _backends(parsed_config):
+        _, factory = _connector_factory(kind, backend)
+        tasks.append(
+            BackendTask(
+                backend.name,
+                partial(_allocations, parents, backend.name, factory, store),
+            )
+        )
+    allocations = None
+    for _, backend_allocations in QueryExecutor(parsed_config.concurrency).run(tasks):
+        if allocations is None:
+            allocations = backend_allocations
         else:
-            table = NetBoxConnector(nb).query_network_by_string(query)
-        if len(table.rows) > 0:
-            console.print(table)
+            allocations.update(backend_allocations)
+    if allocations is None:
+        return
 
-    for phpipam in parsed_config.phpipams:
-        if subnet:
-            table = PhpIpamConnector(phpipam).query_network_by_address(subnet)
+    output = _output_format(output)
+    writer = None
+    if output != OutputFormat.table:
+        writer = RowWriter(output, sys.stdout, fields=FREE_FIELDS)
+    for parent in parents:
+        usage = allocations.usage(parent)
+        if prefixlen is None:
+            free_blocks = f'{len(usage.free)} free ranges'
         else:
-            table = PhpIpamConnector(phpipam).query_network_by_string(query)
-        if len(table.rows) > 0:
+            free_blocks = f'{usage.count(prefixlen)} free /{prefixlen} blocks'
+        utilization = (
+            f'{usage.utilization:.1%} used, {usage.allocated} of '
+            + f'{parent.num_addresses} addresses, {free_blocks}'
+        )
+        rows = islice(usage.rows(prefixlen), count)
+        if writer is None:
+            table = FreeTable(str(parent), utilization)
+            for row in rows:
+                table.add_record(row)
             console.print(table)
+            continue
+        err_console.print(f'{parent}: {utilization}', style='dim')
+        for chunk in chunks(rows, BULK_CHUNK_SIZE):
+            writer.write(chunk)
+    if writer is not None:
+        writer.close()
 
 
 @app.command()
-def subnet(
-    query: str = typer.Argument(..., help='Subnet CIDR to query hosts from'),
-    config: Path = typer.Option(
-        default_config_path, '--config', '-c', help='Path to config file'
+def enrich(
+    files: Optional[list[Path]] = typer.Argument(
+        None, help='Log files to annotate, stdin without'
+    ),
+    fields: str = typer.Option(
+        'hostname,tenant,prefix',
+        '--fields',
+        '-F',
+        help='Comma separated fields to append: hostname, tenant, prefix, vrf, '
+        + 'section, description, backend, link',
+    ),
+    cache_size: int = typer.Option(
+        100_000, '--cache-size', help='Addresses whose annotation is kept'
     ),
+    as_json: bool = typer.Option(
+        False, '--json', help='Write a JSON object per line with the annotations'
+    ),
+    config: Path = config_option,
+    no_cache: bool = no_cache_option,
+    refresh: bool = refresh_option,
+    offline: bool = offline_option,
+    no_daemon: bool = no_daemon_option,
 ):
     '''
-    Query IPAMs for hosts in a subnet
+    Annotate log lines with the IPAM data of the IP addresses in them
     '''
-    cidr = ip_network(query)
+    from ipams.enrich import ENRICH_FIELDS, Enricher
+    from ipams.enrich import enrich as enrich_lines
+
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in ENRICH_FIELDS]
+    if unknown or not selected:
+        raise typer.BadParameter(
+            f'Unknown fields {", ".join(unknown)}, choose from {", ".join(ENRICH_FIELDS)}'
+        )
     parsed_config = parse_config(config)
-    for nb in parsed_config.netboxes:
-        table = NetBoxConnector(nb).query_subnet_by_cidr(cidr)
-        if len(table.rows) > 0:
-            console.print(table)
+    client = _daemon(parsed_config, config, no_daemon, no_cache, refresh, offline)
+    cache = _open_cache(parsed_config, no_cache, refresh)
+    store = _open_snapshot(parsed_config, offline)
+    local = memoize(partial(_bulk_resolver, parsed_config, cache, store))
+
+    def resolve(addresses: list[str]) -> dict[str, list[dict]]:
+        if client is not None:
+            matches = client.lookup(addresses)
+            if matches is not None:
+                return dict(matches)
+        found: dict[str, list[dict]] = {}
+        for chunk in chunks(addresses, BULK_CHUNK_SIZE):
+            found.update(local()([ip_address(address) for address in chunk]))
+        return found
+
+    enricher = Enricher(resolve, selected, cache_size)
+    started = monotonic()
+    if files:
+        for file in files:
+            with open(file, errors='replace') as lines:
+                enrich_lines(lines, enricher, sys.stdout, as_json)
+    else:
+        enrich_lines(sys.stdin, enricher, sys.stdout, as_json)
+    elapsed = monotonic() - started
+    lookups = enricher.cache.hits + enricher.cache.misses
+    err_console.print(
+        f'{enricher.lines} lines, {enricher.lookups} addresses looked up, '
+        + f'{enricher.cache.hits / lookups if lookups else 0:.1%} cache hits, '
+        + f'{enricher.lines / elapsed if elapsed else 0:.0f} lines/s',
+        style='dim',
+    )
+
+
+def _export(
+    export: Export,
+    kind: _backend_kind,
+    name: str,
+    factory: Callable[[], Any],
+    types: list[str],
+    size: int,
+    workers: int,
+) -> tuple[dict[str, int], int]:
+    from ipams.export import export_backend
+
+    return export_backend(export, name, kind, factory(), types, size, workers)
+
+
+@app.command()
+def export(
+    directory: Path = typer.Argument(
+        ..., help='Directory for the part files and the manifest'
+    ),
+    format: str = typer.Option(
+        'jsonl',
+        '--format',
+        '-f',
+        help='Format of the part files: jsonl, csv or parquet',
+    ),
+    types: Optional[list[str]] = typer.Option(
+        None, '--type', '-t', help='Only export prefix or address, both by default'
+    ),
+    backend: Optional[str] = typer.Option(
+        None, '--backend', '-b', help='Only export this backend'
+    ),
+    partition_size: int = typer.Option(
+        50_000, '--partition-size', help='Rows per part file'
+    ),
+    workers: int = typer.Option(
+        4, '--workers', '-w', help='Partitions fetched at once per backend'
+    ),
+    restart: bool = typer.Option(
+        False, '--restart', help='Discard a previous export instead of resuming it'
+    ),
+    config: Path = config_option,
+):
+    '''
+    Export all prefixes and addresses of the IPAMs to part files, partitions
+    are fetched concurrently and a failed export resumes where it stopped
+    '''
+    from ipams.export import EXPORT_FORMATS, EXPORT_TYPES, Export
+
+    if format not in EXPORT_FORMATS:
+        raise typer.BadParameter(f'Choose a format from {", ".join(EXPORT_FORMATS)}')
+    for type in types or []:
+        if type not in EXPORT_TYPES:
+            raise typer.BadParameter(f'Unknown type "{type}"')
+    if format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            err_console.print(
+                'Parquet export needs pyarrow: pip install "ipams[parquet]"'
+            )
+            raise typer.Exit(1)
+
+    parsed_config = parse_config(config)
+    try:
+        target = Export(directory, format, restart)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    started = monotonic()
+    tasks = []
+    for kind, backend_config in _backends(parsed_config):
+        if backend and backend_config.name != backend:
+            continue
+        _, factory = _connector_factory(kind, backend_config, concurrency=workers)
+        tasks.append(
+            BackendTask(
+                backend_config.name,
+                partial(
+                    _export,
+                    target,
+                    kind,
+                    backend_config.name,
+                    factory,
+                    list(types or EXPORT_TYPES),
+                    partition_size,
+                    workers,
+                ),
+            )
+        )
+    # backends fail as a whole if their partitions can't be planned
+    exported = 0
+    failed = 0
+    for task, (rows, failed_partitions) in QueryExecutor(parsed_config.concurrency).run(
+        tasks
+    ):
+        exported += 1
+        failed += failed_partitions
+        console.print(
+            f'Exported "{task.name}": '
+            + ', '.join(f'{count} {type} rows' for type, count in rows.items())
+        )
+    err_console.print(f'Finished in {monotonic() - started:.1f}s', style='dim')
+    if failed or exported < len(tasks):
+        err_console.print(
+            f'{len(tasks) - exported} backends and {failed} partitions failed, '
+            + 'run the export again to resume'
+        )
+        raise typer.Exit(1)
+
+
+@cache_app.command('stats')
+def cache_stats(config: Path = config_option):
+    '''
+    Show entries and size of the response cache per backend
+    '''
+    from ipams.cache import ResponseCache
+
+    parsed_config = parse_config(config)
+    table = Table(title='Response cache', title_justify='left')
+    for column in ('Backend', 'Entries', 'Size', 'Hits', 'Oldest', 'Newest'):
+        table.add_column(column)
+    for stats in ResponseCache(parsed_config.cache).stats():
+        table.add_row(
+            stats['backend'],
+            str(stats['entries']),
+            f'{stats["size"] / 1024:.1f} KiB',
+            str(stats['hits']),
+            str(datetime.fromtimestamp(stats['oldest']).replace(microsecond=0)),
+            str(datetime.fromtimestamp(stats['newest']).replace(microsecond=0)),
+        )
+    console.print(table)
+    console.print(f'Location: {parsed_config.cache.path}')
+
+
+@cache_app.command('clear')
+def cache_clear(
+    config: Path = config_option,
+    backend: Optional[str] = typer.Option(
+        None, '--backend', '-b', help='Only clear entries of this backend'
+    ),
+):
+    '''
+    Remove cached responses
+    '''
+    from ipams.cache import ResponseCache
+
+    parsed_config = parse_config(config)
+    removed = ResponseCache(parsed_config.cache).clear(backend)
+    console.print(f'Removed {removed} cached responses')
 
 
 @app.command()
 def version():
+    import importlib.metadata
+
     console.print(importlib.metadata.version('ipams'))
@@ -1,22 +1,99 @@
+import os
+import pickle
+from hashlib import sha256
+from os import getenv
 from pathlib import Path
+from typing import Optional
 
-import yaml
 from pydantic import BaseModel
 
+from ipams.cache import CacheConfig, default_cache_dir
+from ipams.daemon import ServeConfig
+from ipams.logging import logger
 from ipams.netbox import NetBoxConfig
 from ipams.phpipam import PhpIpamConfig
+from ipams.snapshot import SnapshotConfig
+
+# validated configs are pickled here and reused while the file is unchanged,
+# set IPAMS_CONFIG_CACHE=0 to always parse the file
+default_config_cache_dir = default_cache_dir.joinpath('configs')
+CONFIG_CACHE = getenv('IPAMS_CONFIG_CACHE', '1') != '0'
 
 
 class Config(BaseModel):
     netboxes: list[NetBoxConfig] = []
     phpipams: list[PhpIpamConfig] = []
+    # maximum number of backends queried at the same time
+    concurrency: int = 8
+    # print results in config order instead of as soon as they arrive
+    ordered: bool = False
+    # seconds before a backend query is abandoned, None waits forever
+    query_timeout: Optional[float] = None
+    cache: CacheConfig = CacheConfig()
+    snapshot: SnapshotConfig = SnapshotConfig()
+    serve: ServeConfig = ServeConfig()
 
 
 def parse_config(config: Path) -> Config:
     '''Supports json or yaml config files'''
     if not config.exists():
         raise FileNotFoundError(f'Config file {config} does not exist')
+    if not CONFIG_CACHE:
+        return _parse_config(config)
+    path = default_config_cache_dir.joinpath(
+        sha256(str(config.resolve()).encode()).hexdigest()
+    )
+    stamp = _stamp(config)
+    parsed = _load_cached(path, stamp)
+    if parsed is None:
+        parsed = _parse_config(config)
+        _save_cached(path, stamp, parsed)
+    return parsed
+
+
+def _parse_config(config: Path) -> Config:
     if config.suffix in ['.yaml', '.yml']:
+        import yaml
+
         with open(config) as f:
             return Config.parse_obj(yaml.safe_load(f))
     return Config.parse_file(config)
+
+
+def _stamp(config: Path) -> tuple:
+    '''
+    Changes with the config file and with the ipams sources, so a cached
+    config is never unpickled into models that gained or lost fields
+    '''
+    stat = config.stat()
+    sources = sorted(
+        (source.name, source.stat().st_mtime_ns)
+        for source in Path(__file__).parent.glob('*.py')
+    )
+    return (stat.st_mtime_ns, stat.st_size, tuple(sources))
+
+
+def _load_cached(path: Path, stamp: tuple) -> Optional[Config]:
+    try:
+        cached_stamp, parsed = pickle.loads(path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug(f'Ignoring unreadable config cache {path}: {e}')
+        return None
+    if cached_stamp != stamp or not isinstance(parsed, Config):
+        return None
+    return parsed
+
+
+def _save_cached(path: Path, stamp: tuple, parsed: Config):
+    '''Written atomically and only readable by the user, it contains credentials'''
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        tmp = path.with_suffix('.tmp')
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pickle.dumps((stamp, parsed)))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug(f'Could not cache config in {path}: {e}')
@@ -0,0 +1,118 @@
+import json
+import socket
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+from urllib.parse import urlencode
+
+from pydantic import BaseModel
+
+from ipams.cache import default_cache_dir
+from ipams.logging import logger
+
+if TYPE_CHECKING:
+    from http.client import HTTPResponse
+
+# header naming the config file a client uses, the daemon refuses other configs
+CONFIG_HEADER = 'X-Ipams-Config'
+
+
+class ServeConfig(BaseModel):
+    socket: Path = default_cache_dir.joinpath('ipams.sock')
+    # the HTTP API on 127.0.0.1 is only started with a port
+    port: Optional[int] = None
+    # HTTP clients send the token written here as `Authorization: Bearer <token>`
+    token_file: Path = default_cache_dir.joinpath('ipams.token')
+    # seconds connectors with their sessions and memoized lookups are reused
+    connector_ttl: int = 300
+
+
+class DaemonClient:
+    '''
+    Sends queries to a running `ipams serve` over its unix socket.
+    Every method returns None if no daemon answers for this config, the
+    caller then queries the IPAMs itself.
+    '''
+
+    def __init__(self, config: ServeConfig, config_path: Path):
+        self.config = config
+        self.config_path = config_path.resolve()
+
+    def available(self) -> bool:
+        return self.config.socket.is_socket()
+
+    def query(
+        self,
+        command: str,
+        query: str,
+        ordered: bool = False,
+        include_unassigned: bool = False,
+        limit: Optional[int] = None,
+        first: bool = False,
+        prioritize: bool = False,
+    ) -> Optional[Iterator[tuple[str, str, list[dict]]]]:
+        '''Batches of rows as (backend, ipam, rows)'''
+        params = urlencode(
+            {
+                'q': query,
+                'ordered': int(ordered),
+                'include_unassigned': int(include_unassigned),
+                'limit': limit or '',
+                'first': int(first),
+                'prioritize': int(prioritize),
+            }
+        )
+        response = self._request('GET', f'/{command}?{params}')
+        if response is None:
+            return None
+        return (
+            (message['backend'], message['ipam'], message['rows'])
+            for message in _messages(response)
+        )
+
+    def lookup(
+        self, addresses: Iterable[str]
+    ) -> Optional[Iterator[tuple[str, list[dict]]]]:
+        '''Matches per address, in input order'''
+        body = '\n'.join(addresses).encode()
+        response = self._request('POST', '/ip', body)
+        if response is None:
+            return None
+        return (
+            (message['query'], message['matches']) for message in _messages(response)
+        )
+
+    def _request(
+        self, method: str, path: str, body: Optional[bytes] = None
+    ) -> Optional['HTTPResponse']:
+        from http.client import HTTPConnection
+
+        connection = HTTPConnection('localhost')
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.sock.connect(str(self.config.socket))
+            connection.request(
+                method, path, body, {CONFIG_HEADER: str(self.config_path)}
+            )
+            response = connection.getresponse()
+        except OSError as e:
+            logger.debug(f'No daemon on {self.config.socket}: {e}')
+            connection.close()
+            return None
+        if response.status != 200:
+            logger.info(
+                f'Daemon on {self.config.socket} answered {response.status}: '
+                + response.read().decode(errors='replace')
+            )
+            connection.close()
+            return None
+        return response
+
+
+def _messages(response: 'HTTPResponse') -> Iterator[dict]:
+    '''One JSON document per line, read as the daemon writes them'''
+    try:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        response.close()
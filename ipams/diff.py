@@ -0,0 +1,242 @@
+'''
+Reconciliation of two IPAMs: prefixes and addresses that only one of them
+knows, and matching entries whose hostname or description disagree.
+
+Both sides are encoded as integer key arrays, IPv4 addresses as one 32 bit
+word and IPv6 addresses as two 64 bit words, prefixes with their length as
+an additional key. Set differences and matches come from a single sort of
+both key sets, so millions of entries are compared in seconds.
+'''
+
+import socket
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from ipams.snapshot import SnapshotStore
+
+# columns of the report
+DIFF_FIELDS = ('type', 'address', 'issue', 'left', 'right', 'left_link', 'right_link')
+# fields compared per entry type
+COMPARED = {'address': ('hostname', 'description'), 'prefix': ('description',)}
+
+
+def _pack(text: str) -> tuple[int, bytes, int]:
+    '''Version, 16 byte big endian address and prefix length of "ip[/len]"'''
+    address, _, prefixlen = text.partition('/')
+    if ':' in address:
+        packed = socket.inet_pton(socket.AF_INET6, address)
+        return 6, packed, int(prefixlen) if prefixlen else 128
+    packed = bytes(12) + socket.inet_pton(socket.AF_INET, address)
+    return 4, packed, int(prefixlen) if prefixlen else 32
+
+
+def _unpack(version: int, packed: bytes) -> str:
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class _Entries:
+    '''Entries of one type and IP version while they are collected'''
+
+    def __init__(self) -> None:
+        self.packed: list[bytes] = []
+        self.prefixlens: list[int] = []
+        self.links: list[str] = []
+        self.fields: dict[str, list[str]] = {'hostname': [], 'description': []}
+
+    def add(
+        self, packed: bytes, prefixlen: int, hostname: str, description: str, link: str
+    ):
+        self.packed.append(packed)
+        self.prefixlens.append(prefixlen)
+        self.links.append(link)
+        self.fields['hostname'].append(hostname.strip().lower().rstrip('.'))
+        self.fields['description'].append(description.strip())
+
+
+class Inventory:
+    '''
+    Prefixes and addresses of one backend, grouped by type and IP version.
+    Entries with the same key (e.g. an address in two VRFs) count once.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._entries: dict[tuple[str, int], _Entries] = {}
+
+    def add(
+        self,
+        type: str,
+        version: int,
+        packed: bytes,
+        prefixlen: int,
+        hostname: str = '',
+        description: str = '',
+        link: str = '',
+    ):
+        group = self._entries.get((type, version))
+        if group is None:
+            group = self._entries[(type, version)] = _Entries()
+        group.add(packed, prefixlen, hostname or '', description or '', link or '')
+
+    def add_rows(self, type: str, rows: Iterable[dict]):
+        '''Rows of `iter_prefixes` or `iter_addresses` of a connector'''
+        column = 'prefix' if type == 'prefix' else 'address'
+        for row in rows:
+            version, packed, prefixlen = _pack(row[column])
+            self.add(
+                type,
+                version,
+                packed,
+                prefixlen,
+                row.get('hostname', ''),
+                row.get('description', ''),
+                row.get('link', ''),
+            )
+
+    def add_snapshot(self, store: 'SnapshotStore'):
+        '''Prefixes and addresses of the backend from the local snapshot'''
+        for entry in store.entries(self.name, 'prefix'):
+            self.add('prefix', *entry)
+        for entry in store.entries(self.name, 'address'):
+            self.add('address', *entry)
+
+    def __len__(self) -> int:
+        return sum(len(group.packed) for group in self._entries.values())
+
+    def groups(self) -> set[tuple[str, int]]:
+        return set(self._entries)
+
+    def keys(self, type: str, version: int) -> list[np.ndarray]:
+        '''Key columns of a group, most significant first'''
+        group = self._entries.get((type, version))
+        if group is None:
+            return [np.zeros(0, np.uint64)] * self._width(type, version)
+        words = np.frombuffer(b''.join(group.packed), '>u8').reshape(-1, 2)
+        if version == 4:
+            columns = [words[:, 1].astype(np.uint32)]
+        else:
+            columns = [words[:, 0].astype(np.uint64), words[:, 1].astype(np.uint64)]
+        if type == 'prefix':
+            columns.append(np.array(group.prefixlens, np.uint8))
+        return columns
+
+    @staticmethod
+    def _width(type: str, version: int) -> int:
+        return (1 if version == 4 else 2) + (type == 'prefix')
+
+    def column(self, type: str, version: int, field: str) -> np.ndarray:
+        group = self._entries[(type, version)]
+        values = group.links if field == 'link' else group.fields[field]
+        return np.array(values, dtype=object)
+
+    def label(self, type: str, version: int, index: int) -> str:
+        group = self._entries[(type, version)]
+        address = _unpack(version, group.packed[index])
+        if type == 'prefix':
+            return f'{address}/{group.prefixlens[index]}'
+        return address
+
+
+def _unique(keys: list[np.ndarray]) -> np.ndarray:
+    '''Indexes of the first entry per distinct key, in key order'''
+    if not len(keys[0]):
+        return np.zeros(0, np.intp)
+    order = np.lexsort(keys[::-1])
+    duplicate = np.ones(len(order) - 1, bool)
+    for column in keys:
+        ordered = column[order]
+        duplicate &= ordered[1:] == ordered[:-1]
+    return order[np.concatenate((np.ones(1, bool), ~duplicate))]
+
+
+def join(
+    left: list[np.ndarray], right: list[np.ndarray]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Merge join of two sets of distinct keys given as columns, most
+    significant first. Returns the indexes of keys only in `left`, only in
+    `right`, and the matching (left, right) index pairs, all in key order.
+    '''
+    size = len(left[0])
+    columns = [np.concatenate((a, b)) for a, b in zip(left, right)]
+    side = np.concatenate((np.zeros(size, np.int8), np.ones(len(right[0]), np.int8)))
+    order = np.lexsort((side, *columns[::-1]))
+    same = np.ones(max(len(order) - 1, 0), bool)
+    for column in columns:
+        ordered = column[order]
+        same &= ordered[1:] == ordered[:-1]
+    # keys are distinct per side, equal neighbours are a left and a right entry
+    first = np.flatnonzero(same)
+    matched = np.zeros(len(order), bool)
+    matched[first] = True
+    matched[first + 1] = True
+    unmatched = order[~matched]
+    return (
+        unmatched[unmatched < size],
+        unmatched[unmatched >= size] - size,
+        order[first],
+        order[first + 1] - size,
+    )
+
+
+def diff(left: Inventory, right: Inventory) -> Iterator[dict]:
+    '''
+    Report rows, prefixes first and per IP version: entries missing in one
+    of the backends, then mismatching fields
+    '''
+    groups = left.groups() | right.groups()
+    for type, version in sorted(
+        groups, key=lambda group: (group[0] != 'prefix', group[1])
+    ):
+        left_keys = left.keys(type, version)
+        right_keys = right.keys(type, version)
+        left_index = _unique(left_keys)
+        right_index = _unique(right_keys)
+        only_left, only_right, pairs_left, pairs_right = join(
+            [column[left_index] for column in left_keys],
+            [column[right_index] for column in right_keys],
+        )
+        field = COMPARED[type][0]
+        for inventory, indexes, missing in (
+            (left, left_index[only_left], right),
+            (right, right_index[only_right], left),
+        ):
+            if not len(indexes):
+                continue
+            values = inventory.column(type, version, field)
+            links = inventory.column(type, version, 'link')
+            is_left = inventory is left
+            for index in indexes.tolist():
+                value, link = values[index], links[index]
+                yield {
+                    'type': type,
+                    'address': inventory.label(type, version, index),
+                    'issue': f'missing in {missing.name}',
+                    'left': value if is_left else '',
+                    'right': '' if is_left else value,
+                    'left_link': link if is_left else '',
+                    'right_link': '' if is_left else link,
+                }
+        if not len(pairs_left):
+            continue
+        pairs_left = left_index[pairs_left]
+        pairs_right = right_index[pairs_right]
+        left_links = left.column(type, version, 'link')[pairs_left]
+        right_links = right.column(type, version, 'link')[pairs_right]
+        for field in COMPARED[type]:
+            left_values = left.column(type, version, field)[pairs_left]
+            right_values = right.column(type, version, field)[pairs_right]
+            for pair in np.flatnonzero(left_values != right_values).tolist():
+                yield {
+                    'type': type,
+                    'address': left.label(type, version, int(pairs_left[pair])),
+                    'issue': field,
+                    'left': left_values[pair],
+                    'right': right_values[pair],
+                    'left_link': left_links[pair],
+                    'right_link': right_links[pair],
+                }
@@ -0,0 +1,264 @@
+'''
+Annotation of log lines with what the IPAMs know about their addresses.
+
+Lines flow through a bounded pipeline: a reader thread queues them, batches
+of lines are scanned for addresses, the addresses missing in an LRU cache
+are resolved with one bulk lookup per batch and the annotated lines are
+written. A slow consumer blocks the writer and a full queue the reader, so
+memory stays bounded on endless streams.
+'''
+
+import json
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from ipaddress import ip_address, ip_interface
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TextIO
+
+# fields that can be appended, `prefix` is the network an IPAM records with
+# the address (NetBox addresses carry their prefix length, phpIPAM's don't)
+ENRICH_FIELDS = (
+    'hostname',
+    'tenant',
+    'prefix',
+    'vrf',
+    'section',
+    'description',
+    'backend',
+    'link',
+)
+DEFAULT_FIELDS = ('hostname', 'tenant', 'prefix')
+# lines annotated together, a partial batch is flushed after FLUSH_INTERVAL
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 0.2
+# lines read ahead of the batch being annotated
+QUEUE_SIZE = 10 * BATCH_SIZE
+# addresses whose annotation is kept
+CACHE_SIZE = 100_000
+
+# address candidates, `_address` decides which of them are addresses
+_scanner = re.compile(
+    r'''
+    (?<![\w.])(?=[0-9a-f:])
+    (?:
+        (?:\d{1,3}\.){3}\d{1,3}(?!\w|\.\d)
+        | (?<!:)(?:[0-9a-f]{0,4}:){2,7}
+          (?:(?:\d{1,3}\.){3}\d{1,3}|[0-9a-f]{1,4})?(?![\w:]|\.\d)
+    )
+    ''',
+    re.VERBOSE | re.IGNORECASE,
+)
+# end of the input, or the exception the reader failed with
+_END = object()
+
+
+def _address(candidate: str) -> Optional[str]:
+    '''Normalized address of a candidate, None if it isn't one'''
+    # times and MAC addresses have colons too, but neither "::" nor 7 of them
+    if ':' in candidate and '::' not in candidate and candidate.count(':') != 7:
+        return None
+    try:
+        return str(ip_address(candidate))
+    except ValueError:
+        return None
+
+
+def addresses(
+    line: str, normalize: Callable[[str], Optional[str]] = _address
+) -> list[str]:
+    '''Distinct addresses of a line, in order, `normalize` parses a candidate'''
+    found = []
+    for candidate in _scanner.findall(line):
+        address = normalize(candidate)
+        if address is not None and address not in found:
+            found.append(address)
+    return found
+
+
+def _prefix(match: dict) -> str:
+    address = match.get('address') or ''
+    return str(ip_interface(address).network) if '/' in address else ''
+
+
+def _quote(value: str) -> str:
+    if value and not any(c in value for c in ' "[]='):
+        return value
+    return json.dumps(value)
+
+
+class Annotation(NamedTuple):
+    '''Fields of an address and the text appended for it, rendered once'''
+
+    fields: dict[str, str]
+    tag: str
+
+
+def annotation(address: str, matches: list[dict], fields: Iterable[str]) -> Annotation:
+    '''Fields of an address, from the first match that has each of them'''
+    values: dict[str, str] = {}
+    for field in fields:
+        for match in matches:
+            value = _prefix(match) if field == 'prefix' else match.get(field)
+            if value:
+                values[field] = str(value)
+                break
+    if not values:
+        return Annotation(values, '')
+    pairs = ' '.join(f'{key}={_quote(value)}' for key, value in values.items())
+    return Annotation(values, f'[{address} {pairs}]')
+
+
+# placeholder of an address while it is looked up
+_UNKNOWN = Annotation({}, '')
+
+
+class LRUCache:
+    '''Annotations of the most recently seen addresses'''
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Annotation] = OrderedDict()
+
+    def get(self, address: str) -> Optional[Annotation]:
+        entry = self._entries.get(address)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(address)
+        return entry
+
+    def set(self, address: str, entry: Annotation):
+        self._entries[address] = entry
+        self._entries.move_to_end(address)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+class Enricher:
+    '''
+    Annotates batches of lines, `resolve` looks up many addresses at once
+    and returns the matches of all IPAMs per address
+    '''
+
+    def __init__(
+        self,
+        resolve: Callable[[list[str]], dict[str, list[dict]]],
+        fields: Iterable[str] = DEFAULT_FIELDS,
+        cache_size: int = CACHE_SIZE,
+    ):
+        self.resolve = resolve
+        self.fields = tuple(fields)
+        self.cache = LRUCache(cache_size)
+        # parsed candidates, the same addresses recur in most logs
+        self._address = lru_cache(maxsize=cache_size)(_address)
+        self.lines = 0
+        self.lookups = 0
+
+    def annotate(self, lines: list[str]) -> list[tuple[str, dict[str, Annotation]]]:
+        '''Lines with the annotation of each of their addresses'''
+        found = [addresses(line, self._address) for line in lines]
+        annotations: dict[str, Annotation] = {}
+        missing = []
+        for line_addresses in found:
+            for address in line_addresses:
+                if address in annotations:
+                    continue
+                cached = self.cache.get(address)
+                if cached is None:
+                    missing.append(address)
+                    annotations[address] = _UNKNOWN
+                else:
+                    annotations[address] = cached
+        if missing:
+            self.lookups += len(missing)
+            matches = self.resolve(missing)
+            for address in missing:
+                entry = annotation(address, matches.get(address, []), self.fields)
+                annotations[address] = entry
+                self.cache.set(address, entry)
+        self.lines += len(lines)
+        return [
+            (line, {address: annotations[address] for address in line_addresses})
+            for line, line_addresses in zip(lines, found)
+        ]
+
+
+def format_line(line: str, annotations: dict[str, Annotation]) -> str:
+    '''The line with " [address field=value ...]" per known address'''
+    tags = [entry.tag for entry in annotations.values() if entry.tag]
+    return ' '.join([line, *tags]) if tags else line
+
+
+def format_json(line: str, annotations: dict[str, Annotation]) -> str:
+    return json.dumps(
+        {
+            'line': line,
+            'addresses': {
+                address: entry.fields for address, entry in annotations.items()
+            },
+        }
+    )
+
+
+def batches(lines: Iterable[str]) -> Iterator[list[str]]:
+    '''
+    Lines without line breaks in batches of up to `BATCH_SIZE`, read ahead
+    by a thread. A batch is handed over once `FLUSH_INTERVAL` passed since
+    its first line, so lines of a slow stream are annotated without delay.
+    '''
+    queue: Queue = Queue(QUEUE_SIZE)
+
+    def read():
+        try:
+            for line in lines:
+                queue.put(line.rstrip('\r\n'))
+            queue.put(_END)
+        except Exception as e:
+            queue.put(e)
+
+    Thread(target=read, name='ipams-reader', daemon=True).start()
+    while True:
+        item = queue.get()
+        batch: list[str] = []
+        deadline = monotonic() + FLUSH_INTERVAL
+        while isinstance(item, str):
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                break
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                try:
+                    item = queue.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+        if batch:
+            yield batch
+        if item is _END:
+            return
+        if isinstance(item, Exception):
+            raise item
+
+
+def enrich(
+    lines: Iterable[str],
+    enricher: Enricher,
+    output: TextIO,
+    as_json: bool = False,
+):
+    '''Write every line of `lines` with its annotations to `output`'''
+    render = format_json if as_json else format_line
+    for batch in batches(lines):
+        output.write(
+            ''.join(
+                render(line, annotations) + '\n'
+                for line, annotations in enricher.annotate(batch)
+            )
+        )
+        output.flush()
@@ -0,0 +1,236 @@
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Condition, Event, Thread
+from time import monotonic
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Generic,
+    Iterable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+from ipams.logging import logger
+from ipams.tracing import tracer
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# items per batch when streaming task results
+BATCH_SIZE = 100
+# seconds after which a partial batch is handed over anyway
+FLUSH_INTERVAL = 0.2
+
+
+def _batches(items: Iterable[R], size: int, cancelled: Event) -> Iterator[list[R]]:
+    '''
+    Batches of `items`, once cancelled no further item is requested and the
+    iterator is closed, so a connector stops paging
+    '''
+    iterator = iter(items)
+    batch: list[R] = []
+    flushed = monotonic()
+    try:
+        for item in iterator:
+            if cancelled.is_set():
+                return
+            batch.append(item)
+            if len(batch) >= size or monotonic() - flushed >= FLUSH_INTERVAL:
+                yield batch
+                batch = []
+                flushed = monotonic()
+        if batch:
+            yield batch
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+class BackendTask(Generic[T]):
+    '''
+    A query against a single IPAM backend. With a `delay` it only starts
+    after that many seconds, or once all tasks before it are done.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], T],
+        timeout: Optional[float] = None,
+        delay: float = 0.0,
+    ):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.delay = delay
+
+
+class QueryExecutor:
+    '''
+    Runs backend tasks concurrently and yields their results as soon as they
+    complete, or in task order when `ordered` is set. With `first` only the
+    results of the first task that returns any are yielded.
+
+    Workers are daemon threads, so a backend that exceeds its timeout is
+    reported and abandoned without blocking the command from exiting. Once
+    the results are closed, or the first task is done, the remaining tasks
+    are cancelled: queued ones don't start and streaming ones stop after
+    their current item.
+    '''
+
+    def __init__(
+        self, concurrency: int = 8, ordered: bool = False, first: bool = False
+    ):
+        self.concurrency = max(1, concurrency)
+        self.ordered = ordered and not first
+        self.first = first
+
+    def run(self, tasks: list[BackendTask[T]]) -> Iterator[tuple[BackendTask[T], T]]:
+        yield from self._run(tasks, None)
+
+    def stream(
+        self, tasks: list[BackendTask[Iterable[R]]], batch_size: int = BATCH_SIZE
+    ) -> Generator[tuple[BackendTask[Iterable[R]], list[R]], None, None]:
+        '''
+        Run tasks returning iterables and yield their items in batches while
+        the tasks are still producing. A batch is handed over once it is full
+        or `FLUSH_INTERVAL` passed, so the first rows show up immediately.
+        In ordered mode batches of later tasks are held back until all
+        previous tasks are done.
+        '''
+        yield from self._run(tasks, batch_size)
+
+    def _run(
+        self, tasks: list[BackendTask], batch_size: Optional[int]
+    ) -> Generator[tuple[BackendTask, Any], None, None]:
+        # messages are (task index, payload, error, last message of the task)
+        results: Queue = Queue()
+        started: dict[int, float] = {}
+        semaphore = BoundedSemaphore(self.concurrency)
+        cancelled = Event()
+        # indexes of finished tasks, delayed tasks wait for the earlier ones
+        finished: set[int] = set()
+        progress = Condition()
+
+        def worker(index: int, task: BackendTask):
+            if task.delay:
+                with progress:
+                    progress.wait_for(
+                        lambda: cancelled.is_set() or finished >= set(range(index)),
+                        timeout=task.delay,
+                    )
+            try:
+                with semaphore, tracer.span(task.name):
+                    if cancelled.is_set():
+                        return
+                    started[index] = monotonic()
+                    try:
+                        result = task.func()
+                        if batch_size is not None:
+                            for batch in _batches(result, batch_size, cancelled):
+                                results.put((index, batch, None, False))
+                            result = None
+                        results.put((index, result, None, True))
+                    except Exception as e:
+                        results.put((index, None, e, True))
+            finally:
+                with progress:
+                    finished.add(index)
+                    progress.notify_all()
+
+        for index, task in enumerate(tasks):
+            Thread(
+                target=worker,
+                args=(index, task),
+                name=f'ipams-{task.name}',
+                daemon=True,
+            ).start()
+
+        try:
+            yield from self._collect(tasks, results, started)
+        finally:
+            cancelled.set()
+            with progress:
+                progress.notify_all()
+
+    def _collect(
+        self, tasks: list[BackendTask], results: Queue, started: dict[int, float]
+    ) -> Iterator[tuple[BackendTask, Any]]:
+        pending = set(range(len(tasks)))
+        buffered: dict[int, list] = {}
+        next_index = 0
+        # with `first`, the task whose results are yielded
+        chosen: Optional[int] = None
+        while pending:
+            try:
+                index, payload, error, last = results.get(
+                    timeout=self._wait_time(tasks, pending, started)
+                )
+            except Empty:
+                index, payload, error, last = -1, None, None, False
+
+            if index in pending:
+                if error is not None:
+                    logger.error(f'Query on "{tasks[index].name}" failed: {error}')
+                if self.first and chosen is None and payload:
+                    chosen = index
+                if payload is not None and (not self.first or index == chosen):
+                    buffered.setdefault(index, []).append(payload)
+                if last:
+                    pending.discard(index)
+
+            now = monotonic()
+            for expired in [
+                i for i in pending if self._expired(tasks[i], started, i, now)
+            ]:
+                logger.warning(
+                    f'Query on "{tasks[expired].name}" timed out '
+                    + f'after {tasks[expired].timeout}s'
+                )
+                pending.discard(expired)
+
+            if self.ordered:
+                while next_index < len(tasks):
+                    for payload in buffered.pop(next_index, []):
+                        yield tasks[next_index], payload
+                    if next_index in pending:
+                        break
+                    next_index += 1
+            else:
+                for i in list(buffered):
+                    for payload in buffered.pop(i):
+                        yield tasks[i], payload
+            if chosen is not None and chosen not in pending:
+                return
+
+    @staticmethod
+    def _expired(
+        task: BackendTask, started: dict[int, float], index: int, now: float
+    ) -> bool:
+        if task.timeout is None or index not in started:
+            return False
+        return now - started[index] >= task.timeout
+
+    @staticmethod
+    def _wait_time(
+        tasks: list[BackendTask], pending: set[int], started: dict[int, float]
+    ) -> Optional[float]:
+        '''Seconds until the next running task hits its deadline'''
+        now = monotonic()
+        deadlines = []
+        waiting = False
+        for i in pending:
+            timeout = tasks[i].timeout
+            if timeout is None:
+                continue
+            if i in started:
+                deadlines.append(started[i] + timeout - now)
+            else:
+                waiting = True
+        if not deadlines:
+            # queued tasks get their deadline once a worker slot frees up
+            return 0.5 if waiting else None
+        return max(0.0, min(deadlines + ([0.5] if waiting else [])))
@@ -0,0 +1,259 @@
+'''
+Bulk export of the prefixes and addresses of all IPAMs, e.g. for a data
+warehouse.
+
+Collections are split into partitions, offset ranges of NetBox listings and
+ranges of phpIPAM subnets, which are fetched concurrently. Every partition
+is written to its own part file while its rows arrive and renamed once it is
+complete. The manifest of the export directory records the planned and the
+completed partitions, so a failed export resumes with the missing ones.
+'''
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from threading import Lock
+from typing import Any, Iterable, Optional, TextIO
+
+from ipams.logging import logger
+from ipams.output import OutputFormat, RowWriter, normalize
+from ipams.utils import chunks
+
+# normalized columns of both types, `address` is the prefix of prefixes
+EXPORT_FIELDS = (
+    'backend',
+    'ipam',
+    'type',
+    'id',
+    'address',
+    'vrf',
+    'tenant',
+    'section',
+    'hostname',
+    'device',
+    'site',
+    'description',
+    'link',
+)
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+EXPORT_TYPES = ('prefix', 'address')
+# rows per partition, smaller partitions resume with less work lost
+PARTITION_SIZE = 50_000
+# partitions fetched at once per backend, each prefetches its next pages
+EXPORT_WORKERS = 4
+# rows written at once, and per parquet row group
+WRITE_CHUNK_SIZE = 1000
+ROW_GROUP_SIZE = 50_000
+MANIFEST = 'manifest.json'
+
+
+def export_row(backend: str, ipam: str, type: str, row: dict) -> dict:
+    '''A row of a connector in the export schema'''
+    values = normalize(row, EXPORT_FIELDS)
+    values['backend'] = backend
+    values['ipam'] = ipam
+    values['type'] = type
+    values['id'] = str(row.get('id', ''))
+    values['address'] = row.get(type) or ''
+    return {field: value or '' for field, value in values.items()}
+
+
+class _TextPart:
+    '''JSON lines or CSV part file'''
+
+    def __init__(self, path: Path, output: OutputFormat):
+        self._stream: TextIO = open(path, 'w', newline='')
+        self._writer = RowWriter(output, self._stream, fields=EXPORT_FIELDS)
+
+    def write(self, rows: list[dict]):
+        self._writer.write(rows)
+
+    def close(self):
+        self._writer.close()
+        self._stream.close()
+
+
+class _ParquetPart:
+    '''Parquet part file, all columns are strings'''
+
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._table = pa.Table.from_pydict
+        self._schema = pa.schema([(field, pa.string()) for field in EXPORT_FIELDS])
+        self._writer = pq.ParquetWriter(path, self._schema, compression='zstd')
+        self._rows: list[dict] = []
+
+    def write(self, rows: list[dict]):
+        self._rows += rows
+        if len(self._rows) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        columns = {field: [row[field] for row in self._rows] for field in EXPORT_FIELDS}
+        self._writer.write_table(self._table(columns, self._schema))
+        self._rows = []
+
+    def close(self):
+        if self._rows:
+            self._flush()
+        self._writer.close()
+
+
+class Export:
+    '''
+    An export directory: the partitions planned per backend and type, and
+    the rows of those that are complete
+    '''
+
+    def __init__(self, directory: Path, format: str, restart: bool = False):
+        self.directory = directory
+        self.format = format
+        self.manifest = directory / MANIFEST
+        self.partitions: dict[str, dict] = {}
+        self._lock = Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+        if not self.manifest.exists():
+            return
+        manifest = json.loads(self.manifest.read_text())
+        if restart:
+            for name in manifest['partitions']:
+                self._path(name, manifest['format']).unlink(missing_ok=True)
+            self.manifest.unlink()
+            return
+        if manifest['format'] != format:
+            raise ValueError(
+                f'{directory} holds a {manifest["format"]} export, '
+                + 'pass the same format or --restart'
+            )
+        self.partitions = manifest['partitions']
+
+    def _path(self, name: str, format: Optional[str] = None) -> Path:
+        return self.directory / f'{name}.{format or self.format}'
+
+    def planned(self, backend: str, type: str) -> bool:
+        with self._lock:
+            return any(
+                partition['backend'] == backend and partition['type'] == type
+                for partition in self.partitions.values()
+            )
+
+    def plan(self, backend: str, ipam: str, type: str, partitions: list[dict]):
+        with self._lock:
+            for index, partition in enumerate(partitions):
+                self.partitions[f'{backend}-{type}-{index:05d}'] = {
+                    'backend': backend,
+                    'ipam': ipam,
+                    'type': type,
+                    'partition': partition,
+                    'rows': None,
+                }
+            self._save()
+
+    def pending(self, backend: str, types: Iterable[str]) -> list[str]:
+        with self._lock:
+            return [
+                name
+                for name, partition in self.partitions.items()
+                if partition['backend'] == backend
+                and partition['type'] in types
+                and partition['rows'] is None
+            ]
+
+    def rows(self, backend: str, type: str) -> int:
+        '''Rows of the complete partitions'''
+        with self._lock:
+            return sum(
+                partition['rows'] or 0
+                for partition in self.partitions.values()
+                if partition['backend'] == backend and partition['type'] == type
+            )
+
+    def write(self, name: str, rows: Iterable[dict]) -> int:
+        '''Write the rows of a partition and mark it complete'''
+        with self._lock:
+            partition = self.partitions[name]
+        path = self._path(name)
+        incomplete = path.with_name(path.name + '.partial')
+        part: Any
+        if self.format == 'parquet':
+            part = _ParquetPart(incomplete)
+        else:
+            part = _TextPart(incomplete, OutputFormat(self.format))
+        count = 0
+        try:
+            for chunk in chunks(rows, WRITE_CHUNK_SIZE):
+                part.write(
+                    [
+                        export_row(
+                            partition['backend'],
+                            partition['ipam'],
+                            partition['type'],
+                            row,
+                        )
+                        for row in chunk
+                    ]
+                )
+                count += len(chunk)
+        except BaseException:
+            part.close()
+            incomplete.unlink(missing_ok=True)
+            raise
+        part.close()
+        os.replace(incomplete, path)
+        with self._lock:
+            partition['rows'] = count
+            self._save()
+        return count
+
+    def _save(self):
+        manifest = {'format': self.format, 'partitions': self.partitions}
+        temporary = self.manifest.with_name(MANIFEST + '.partial')
+        temporary.write_text(json.dumps(manifest, indent=1))
+        os.replace(temporary, self.manifest)
+
+
+def export_backend(
+    export: Export,
+    backend: str,
+    ipam: str,
+    connector: Any,
+    types: Iterable[str],
+    size: int = PARTITION_SIZE,
+    workers: int = EXPORT_WORKERS,
+) -> tuple[dict[str, int], int]:
+    '''
+    Plan the partitions of a backend unless a previous run did, then export
+    the pending ones. Returns the exported rows per type and the number of
+    partitions that failed.
+    '''
+    types = tuple(types)
+    for type in types:
+        if not export.planned(backend, type):
+            export.plan(backend, ipam, type, connector.export_partitions(type, size))
+    failed = 0
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix=f'ipams-{backend}'
+    ) as pool:
+        futures = {
+            pool.submit(
+                export.write,
+                name,
+                connector.export_rows(
+                    export.partitions[name]['type'],
+                    export.partitions[name]['partition'],
+                ),
+            ): name
+            for name in export.pending(backend, types)
+        }
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f'Export of "{futures[future]}" failed: {e}')
+                continue
+            logger.debug(f'Exported {rows} rows of "{futures[future]}"')
+    return {type: export.rows(backend, type) for type in types}, failed
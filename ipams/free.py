@@ -0,0 +1,195 @@
+'''
+Free space of parent prefixes, over the prefixes and addresses of all IPAMs.
+
+Allocations are collected as integer intervals, sorted and merged once per
+IP version. Free blocks are computed from the bounds of the gaps between
+them, so the cost depends on the number of allocations and not on the size
+of a parent: an IPv6 /32 is as cheap as an IPv4 /24. VRFs are not told
+apart, an allocation in any VRF uses the space.
+'''
+
+import socket
+from bisect import bisect_left, bisect_right
+from ipaddress import IPv4Network, IPv6Network
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
+
+if TYPE_CHECKING:
+    from ipams.snapshot import SnapshotStore
+
+Network = Union[IPv4Network, IPv6Network]
+
+# columns of the report
+FREE_FIELDS = ('parent', 'prefix', 'addresses')
+
+_bits = {4: 32, 6: 128}
+
+
+def _range(text: str, prefix: bool) -> tuple[int, int, int]:
+    '''
+    Version, first and last address of a prefix, or of an address whose
+    prefix length is that of its interface and is ignored
+    '''
+    address, _, prefixlen = text.partition('/')
+    if ':' in address:
+        version, packed = 6, socket.inet_pton(socket.AF_INET6, address)
+    else:
+        version, packed = 4, socket.inet_pton(socket.AF_INET, address)
+    value = int.from_bytes(packed, 'big')
+    host_bits = _bits[version] - int(prefixlen) if prefix and prefixlen else 0
+    first = value >> host_bits << host_bits
+    return version, first, first + (1 << host_bits) - 1
+
+
+def _format(version: int, first: int, prefixlen: int) -> str:
+    if version == 4:
+        address = socket.inet_ntop(socket.AF_INET, first.to_bytes(4, 'big'))
+    else:
+        address = socket.inet_ntop(socket.AF_INET6, first.to_bytes(16, 'big'))
+    return f'{address}/{prefixlen}'
+
+
+class Usage:
+    '''Allocated addresses and free ranges of a parent prefix'''
+
+    def __init__(
+        self, parent: Network, allocated: int, free: list[tuple[int, int]]
+    ) -> None:
+        self.parent = parent
+        self.allocated = allocated
+        # (first, last) of the gaps between allocations, in address order
+        self.free = free
+
+    @property
+    def utilization(self) -> float:
+        return self.allocated / self.parent.num_addresses
+
+    def blocks(self) -> Iterator[tuple[int, int]]:
+        '''First address and prefix length of the largest aligned free blocks'''
+        bits = _bits[self.parent.version]
+        for first, last in self.free:
+            while first <= last:
+                size = 1 << ((last - first + 1).bit_length() - 1)
+                if first:
+                    size = min(size, first & -first)
+                yield first, bits + 1 - size.bit_length()
+                first += size
+
+    def available(self, prefixlen: int) -> Iterator[tuple[int, int]]:
+        '''Free blocks with the prefix length, the next available one first'''
+        size = 1 << (_bits[self.parent.version] - prefixlen)
+        for first, last in self.free:
+            # first aligned start in the gap
+            start = -(-first // size) * size
+            for block in range(start, last - size + 2, size):
+                yield block, prefixlen
+
+    def rows(self, prefixlen: Optional[int] = None) -> Iterator[dict]:
+        '''
+        Report rows of the free blocks, all blocks with the prefix length or
+        the largest ones without
+        '''
+        version = self.parent.version
+        parent = str(self.parent)
+        blocks = self.blocks() if prefixlen is None else self.available(prefixlen)
+        for first, length in blocks:
+            yield {
+                'parent': parent,
+                'prefix': _format(version, first, length),
+                'addresses': 1 << (_bits[version] - length),
+            }
+
+    def count(self, prefixlen: int) -> int:
+        '''Number of free blocks with the prefix length'''
+        size = 1 << (_bits[self.parent.version] - prefixlen)
+        return sum(
+            max((last + 1) // size - -(-first // size), 0) for first, last in self.free
+        )
+
+
+class Allocations:
+    '''
+    Prefixes and addresses inside a set of parent prefixes. A prefix equal
+    to a parent doesn't allocate space in it, one inside it allocates all of
+    its addresses.
+    '''
+
+    def __init__(self, parents: list[Network]) -> None:
+        self._parents = [
+            (
+                parent.version,
+                int(parent.network_address),
+                int(parent.broadcast_address),
+            )
+            for parent in parents
+        ]
+        # version -> (first, last) of all allocations
+        self._ranges: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        self._sorted: dict[int, tuple[list[int], list[int]]] = {}
+
+    def add(self, version: int, first: int, last: int):
+        for parent_version, parent_first, parent_last in self._parents:
+            if (
+                version == parent_version
+                and parent_first <= first <= last <= parent_last
+            ):
+                self._ranges[version].append((first, last))
+                self._sorted.pop(version, None)
+                return
+
+    def add_rows(self, type: str, rows: Iterable[dict]):
+        '''Rows of `iter_prefixes` or `iter_addresses` of a connector'''
+        prefix = type == 'prefix'
+        column = 'prefix' if prefix else 'address'
+        for row in rows:
+            self.add(*_range(row[column], prefix))
+
+    def add_snapshot(self, store: 'SnapshotStore', backend: str):
+        '''Prefixes and addresses of a backend from the local snapshot'''
+        for version, start, prefixlen, *_ in store.entries(backend, 'prefix'):
+            first = int.from_bytes(start, 'big')
+            self.add(version, first, first + (1 << (_bits[version] - prefixlen)) - 1)
+        for version, address, *_ in store.entries(backend, 'address'):
+            first = int.from_bytes(address, 'big')
+            self.add(version, first, first)
+
+    def update(self, other: 'Allocations'):
+        '''Add the allocations of another backend'''
+        for version, ranges in other._ranges.items():
+            self._ranges[version].extend(ranges)
+            self._sorted.pop(version, None)
+
+    def __len__(self) -> int:
+        return sum(len(ranges) for ranges in self._ranges.values())
+
+    def _ordered(self, version: int) -> tuple[list[int], list[int]]:
+        '''Firsts and lasts of the allocations, ordered by first'''
+        if version not in self._sorted:
+            ranges = sorted(self._ranges[version])
+            self._sorted[version] = (
+                [first for first, _ in ranges],
+                [last for _, last in ranges],
+            )
+        return self._sorted[version]
+
+    def usage(self, parent: Network) -> Usage:
+        firsts, lasts = self._ordered(parent.version)
+        parent_first = int(parent.network_address)
+        parent_last = int(parent.broadcast_address)
+        allocated = 0
+        free = []
+        # next address not covered by an allocation
+        position = parent_first
+        for index in range(
+            bisect_left(firsts, parent_first), bisect_right(firsts, parent_last)
+        ):
+            first, last = firsts[index], lasts[index]
+            if last > parent_last or (first, last) == (parent_first, parent_last):
+                continue
+            if first > position:
+                free.append((position, first - 1))
+            if last >= position:
+                allocated += last + 1 - max(first, position)
+                position = last + 1
+        if position <= parent_last:
+            free.append((position, parent_last))
+        return Usage(parent, allocated, free)
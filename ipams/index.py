@@ -0,0 +1,92 @@
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_network
+from typing import Callable, Generic, Iterator, TypeVar, Union
+
+T = TypeVar('T')
+
+_bits = {4: 32, 6: 128}
+_networks: dict[int, Callable[..., Union[IPv4Network, IPv6Network]]] = {
+    4: IPv4Network,
+    6: IPv6Network,
+}
+
+
+def encode(address: Union[IPv4Address, IPv6Address]) -> bytes:
+    '''Fixed width big endian encoding, byte order equals numeric order'''
+    return int(address).to_bytes(16, 'big')
+
+
+def decode(value: bytes, version: int) -> Union[IPv4Address, IPv6Address]:
+    if version == 4:
+        return IPv4Address(int.from_bytes(value, 'big'))
+    return IPv6Address(int.from_bytes(value, 'big'))
+
+
+def network_range(network: Union[IPv4Network, IPv6Network]) -> tuple[bytes, bytes]:
+    '''First and last address of a network, encoded'''
+    return encode(network.network_address), encode(network.broadcast_address)
+
+
+class PrefixIndex(Generic[T]):
+    '''
+    Longest prefix match over integer encoded networks.
+
+    Prefixes are kept in one hash table per prefix length, a lookup masks
+    the address for each length present (longest first), so it costs at
+    most 33 (IPv4) or 129 (IPv6) dict lookups regardless of the table size.
+    '''
+
+    def __init__(self) -> None:
+        # version -> prefix length -> network as int -> items
+        self._tables: dict[int, dict[int, dict[int, list[T]]]] = {4: {}, 6: {}}
+        self._lengths: dict[int, list[int]] = {4: [], 6: []}
+
+    def __len__(self) -> int:
+        return sum(
+            len(items)
+            for tables in self._tables.values()
+            for table in tables.values()
+            for items in table.values()
+        )
+
+    def add(self, network: Union[IPv4Network, IPv6Network], item: T):
+        tables = self._tables[network.version]
+        if network.prefixlen not in tables:
+            tables[network.prefixlen] = {}
+            self._lengths[network.version] = sorted(tables, reverse=True)
+        table = tables[network.prefixlen]
+        table.setdefault(int(network.network_address), []).append(item)
+
+    def remove(self, network: Union[IPv4Network, IPv6Network], item: T):
+        table = self._tables[network.version].get(network.prefixlen, {})
+        items = table.get(int(network.network_address), [])
+        if item in items:
+            items.remove(item)
+        if not items:
+            table.pop(int(network.network_address), None)
+
+    def covering(
+        self, network: Union[IPv4Network, IPv6Network, IPv4Address, IPv6Address]
+    ) -> Iterator[tuple[Union[IPv4Network, IPv6Network], T]]:
+        '''All prefixes containing `network`, longest prefix first'''
+        if isinstance(network, (IPv4Address, IPv6Address)):
+            network = ip_network(network)
+        bits = _bits[network.version]
+        value = int(network.network_address)
+        tables = self._tables[network.version]
+        for length in self._lengths[network.version]:
+            if length > network.prefixlen:
+                continue
+            masked = value & (((1 << length) - 1) << (bits - length))
+            for item in tables[length].get(masked, []):
+                yield _networks[network.version]((masked, length)), item
+
+    def longest_match(
+        self, address: Union[IPv4Address, IPv6Address]
+    ) -> list[tuple[Union[IPv4Network, IPv6Network], T]]:
+        '''Items of the most specific prefix containing `address`'''
+        matches: list[tuple[Union[IPv4Network, IPv6Network], T]] = []
+        for network, item in self.covering(address):
+            if matches and network != matches[0][0]:
+                break
+            matches.append((network, item))
+        return matches
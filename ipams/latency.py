@@ -0,0 +1,111 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from ipams.cache import default_cache_dir
+from ipams.logging import logger
+
+T = TypeVar('T')
+
+default_latency_path = default_cache_dir.joinpath('latencies.json')
+# weight of a new measurement in the moving average of a backend
+SMOOTHING = 0.3
+
+
+class Latencies:
+    '''
+    Moving average of the seconds each backend took to answer a query,
+    persisted so that later invocations can query the fastest backends
+    first. Backends without measurements have no rank, they are started
+    right away so that they get one.
+    '''
+
+    def __init__(self, path: Path = default_latency_path):
+        self.path = path
+        self._lock = Lock()
+        self._seconds: Optional[dict[str, float]] = None
+        self._changed = False
+
+    def get(self, name: str) -> Optional[float]:
+        with self._lock:
+            return self._load().get(name)
+
+    def record(self, name: str, seconds: float, lower_bound: bool = False):
+        '''
+        Add a measurement, a `lower_bound` of a query that didn't finish only
+        raises the average
+        '''
+        with self._lock:
+            seconds_by_name = self._load()
+            previous = seconds_by_name.get(name)
+            if lower_bound and previous is not None and seconds <= previous:
+                return
+            if previous is not None:
+                seconds = previous + SMOOTHING * (seconds - previous)
+            seconds_by_name[name] = round(seconds, 4)
+            self._changed = True
+
+    def timed(
+        self,
+        name: str,
+        query: Callable[[], Iterable[T]],
+        running: Optional[dict[object, tuple[str, float]]] = None,
+    ) -> Iterator[T]:
+        '''
+        Rows of a query of a backend, its duration is recorded once all of
+        them are consumed. Queries that fail, are cancelled or lose a race
+        took at least as long as they ran, that is recorded as lower bound.
+        While the query runs it is listed in `running`, see `abandon`.
+        '''
+        started = monotonic()
+        key = object()
+        running = {} if running is None else running
+        running[key] = (name, started)
+        complete = False
+        try:
+            yield from query()
+            complete = True
+        finally:
+            if running.pop(key, None):
+                self.record(name, monotonic() - started, lower_bound=not complete)
+
+    def abandon(self, running: dict[object, tuple[str, float]]):
+        '''
+        Record the queries still running as lower bounds, they are abandoned
+        while blocked in a request and would not record anything themselves
+        '''
+        now = monotonic()
+        for key in list(running):
+            entry = running.pop(key, None)
+            if entry:
+                self.record(entry[0], now - entry[1], lower_bound=True)
+
+    def _load(self) -> dict[str, float]:
+        if self._seconds is None:
+            try:
+                self._seconds = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                self._seconds = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring unreadable latencies "{self.path}": {e}')
+                self._seconds = {}
+        return self._seconds
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            self._changed = False
+            try:
+                self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                temporary = self.path.with_suffix('.tmp')
+                temporary.write_text(json.dumps(self._seconds))
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logger.debug(f'Could not save latencies in {self.path}: {e}')
+
+
+latencies = Latencies()
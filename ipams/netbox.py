@@ -1,15 +1,62 @@
-from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_interface
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
 
 from pydantic import BaseModel
-from pynetbox.core.api import Api
 
-from ipams.output import (
-    NetBoxHostTable,
-    NetBoxIPTable,
-    NetBoxNetworkTable,
-    NetBoxSubnetTable,
-)
+from ipams.snapshot import Changes
+from ipams.tracing import tracer
+from ipams.utils import chunks, prefetched
+
+# pynetbox and requests are imported when a connector is built, the config
+# model is needed to parse every config file
+if TYPE_CHECKING:
+    from pynetbox.core.endpoint import Endpoint
+
+    from ipams.cache import ResponseCache
+
+# records per page, following pages are fetched while a page is consumed.
+# NetBox caps it at its MAX_PAGE_SIZE, 1000 by default
+PAGE_SIZE = 1000
+PREFETCH_PAGES = 4
+# number of device ids resolved per bulk request
+DEVICE_CHUNK_SIZE = 100
+# number of IP addresses whose devices are resolved together while syncing
+SNAPSHOT_CHUNK_SIZE = 1000
+# number of addresses per multi-value `address` filter in bulk lookups
+ADDRESS_CHUNK_SIZE = 100
+# subnets are split into prefixes of this many addresses, fetched in parallel
+SUBNET_CHUNK_ADDRESSES = 1024
+# but into no more prefixes than this, larger subnets get larger chunks
+MAX_SUBNET_CHUNKS = 256
+PREFETCH_SUBNET_CHUNKS = 4
+# a chunk is fetched in a single page if NetBox's MAX_PAGE_SIZE allows it
+SUBNET_PAGE_SIZE = 1000
+# only the fields of the output are requested, NetBox before 4.0 ignores this
+# and returns whole objects. Nested objects are always in brief format.
+IP_FIELDS = 'id,address,vrf,tenant,dns_name,description'
+ASSIGNED_IP_FIELDS = 'id,address,tenant,assigned_object'
+PREFIX_FIELDS = 'id,prefix,vrf,tenant,description'
+DEVICE_FIELDS = 'id,name,site,tenant,primary_ip,primary_ip4'
+DEVICE_SUMMARY_FIELDS = 'id,name,site,tenant'
+# plus the update time tracked while syncing
+SNAPSHOT_FIELDS = ',last_updated'
+
+# IPs with the fields of device rows, filters as of NetBox 4.0 to 4.2
+GRAPHQL_ADDRESSES = """
+query ($filters: IPAddressFilter, $pagination: OffsetPaginationInput) {
+  ip_address_list(filters: $filters, pagination: $pagination) {
+    id
+    address
+    tenant { name }
+    assigned_object {
+      ... on InterfaceType {
+        device { id name site { name } tenant { name } }
+      }
+    }
+  }
+}
+"""
 
 
 class NetBoxConfig(BaseModel):
@@ -18,102 +65,493 @@ class NetBoxConfig(BaseModel):
     token: str
     threading: bool = True
     verify_ssl: bool = True
+    # fetch IPs with their device in one GraphQL request per page instead of
+    # resolving the devices with REST requests
+    graphql: bool = False
+    query_timeout: Optional[float] = None
+    # seconds to connect and to wait for data of a single request
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    # attempts after the first for idempotent requests that failed
+    retries: int = 2
+    # requests per second, None for no limit
+    rate_limit: Optional[float] = None
+    # records per page, NetBox returns no more than its MAX_PAGE_SIZE
+    page_size: int = PAGE_SIZE
+    cache_ttl: Optional[int] = None
+    cache_ttls: dict[str, int] = {}
 
 
 class NetBoxConnector:
-    def __init__(self, config: NetBoxConfig):
+    def __init__(
+        self,
+        config: NetBoxConfig,
+        cache: Optional['ResponseCache'] = None,
+        concurrency: int = 1,
+    ):
+        from pynetbox.core.api import Api
+
+        from ipams.transport import mount_transport
+
         self.name = config.name
         self.url = config.url
+        self.token = config.token
+        self.graphql = config.graphql
         self.conn = Api(
             config.url,
             token=config.token,
             threading=config.threading,
         )
+        mount_transport(
+            self.conn.http_session,
+            config,
+            self.conn.base_url,
+            cache,
+            # queries sharing the connector each prefetch pages
+            pool_size=max(concurrency, 1) * PREFETCH_SUBNET_CHUNKS * PREFETCH_PAGES,
+        )
+        tracer.instrument(self.conn.http_session, config.name, self.conn.base_url)
+        self.threading = config.threading
+        self.page_size = config.page_size
+        self._devices: dict[int, dict] = {}
 
-    def query_ip(self, ip: Union[IPv4Address, IPv6Address]) -> NetBoxIPTable:
+    def query_ip(self, ip: Union[IPv4Address, IPv6Address]) -> Iterator[dict]:
         """Query NetBox for IP address"""
-        results = NetBoxIPTable(self.name)
-        for q_ip in self.conn.ipam.ip_addresses.filter(address=str(ip)):
-            results.add_row(
-                vrf=q_ip.vrf.name if q_ip.vrf else '',
-                tenant=q_ip.tenant.name if q_ip.tenant else '',
-                address=str(q_ip.address),
-                hostname=str(q_ip.dns_name),
-                description=str(q_ip.description),
-                link=f"{self.url.rstrip('/')}/ipam/ip-addresses/{q_ip.id}/",
+        for q_ip in self._paged(
+            self.conn.ipam.ip_addresses, address=str(ip), fields=IP_FIELDS
+        ):
+            yield {
+                'vrf': q_ip.vrf.name if q_ip.vrf else '',
+                'tenant': q_ip.tenant.name if q_ip.tenant else '',
+                'address': str(q_ip.address),
+                'hostname': str(q_ip.dns_name),
+                'description': str(q_ip.description),
+                'link': f"{self.url.rstrip('/')}/ipam/ip-addresses/{q_ip.id}/",
+            }
+
+    def query_ips(
+        self, ips: list[Union[IPv4Address, IPv6Address]]
+    ) -> dict[str, list[dict]]:
+        """Look up many IP addresses with a few multi-value `address` filters"""
+        found: dict[str, list[dict]] = {str(ip): [] for ip in ips}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for records in pool.map(
+                self._filter_addresses, chunks(found, ADDRESS_CHUNK_SIZE)
+            ):
+                for record in records:
+                    ip = str(ip_interface(record['address']).ip)
+                    if ip in found:
+                        found[ip].append(record)
+        return found
+
+    def _filter_addresses(self, addresses: list[str]) -> list[dict]:
+        return [
+            {
+                'address': str(q_ip.address),
+                'hostname': str(q_ip.dns_name),
+                'vrf': q_ip.vrf.name if q_ip.vrf else '',
+                'tenant': q_ip.tenant.name if q_ip.tenant else '',
+                'description': str(q_ip.description),
+                'link': f"{self.url.rstrip('/')}/ipam/ip-addresses/{q_ip.id}/",
+            }
+            for q_ip in self.conn.ipam.ip_addresses.filter(
+                address=addresses, fields=IP_FIELDS
             )
-        return results
+        ]
 
-    def query_host_by_ip(self, ip: Union[IPv4Address, IPv6Address]) -> NetBoxHostTable:
-        results = NetBoxHostTable(self.name)
-        for q_ip in self.conn.ipam.ip_addresses.filter(
-            q=str(ip), assigned_to_interface=True
-        ):
-            if q_ip.assigned_object and q_ip.assigned_object.device:
-                device = self.conn.dcim.devices.get(id=q_ip.assigned_object.device.id)
-                if device:
-                    results.add_row(
-                        tenant=device.tenant.name if device.tenant else '',
-                        site=device.site.name if device.site else '',
-                        device=device.name,
-                        address=str(q_ip.address),
-                        link=f"{self.url.rstrip('/')}/dcim/devices/{device.id}/",
-                    )
-        return results
-
-    def query_host_by_name(self, name: str) -> NetBoxHostTable:
-        results = NetBoxHostTable(self.name)
-        for device in self.conn.dcim.devices.filter(q=name):
-            results.add_row(
-                tenant=device.tenant.name if device.tenant else '',
-                site=device.site.name if device.site else '',
-                device=device.name,
-                address=str(device.primary_ip.address if device.primary_ip4 else ''),
-                link=f"{self.url.rstrip('/')}/dcim/devices/{device.id}/",
+    def query_host_by_ip(self, ip: Union[IPv4Address, IPv6Address]) -> Iterator[dict]:
+        """
+        Devices with the IP, REST searches for IPs starting with `ip`, GraphQL
+        has no such search and matches the address exactly
+        """
+        if self.graphql:
+            ip_records = self._graphql_addresses(
+                address=[str(ip)], assigned_to_interface=True
             )
-        return results
+        else:
+            ip_records = self._paged(
+                self.conn.ipam.ip_addresses,
+                raw=True,
+                q=str(ip),
+                assigned_to_interface=True,
+                fields=ASSIGNED_IP_FIELDS,
+            )
+        yield from self._device_rows(ip_records)
+
+    def query_host_by_name(self, name: str) -> Iterator[dict]:
+        for device in self._paged(self.conn.dcim.devices, q=name, fields=DEVICE_FIELDS):
+            yield {
+                'tenant': device.tenant.name if device.tenant else '',
+                'site': device.site.name if device.site else '',
+                'device': device.name,
+                'address': str(device.primary_ip.address if device.primary_ip4 else ''),
+                'link': f"{self.url.rstrip('/')}/dcim/devices/{device.id}/",
+            }
 
     def query_network_by_address(
         self, network: Union[IPv4Network, IPv6Network]
-    ) -> NetBoxNetworkTable:
-        results = NetBoxNetworkTable(self.name)
-        for q_network in self.conn.ipam.prefixes.filter(q=network.compressed):
-            results.add_row(
-                network=str(q_network.prefix),
-                vrf=q_network.vrf.name if q_network.vrf else '',
-                tenant=q_network.tenant.name if q_network.tenant else '',
-                description=str(q_network.description),
-                link=f"{self.url.rstrip('/')}/ipam/prefixes/{q_network.id}/",
+    ) -> Iterator[dict]:
+        for q_network in self._paged(
+            self.conn.ipam.prefixes, q=network.compressed, fields=PREFIX_FIELDS
+        ):
+            yield self._network_row(q_network)
+
+    def query_network_by_string(self, query: str) -> Iterator[dict]:
+        for q_network in self._paged(
+            self.conn.ipam.prefixes, q=query, fields=PREFIX_FIELDS
+        ):
+            yield self._network_row(q_network)
+
+    def query_subnet_by_cidr(
+        self, cidr: IPv4Network | IPv6Network, include_unassigned: bool = False
+    ) -> Iterator[dict]:
+        """
+        IPs in `cidr` with their device, IPs without an interface only with
+        `include_unassigned`. Large subnets are fetched in parallel chunks,
+        in address order and with a bounded number of chunks in memory.
+        """
+        filters = {} if include_unassigned else {'assigned_to_interface': True}
+
+        def fetch(chunk: IPv4Network | IPv6Network) -> list[dict]:
+            if self.graphql:
+                return list(
+                    self._graphql_addresses(
+                        SUBNET_PAGE_SIZE, parent=[chunk.compressed], **filters
+                    )
+                )
+            return list(
+                self._paged(
+                    self.conn.ipam.ip_addresses,
+                    page_size=SUBNET_PAGE_SIZE,
+                    raw=True,
+                    parent=chunk.compressed,
+                    fields=ASSIGNED_IP_FIELDS,
+                    **filters,
+                )
             )
-        return results
-
-    def query_network_by_string(self, query: str) -> NetBoxNetworkTable:
-        results = NetBoxNetworkTable(self.name)
-        for q_network in self.conn.ipam.prefixes.filter(q=query):
-            results.add_row(
-                network=str(q_network.prefix),
-                vrf=q_network.vrf.name if q_network.vrf else '',
-                tenant=q_network.tenant.name if q_network.tenant else '',
-                description=str(q_network.description),
-                link=f"{self.url.rstrip('/')}/ipam/prefixes/{q_network.id}/",
+
+        pages = prefetched(
+            fetch,
+            self._cidr_chunks(cidr),
+            PREFETCH_SUBNET_CHUNKS if self.threading else 1,
+        )
+        ip_records = (q_ip for page in pages for q_ip in page)
+        yield from self._device_rows(ip_records, include_unassigned, SUBNET_PAGE_SIZE)
+
+    @staticmethod
+    def _cidr_chunks(
+        cidr: IPv4Network | IPv6Network,
+    ) -> Iterator[IPv4Network | IPv6Network]:
+        chunk_bits = SUBNET_CHUNK_ADDRESSES.bit_length() - 1
+        max_split_bits = MAX_SUBNET_CHUNKS.bit_length() - 1
+        prefixlen = min(
+            cidr.max_prefixlen - chunk_bits, cidr.prefixlen + max_split_bits
+        )
+        return cidr.subnets(new_prefix=max(cidr.prefixlen, prefixlen))
+
+    def _network_row(self, q_network) -> dict:
+        return {
+            'network': str(q_network.prefix),
+            'vrf': q_network.vrf.name if q_network.vrf else '',
+            'tenant': q_network.tenant.name if q_network.tenant else '',
+            'description': str(q_network.description),
+            'link': f"{self.url.rstrip('/')}/ipam/prefixes/{q_network.id}/",
+        }
+
+    def _paged(
+        self,
+        endpoint: 'Endpoint',
+        page_size: Optional[int] = None,
+        raw: bool = False,
+        **filters,
+    ) -> Iterator:
+        """
+        Records of all pages of a filter. Unlike pynetbox, which fetches all
+        pages before returning the first record, the following pages are
+        fetched in the background while the current one is consumed.
+        With `raw` the JSON objects are returned instead of pynetbox records,
+        building records costs more CPU than the requests for large listings.
+        """
+
+        size = page_size or self.page_size
+
+        def fetch(offset: int) -> list:
+            records = endpoint.filter(
+                limit=min(size, end - offset), offset=offset, **filters
             )
-        return results
+            return list(records.response if raw else records)
 
-    def query_subnet_by_cidr(
-        self, cidr: IPv4Network | IPv6Network
-    ) -> NetBoxSubnetTable:
-        results = NetBoxSubnetTable(self.name)
-        for q_ip in self.conn.ipam.ip_addresses.filter(
-            parent=cidr.compressed, assigned_to_interface=True
+        first = endpoint.filter(limit=size, offset=0, **filters)
+        records = list(first.response if raw else first)
+        end = first.request.count
+        if records and len(records) < min(size, end):
+            # NetBox returns at most MAX_PAGE_SIZE records per page
+            size = len(records)
+        pages = prefetched(
+            fetch,
+            range(size, end, size),
+            PREFETCH_PAGES if self.threading else 1,
+        )
+        yield from records
+        for page in pages:
+            yield from page
+
+    def _graphql_addresses(self, page_size: int = PAGE_SIZE, **filters) -> Iterator:
+        """
+        IP records with their device like raw REST records, a request per
+        page. GraphQL lists have no count, pages are fetched until one is short.
+        """
+        offset = 0
+        while True:
+            page = self._graphql(
+                GRAPHQL_ADDRESSES,
+                {
+                    'filters': filters,
+                    'pagination': {'offset': offset, 'limit': page_size},
+                },
+            )['ip_address_list']
+            for q_ip in page:
+                q_ip['id'] = int(q_ip['id'])
+                device = (q_ip.get('assigned_object') or {}).get('device')
+                if device:
+                    device['id'] = int(device['id'])
+                yield q_ip
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def _graphql(self, query: str, variables: dict) -> dict:
+        """Data of a GraphQL query, errors are raised like failed REST requests"""
+        from pynetbox.core.query import RequestError
+
+        response = self.conn.http_session.post(
+            f"{self.url.rstrip('/')}/graphql/",
+            json={'query': query, 'variables': variables},
+            headers={
+                'Authorization': f'Token {self.token}',
+                'Accept': 'application/json',
+            },
+        )
+        if not response.ok:
+            raise RequestError(response)
+        result = response.json()
+        if result.get('errors'):
+            raise ValueError(f"GraphQL query failed: {result['errors'][0]['message']}")
+        return result['data']
+
+    def iter_prefixes(
+        self, changes: Optional[Changes] = None, **filters
+    ) -> Iterator[dict]:
+        """Prefixes for the local snapshot, `changes` tracks the newest update"""
+        for q_network in self._paged(
+            self.conn.ipam.prefixes,
+            raw=True,
+            fields=PREFIX_FIELDS + SNAPSHOT_FIELDS,
+            **filters,
         ):
-            if q_ip.assigned_object and q_ip.assigned_object.device:
-                device = self.conn.dcim.devices.get(id=q_ip.assigned_object.device.id)
+            if changes:
+                changes.track(q_network.get('last_updated'))
+            yield {
+                'id': q_network['id'],
+                'prefix': q_network['prefix'],
+                'vrf': (q_network.get('vrf') or {}).get('name', ''),
+                'tenant': (q_network.get('tenant') or {}).get('name', ''),
+                'description': q_network.get('description') or '',
+                'link': f"{self.url.rstrip('/')}/ipam/prefixes/{q_network['id']}/",
+            }
+
+    def iter_addresses(
+        self, changes: Optional[Changes] = None, **filters
+    ) -> Iterator[dict]:
+        """
+        IP addresses with their device for the local snapshot. Raw records
+        are used, building pynetbox records would take longer than the
+        requests and hold the GIL while other pages are processed.
+        """
+        records = self._paged(
+            self.conn.ipam.ip_addresses,
+            raw=True,
+            fields=f'{IP_FIELDS},assigned_object{SNAPSHOT_FIELDS}',
+            **filters,
+        )
+
+        def resolve(chunk: list) -> tuple[list, dict[int, dict]]:
+            assigned = [
+                (q_ip, (q_ip.get('assigned_object') or {}).get('device'))
+                for q_ip in chunk
+            ]
+            return assigned, self._get_devices(
+                [nested for _, nested in assigned if nested]
+            )
+
+        # the devices of the next chunks are looked up while rows are consumed
+        for assigned, devices in prefetched(
+            resolve,
+            chunks(records, SNAPSHOT_CHUNK_SIZE),
+            PREFETCH_PAGES if self.threading else 1,
+        ):
+            for q_ip, nested in assigned:
+                if changes:
+                    changes.track(q_ip.get('last_updated'))
+                device = devices.get(nested['id'], {}) if nested else {}
+                yield {
+                    'id': q_ip['id'],
+                    'address': q_ip['address'],
+                    'hostname': q_ip.get('dns_name') or '',
+                    'vrf': (q_ip.get('vrf') or {}).get('name', ''),
+                    'tenant': (q_ip.get('tenant') or {}).get('name', ''),
+                    'description': q_ip.get('description') or '',
+                    'link': f"{self.url.rstrip('/')}/ipam/ip-addresses/{q_ip['id']}/",
+                    'device': device.get('name', ''),
+                    'site': device.get('site', ''),
+                    'device_tenant': device.get('tenant', ''),
+                    'device_link': (
+                        f"{self.url.rstrip('/')}/dcim/devices/{device['id']}/"
+                        if device
+                        else ''
+                    ),
+                }
+
+    def export_partitions(self, type: str, size: int) -> list[dict]:
+        """
+        Id ranges of about `size` prefixes or addresses. The ranges don't
+        shift when objects are added or deleted before an export resumes,
+        the last one is open so objects created meanwhile are exported too.
+        """
+        endpoint = (
+            self.conn.ipam.prefixes if type == 'prefix' else self.conn.ipam.ip_addresses
+        )
+
+        def boundary(offset: int) -> int:
+            page = endpoint.filter(limit=1, offset=offset, ordering='id', fields='id')
+            records = list(page.response)
+            return records[0]['id'] if records else 0
+
+        # the first id of every range after the first one
+        starts = list(
+            prefetched(
+                boundary,
+                range(size, endpoint.count(), size),
+                PREFETCH_PAGES if self.threading else 1,
+            )
+        )
+        lower: list[Optional[int]] = [None, *starts]
+        upper: list[Optional[int]] = [*starts, None]
+        return [
+            {
+                **({'id__gte': first} if first is not None else {}),
+                **({'id__lt': last} if last is not None else {}),
+            }
+            for first, last in zip(lower, upper)
+        ]
+
+    def export_rows(self, type: str, partition: dict) -> Iterator[dict]:
+        """Rows of a partition of `export_partitions`"""
+        rows = self.iter_prefixes if type == 'prefix' else self.iter_addresses
+        return rows(ordering='id', **partition)
+
+    def changes_since(self, high_water: str) -> Changes:
+        """Prefixes and addresses updated or deleted since `high_water`"""
+        changes = Changes(high_water)
+        changes.prefixes = list(
+            self.iter_prefixes(changes, last_updated__gte=high_water)
+        )
+        changes.addresses = list(
+            self.iter_addresses(changes, last_updated__gte=high_water)
+        )
+        for change in self._object_changes().filter(
+            action='delete',
+            changed_object_type=['ipam.prefix', 'ipam.ipaddress'],
+            time_after=high_water,
+        ):
+            changes.track(change.time)
+            if change.changed_object_type == 'ipam.prefix':
+                changes.deleted_prefixes.add(str(change.changed_object_id))
+            else:
+                changes.deleted_addresses.add(str(change.changed_object_id))
+        return changes
+
+    def _object_changes(self):
+        # the changelog moved from extras to core with NetBox 4.1
+        version = tuple(int(part) for part in self.conn.version.split('.')[:2])
+        app = self.conn.core if version >= (4, 1) else self.conn.extras
+        return app.object_changes
+
+    def _device_rows(
+        self,
+        ip_records: Iterable,
+        include_unassigned: bool = False,
+        page_size: int = PAGE_SIZE,
+    ) -> Iterator[dict]:
+        """
+        A row per raw IP record assigned to a device, resolving the devices in
+        bulk per page. With `include_unassigned` other IPs get a row without device.
+        """
+
+        def resolve(chunk: list) -> tuple[list, dict[int, dict]]:
+            assigned = [
+                (q_ip, (q_ip.get('assigned_object') or {}).get('device'))
+                for q_ip in chunk
+            ]
+            return assigned, self._get_devices(
+                [device for _, device in assigned if device]
+            )
+
+        # the devices of the next pages are looked up while rows are consumed
+        for assigned, devices in prefetched(
+            resolve,
+            chunks(ip_records, page_size),
+            PREFETCH_PAGES if self.threading else 1,
+        ):
+            for q_ip, nested in assigned:
+                device = devices.get(nested['id']) if nested else None
                 if device:
-                    results.add_row(
-                        tenant=device.tenant.name if device.tenant else '',
-                        site=device.site.name if device.site else '',
-                        device=device.name,
-                        address=str(q_ip.address),
-                        link=f"{self.url.rstrip('/')}/dcim/devices/{device.id}/",
-                    )
-        return results
+                    yield {
+                        'tenant': device['tenant'],
+                        'site': device['site'],
+                        'device': device['name'],
+                        'address': q_ip['address'],
+                        'link': f"{self.url.rstrip('/')}/dcim/devices/{device['id']}/",
+                    }
+                elif include_unassigned:
+                    yield {
+                        'tenant': (q_ip.get('tenant') or {}).get('name', ''),
+                        'site': '',
+                        'device': '',
+                        'address': q_ip['address'],
+                        'link': f"{self.url.rstrip('/')}/ipam/ip-addresses/{q_ip['id']}/",
+                    }
+
+    def _get_devices(self, nested_devices: list[dict]) -> dict[int, dict]:
+        """Map device ids to name, site and tenant with as few requests as possible"""
+        devices: dict[int, dict] = {}
+        missing: set[int] = set()
+        for nested in nested_devices:
+            if nested['id'] in self._devices:
+                devices[nested['id']] = self._devices[nested['id']]
+            elif {'name', 'site', 'tenant'} <= nested.keys():
+                devices[nested['id']] = self._device_summary(nested)
+            else:
+                missing.add(nested['id'])
+
+        id_chunks = chunks(sorted(missing), DEVICE_CHUNK_SIZE)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for chunk in pool.map(self._filter_devices, id_chunks):
+                for device in chunk:
+                    devices[device['id']] = self._device_summary(device)
+        self._devices.update(devices)
+        return devices
+
+    def _filter_devices(self, ids: list[int]) -> list[dict]:
+        return list(
+            self.conn.dcim.devices.filter(id=ids, fields=DEVICE_SUMMARY_FIELDS).response
+        )
+
+    @staticmethod
+    def _device_summary(device: dict) -> dict:
+        return {
+            'id': device['id'],
+            'name': device['name'],
+            'site': device['site']['name'] if device.get('site') else '',
+            'tenant': device['tenant']['name'] if device.get('tenant') else '',
+        }
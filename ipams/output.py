@@ -1,8 +1,26 @@
+import csv
+import json
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Iterable, Optional, TextIO
+
 from rich.style import Style
 from rich.table import Table
 
+if TYPE_CHECKING:
+    from ipams.query import Result
+
+
+class RecordTable(Table):
+    '''
+    A table filled from records with `add_record`, which maps their fields
+    to cells. `add_row` keeps the signature of `rich.table.Table`.
+    '''
 
-class DefaultNetBoxTable(Table):
+    def add_record(self, *args: Any, **kwargs: Any) -> None:
+        raise NotImplementedError
+
+
+class DefaultNetBoxTable(RecordTable):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.title = 'NetBox'
@@ -24,7 +42,7 @@ class NetBoxIPTable(DefaultNetBoxTable):
         self.add_column('Description', justify='left', style='green')
         self.add_column('Link', justify='left', style='green')
 
-    def add_row(
+    def add_record(
         self,
         vrf: str,
         tenant: str,
@@ -46,7 +64,7 @@ class NetBoxHostTable(DefaultNetBoxTable):
         self.add_column('Address', justify='left', style='magenta', no_wrap=True)
         self.add_column('Link', justify='left', style='green')
 
-    def add_row(
+    def add_record(
         self,
         device: str,
         tenant: str,
@@ -67,7 +85,9 @@ class NetBoxNetworkTable(DefaultNetBoxTable):
         self.add_column('Description', justify='left', style='green')
         self.add_column('Link', justify='left', style='green')
 
-    def add_row(self, vrf: str, tenant: str, network: str, description: str, link: str):
+    def add_record(
+        self, vrf: str, tenant: str, network: str, description: str, link: str
+    ):
         super().add_row(network, tenant, vrf, description, link)
 
 
@@ -75,7 +95,7 @@ class NetBoxSubnetTable(NetBoxHostTable):
     pass
 
 
-class DefaultPhpIpam(Table):
+class DefaultPhpIpam(RecordTable):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.title = 'PHP IPAM'
@@ -96,7 +116,7 @@ class PhpIpamIpTable(DefaultPhpIpam):
         self.add_column('Description', justify='left', style='green')
         self.add_column('Link', justify='left', style='green', no_wrap=True)
 
-    def add_row(
+    def add_record(
         self, address: str, hostname: str, section: str, description: str, link: str
     ):
         super().add_row(address, section, hostname, description, link)
@@ -112,7 +132,7 @@ class PhpIpamHostTable(DefaultPhpIpam):
         self.add_column('Description', justify='left', style='green')
         self.add_column('Link', justify='left', style='green', no_wrap=True)
 
-    def add_row(
+    def add_record(
         self, address: str, hostname: str, section: str, description: str, link: str
     ):
         super().add_row(hostname, section, address, description, link)
@@ -127,5 +147,252 @@ class PhpIpamNetworkTable(DefaultPhpIpam):
         self.add_column('Description', justify='left', style='green')
         self.add_column('Link', justify='left', style='green', no_wrap=True)
 
-    def add_row(self, network: str, section: str, description: str, link: str):
+    def add_record(self, network: str, section: str, description: str, link: str):
         super().add_row(network, section, description, link)
+
+
+# table per IPAM kind and query method, query methods yield the rows as
+# keyword arguments of `add_record`
+TABLES: dict[str, dict[str, type[RecordTable]]] = {
+    'netbox': {
+        'query_ip': NetBoxIPTable,
+        'query_host_by_ip': NetBoxHostTable,
+        'query_host_by_name': NetBoxHostTable,
+        'query_network_by_address': NetBoxNetworkTable,
+        'query_network_by_string': NetBoxNetworkTable,
+        'query_subnet_by_cidr': NetBoxSubnetTable,
+    },
+    'phpipam': {
+        'query_ip': PhpIpamIpTable,
+        'query_host_by_ip': PhpIpamIpTable,
+        'query_host_by_name': PhpIpamHostTable,
+        'query_network_by_address': PhpIpamNetworkTable,
+        'query_network_by_string': PhpIpamNetworkTable,
+        'query_subnet_by_cidr': PhpIpamIpTable,
+    },
+}
+
+
+class BulkIPTable(RecordTable):
+    '''One row per looked up address with the matches of all backends'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title_justify = 'left'
+        self.title_style = Style(bold=True, underline=True)
+        self.expand = False
+        self.highlight = True
+        self.show_lines = True
+        self.add_column('Query', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Backend', justify='left', style='magenta')
+        self.add_column('Address', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Hostname', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Description', justify='left', style='green')
+        self.add_column('Link', justify='left', style='green', no_wrap=True)
+
+    def add_record(self, query: str, matches: list[dict]):
+        if not matches:
+            super().add_row(query, '', '', '', 'not found', '', style='dim')
+            return
+        super().add_row(
+            query,
+            *(
+                '\n'.join(match[field] for match in matches)
+                for field in ('backend', 'address', 'hostname', 'description', 'link')
+            ),
+        )
+
+
+class ResultTable(RecordTable):
+    '''Merged results of all backends, see `ipams.query.merge`'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = 'All IPAMs'
+        self.title_justify = 'left'
+        self.title_style = Style(bold=True, underline=True)
+        self.expand = False
+        self.highlight = True
+        self.show_lines = True
+        self.add_column('Address', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Hostname', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Device', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Site', justify='left', style='magenta')
+        self.add_column('Tenant', justify='left', style='magenta')
+        self.add_column('VRF', justify='left', style='magenta')
+        self.add_column('Section', justify='left', style='magenta')
+        self.add_column('Description', justify='left', style='green')
+        self.add_column('Backend', justify='left', style='green')
+        self.add_column('Link', justify='left', style='green', no_wrap=True)
+
+    def add_record(self, result: 'Result'):
+        sources = result.sources
+        super().add_row(
+            result.address,
+            result.hostname,
+            result.device,
+            result.site,
+            result.tenant,
+            result.vrf,
+            result.section,
+            result.description,
+            '\n'.join(backend for backend, _, _ in sources),
+            '\n'.join(link for _, _, link in sources),
+        )
+
+
+class DiffTable(RecordTable):
+    '''Differences of two backends, see `ipams.diff.diff`'''
+
+    def __init__(self, left: str, right: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = f'{left} / {right}'
+        self.title_justify = 'left'
+        self.title_style = Style(bold=True, underline=True)
+        self.expand = False
+        self.highlight = True
+        self.show_lines = True
+        self.add_column('Address', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Issue', justify='left', style='magenta', no_wrap=True)
+        self.add_column(left, justify='left', style='green')
+        self.add_column(right, justify='left', style='green')
+        self.add_column('Link', justify='left', style='green', no_wrap=True)
+
+    def add_record(self, row: dict):
+        super().add_row(
+            row['address'],
+            row['issue'],
+            row['left'],
+            row['right'],
+            '\n'.join(link for link in (row['left_link'], row['right_link']) if link),
+        )
+
+
+class FreeTable(RecordTable):
+    '''Free blocks of a parent prefix, see `ipams.free.Usage`'''
+
+    def __init__(self, parent: str, utilization: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = parent
+        self.title_justify = 'left'
+        self.caption = utilization
+        self.caption_justify = 'left'
+        self.title_style = Style(bold=True, underline=True)
+        self.expand = False
+        self.highlight = True
+        self.add_column('Free', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Addresses', justify='right', style='green')
+
+    def add_record(self, row: dict):
+        super().add_row(row['prefix'], str(row['addresses']))
+
+
+class ProfileTable(RecordTable):
+    '''Requests per backend and endpoint, see `ipams.tracing.Tracer.summary`'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = 'Profile'
+        self.title_justify = 'left'
+        self.title_style = Style(bold=True, underline=True)
+        self.expand = False
+        self.add_column('Backend', justify='left', style='magenta', no_wrap=True)
+        self.add_column('Endpoint', justify='left', style='magenta', no_wrap=True)
+        for column in (
+            'Requests',
+            'Cached',
+            'Retries',
+            'Errors',
+            'KiB',
+            'Total s',
+            'Max s',
+        ):
+            self.add_column(column, justify='right', style='green')
+
+    def add_record(self, row: dict):
+        super().add_row(
+            row['backend'],
+            row['endpoint'],
+            str(row['requests']),
+            str(row['cached']),
+            str(row['retries']),
+            str(row['errors']),
+            f'{row["bytes"] / 1024:.1f}',
+            f'{row["seconds"]:.3f}',
+            f'{row["slowest"]:.3f}',
+        )
+
+
+class OutputFormat(str, Enum):
+    table = 'table'
+    json = 'json'
+    jsonl = 'jsonl'
+    csv = 'csv'
+    tsv = 'tsv'
+
+
+# columns of machine readable output, shared by all IPAMs and queries
+FIELDS = (
+    'backend',
+    'ipam',
+    'address',
+    'network',
+    'hostname',
+    'device',
+    'site',
+    'tenant',
+    'vrf',
+    'section',
+    'description',
+    'link',
+)
+
+
+def normalize(row: dict, fields: tuple[str, ...] = FIELDS) -> dict:
+    return {field: row.get(field, '') for field in fields}
+
+
+class RowWriter:
+    '''
+    Writes rows straight to a stream without any layout, so the output
+    can be consumed by other tools while the query is still running.
+    '''
+
+    def __init__(
+        self,
+        output: OutputFormat,
+        stream: TextIO,
+        fields: tuple[str, ...] = FIELDS,
+    ):
+        self.output = output
+        self.stream = stream
+        self.fields = fields
+        self._count = 0
+        self._csv: Optional[csv.DictWriter] = None
+        if output in (OutputFormat.csv, OutputFormat.tsv):
+            self._csv = csv.DictWriter(
+                stream,
+                fields,
+                delimiter='\t' if output == OutputFormat.tsv else ',',
+                lineterminator='\n',
+            )
+            self._csv.writeheader()
+        elif output == OutputFormat.json:
+            stream.write('[')
+
+    def write(self, rows: Iterable[dict]):
+        normalized = (normalize(row, self.fields) for row in rows)
+        if self._csv is not None:
+            self._csv.writerows(normalized)
+        elif self.output == OutputFormat.json:
+            for row in normalized:
+                self.stream.write((',\n' if self._count else '\n') + json.dumps(row))
+                self._count += 1
+        else:
+            self.stream.writelines(json.dumps(row) + '\n' for row in normalized)
+        self.stream.flush()
+
+    def close(self):
+        if self.output == OutputFormat.json:
+            self.stream.write('\n]\n' if self._count else ']\n')
+        self.stream.flush()
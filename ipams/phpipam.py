@@ -1,14 +1,49 @@
-from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
-from typing import Literal, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ipaddress import (
+    IPv4Address,
+    IPv4Network,
+    IPv6Address,
+    IPv6Network,
+    ip_interface,
+    ip_network,
+)
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING, Iterable, Iterator, Literal, Optional, Union
 
-import requests
 from pydantic import BaseModel
 
+from ipams.catalogue import TrigramIndex
 from ipams.logging import logger
-from ipams.output import PhpIpamHostTable, PhpIpamIpTable, PhpIpamNetworkTable
+from ipams.snapshot import Changes
+from ipams.tokens import token_store
+from ipams.tracing import tracer
+from ipams.utils import prefetched
+
+# requests is imported with the first request, the config model is needed to
+# parse every config file
+if TYPE_CHECKING:
+    import requests
+
+    from ipams.cache import ResponseCache
 
 _phpipamauth = Literal['password', 'token']
 
+# concurrent address searches in bulk lookups
+SEARCH_WORKERS = 8
+# collection pages requested ahead of the one being consumed
+PREFETCH_PAGES = 4
+# phpIPAM always returns all columns, but can leave out rows. Versions without
+# regex filters reject it, then rows are filtered locally.
+HOSTNAME_FILTER = {
+    'filter_by': 'hostname',
+    'filter_value': '.',
+    'filter_match': 'regex',
+}
+# assumed token lifetime if phpIPAM doesn't return an expiry, its default is 6h
+DEFAULT_TOKEN_LIFETIME = 6 * 3600
+
 
 class PhpIpamConfig(BaseModel):
     """Configuration for PhpIpam API"""
@@ -20,17 +55,38 @@ class PhpIpamConfig(BaseModel):
     password: Optional[str] = None
     token: Optional[str] = None
     verify_ssl: bool = True
+    query_timeout: Optional[float] = None
+    # seconds to connect and to wait for data of a single request
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    # attempts after the first for idempotent requests that failed
+    retries: int = 2
+    # requests per second, None for no limit
+    rate_limit: Optional[float] = None
+    cache_ttl: Optional[int] = None
+    cache_ttls: dict[str, int] = {}
 
 
 class PhpIpamConnector:
-    def __init__(self, config: PhpIpamConfig):
+    def __init__(
+        self,
+        config: PhpIpamConfig,
+        cache: Optional['ResponseCache'] = None,
+        catalogue: bool = False,
+        concurrency: int = 1,
+    ):
+        self.config = config
+        self.cache = cache
+        # queries sharing the connector at once
+        self.concurrency = max(concurrency, 1)
+        # long lived connectors search an index of all subnets, built once
+        self.catalogue = catalogue
         self.name = config.name
         self.url = config.url
         self.app_id = config.app_id
         self.username = config.username
         self.password = config.password
         self.token = config.token
-        self.verify_ssl = config.verify_ssl
 
         self.api_url = f'{self.url.rstrip("/")}/api/{self.app_id}'
 
@@ -38,28 +94,68 @@ class PhpIpamConnector:
         if not self.token:
             self.auth_method = 'password'
 
-        self.session = self._init_session()
+        # the session is created and authenticated on first use
+        self._session: Optional['requests.Session'] = None
+        self._session_lock = Lock()
+        self._token_key = f'{self.api_url}|{self.username}'
+
+        # sections are bulk loaded once, subnets are memoized per id
+        self._sections: Optional[dict[int, dict]] = None
+        self._subnets: dict[int, dict] = {}
+        self._all_subnets: Optional[list[dict]] = None
+        self._vlans: Optional[dict[int, dict]] = None
+        self._catalogue: Optional[TrigramIndex[int]] = None
+        self._lock = Lock()
+        self._subnet_locks: dict[int, Lock] = {}
+        self._regex_filters = True
+
+    @property
+    def session(self) -> 'requests.Session':
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._init_session()
+            return self._session
+
+    def _init_session(self) -> 'requests.Session':
+        import requests
+
+        from ipams.transport import mount_transport
 
-    def _init_session(self) -> requests.Session:
         session = requests.Session()
-        session.verify = self.verify_ssl
+        mount_transport(
+            session,
+            self.config,
+            self.api_url,
+            self.cache,
+            pool_size=self.concurrency * SEARCH_WORKERS,
+        )
+        tracer.instrument(session, self.name, self.api_url)
 
         session.headers.update({'Content-Type': 'application/json'})
-        session.headers.update({'phpipam-token': self._get_token()})
+        session.headers.update({'phpipam-token': self._get_token(session)})
         return session
 
-    def _get_token(self) -> str:
+    def _get_token(self, session: 'requests.Session') -> str:
         if self.auth_method == 'password':
-            return self._get_token_password()
+            return self._get_token_password(session)
         elif self.token and self.auth_method == 'token':
             return self.token
         else:
             raise ValueError('Invalid auth method')
 
-    def _get_token_password(self) -> str:
+    def _get_token_password(self, session: 'requests.Session') -> str:
+        """Reuse a stored token, only log in if there is none or it expired"""
+        with token_store.login_lock(self._token_key):
+            token = token_store.get(self._token_key)
+            if token is None:
+                token, expires = self._login(session)
+                token_store.set(self._token_key, token, expires)
+            return token
+
+    def _login(self, session: 'requests.Session') -> tuple[str, float]:
         url = f'{self.api_url}/user/'
         logger.debug(f'Post "{url}"')
-        response = self.session.post(
+        response = session.post(
             url,
             headers={'Content-Type': 'application/json'},
             auth=(self.username or '', self.password or ''),
@@ -69,116 +165,427 @@ class PhpIpamConnector:
         if data['code'] != 200 or data['success'] is not True:
             print(data)
             raise ValueError('Invalid credentials')
-        return data['data']['token']
+        try:
+            expires = datetime.strptime(
+                data['data']['expires'], '%Y-%m-%d %H:%M:%S'
+            ).timestamp()
+        except (KeyError, TypeError, ValueError):
+            expires = time() + DEFAULT_TOKEN_LIFETIME
+        return data['data']['token'], expires
+
+    def _refresh_token(self, rejected: str):
+        """Replace a token the server rejected, once for all waiting threads"""
+        session = self.session
+        token_store.invalidate(self._token_key, rejected)
+        with self._session_lock:
+            if session.headers['phpipam-token'] == rejected:
+                session.headers['phpipam-token'] = self._get_token_password(session)
+
+    def _token_rejected(self, response: 'requests.Response') -> bool:
+        if self.auth_method != 'password' or response.status_code not in (401, 403):
+            return False
+        try:
+            message = str(response.json().get('message', ''))
+        except ValueError:
+            message = ''
+        # phpIPAM answers 403 for expired tokens but also for missing permissions
+        return response.status_code == 401 or 'token' in message.lower()
 
-    def get(self, endpoint: str, params: dict = {}) -> requests.Response:
+    def get(self, endpoint: str, params: dict = {}) -> 'requests.Response':
         url = f'{self.api_url}/{endpoint}'
         logger.debug(f'Get "{url}" with params: {params}')
+        token = self.session.headers['phpipam-token']
         response = self.session.get(url, params=params)
+        if self._token_rejected(response):
+            logger.debug(f'Token of phpipam "{self.name}" was rejected, logging in')
+            self._refresh_token(str(token))
+            with tracer.retry():
+                response = self.session.get(url, params=params)
         return response
 
-    def post(self, endpoint: str, data: dict = {}) -> requests.Response:
+    def post(self, endpoint: str, data: dict = {}) -> 'requests.Response':
         url = f'{self.api_url}/{endpoint}'
         logger.debug(f'Post "{url}" with json: {data}')
         response = self.session.post(url, json=data)
         return response
 
     def get_paged(
-        self,
-    ) -> list[dict]:
-        return []
+        self, endpoints: Iterable[str], params: dict = {}
+    ) -> Iterator[list[dict]]:
+        """
+        `data` of several collection endpoints, in order. phpIPAM has no paging,
+        so large collections are fetched in natural pages (e.g. the addresses
+        of each subnet) which are requested ahead while the caller consumes
+        the previous page. Missing or empty collections give an empty page.
+        """
+        return prefetched(
+            lambda endpoint: self._get_data(endpoint, params), endpoints, PREFETCH_PAGES
+        )
 
-    def query_ip(self, ip: Union[IPv4Address, IPv6Address]) -> PhpIpamIpTable:
-        results = PhpIpamIpTable(self.name)
-        response = self.get(f'/addresses/search/{str(ip)}/')
-        if response.status_code == 404:
-            return results
-        data = response.json()
-        for address in data['data']:
-            subnet_id = address['subnetId']
-            section = self._get_section_for_subnet(subnet_id)
-            results.add_row(
-                address=address['ip'],
-                hostname=address['hostname'],
-                section=section['name'],
-                description=address['description'],
-                link=self._build_link(
-                    f'/subnets/{section["id"]}/{subnet_id}/address-details/{address["id"]}'
-                ),
-            )
-        return results
+    def _get_data(self, endpoint: str, params: dict = {}) -> list[dict]:
+        if params.get('filter_match') == 'regex' and not self._regex_filters:
+            params = {}
+        response = self.get(endpoint, params)
+        if response.status_code == 400 and params.get('filter_match') == 'regex':
+            logger.debug(f'phpipam "{self.name}" has no regex filters')
+            self._regex_filters = False
+            response = self.get(endpoint)
+        return self._data(response)
 
-    def query_host_by_name(self, hostname: str) -> PhpIpamHostTable:
-        results = PhpIpamHostTable(self.name)
-        response = self.get(f'/addresses/search_hostbase/{hostname}/')
+    def _data(self, response: 'requests.Response') -> list[dict]:
+        """
+        `data` of a collection, phpIPAM answers 404 if it is empty. Other
+        errors are raised, so they can't be mistaken for an empty collection.
+        """
         if response.status_code == 404:
-            return results
-        data = response.json()
-        for address in data['data']:
-            subnet_id = address['subnetId']
-            section = self._get_section_for_subnet(subnet_id)
-            results.add_row(
-                address=address['ip'],
-                hostname=address['hostname'],
-                section=section['name'],
-                description=address['description'],
-                link=self._build_link(
-                    f'/subnets/{section["id"]}/{subnet_id}/address-details/{address["id"]}'
-                ),
-            )
-        return results
+            return []
+        if response.status_code == 500:
+            logger.warning(f'Query on phpipam "{self.name}" failed with error code 500')
+            logger.warning('Please take a look in the phpipam server error log')
+        response.raise_for_status()
+        return response.json().get('data') or []
+
+    def query_ip(self, ip: Union[IPv4Address, IPv6Address]) -> Iterator[dict]:
+        yield from self._search_address(ip)
+
+    def query_ips(
+        self, ips: list[Union[IPv4Address, IPv6Address]]
+    ) -> dict[str, list[dict]]:
+        """Look up many IP addresses, phpIPAM only searches one address per request"""
+        with ThreadPoolExecutor(max_workers=SEARCH_WORKERS) as pool:
+            return dict(zip(map(str, ips), pool.map(self._search_address, ips)))
+
+    def _search_address(self, ip: Union[IPv4Address, IPv6Address]) -> list[dict]:
+        return [
+            self._address_row(address)
+            for address in self._get_data(f'/addresses/search/{str(ip)}/')
+        ]
+
+    def query_host_by_name(self, hostname: str) -> Iterator[dict]:
+        for address in self._get_data(f'/addresses/search_hostbase/{hostname}/'):
+            yield self._address_row(address)
 
     def query_network_by_address(
         self, address: Union[IPv4Network, IPv6Network]
-    ) -> PhpIpamNetworkTable:
-        results = PhpIpamNetworkTable(self.name)
-        response = self.get(f'/subnets/search/{str(address)}/')
-        if response.status_code == 404:
-            return results
-        data = response.json()
-        for subnet in data['data']:
-            section = self._get_section_for_subnet(subnet['id'])
-            results.add_row(
-                network=subnet['subnet'] + '/' + subnet['mask'],
-                description=subnet['description'],
-                section=section['name'],
-                link=self._build_link(f'/subnets/{section["id"]}/{subnet["id"]}/'),
-            )
-        return results
+    ) -> Iterator[dict]:
+        subnets = self._get_data(f'/subnets/search/{str(address)}/')
+        self._remember_subnets(subnets)
+        for subnet in subnets:
+            yield self._network_row(subnet)
 
-    def query_network_by_string(self, query: str) -> PhpIpamNetworkTable:
-        results = PhpIpamNetworkTable(self.name)
-        response = self.get('/subnets/')
-        if response.status_code == 500:
-            logger.warning(f'Query on phpipam "{self.name}" failed with error code 500')
-            logger.warning('Please take a look in the phpipam server error log')
-            return results
-        elif response.status_code != 200:
-            return results
-        data = response.json()
-        for subnet in data['data']:
-            if subnet['description'] and query.lower() in subnet['description'].lower():
-                section = self._get_section_for_subnet(subnet['id'])
-                results.add_row(
-                    network=subnet['subnet'] + '/' + subnet['mask'],
-                    description=subnet['description'],
-                    section=section['name'],
-                    link=self._build_link(f'/subnets/{section["id"]}/{subnet["id"]}/'),
+    def query_network_by_string(self, query: str) -> Iterator[dict]:
+        """Subnets whose description or VLAN number/name contain all terms of `query`"""
+        for subnet in self._search_subnets(query):
+            yield self._network_row(subnet)
+
+    def _network_row(self, subnet: dict) -> dict:
+        section = self._get_section(subnet['sectionId'])
+        return {
+            'network': subnet['subnet'] + '/' + subnet['mask'],
+            'description': subnet['description'] or '',
+            'section': section['name'],
+            'link': self._build_link(f'/subnets/{section["id"]}/{subnet["id"]}/'),
+        }
+
+    def _address_row(self, address: dict) -> dict:
+        subnet_id = address['subnetId']
+        section = self._get_section_for_subnet(subnet_id)
+        return {
+            'address': address['ip'],
+            'hostname': address['hostname'],
+            'section': section['name'],
+            'description': address['description'],
+            'link': self._build_link(
+                f'/subnets/{section["id"]}/{subnet_id}/address-details/{address["id"]}'
+            ),
+        }
+
+    def _search_subnets(self, query: str) -> list[dict]:
+        terms = query.lower().split()
+        # building the catalogue costs all subnets, short lived connectors let
+        # phpIPAM filter each term and keep the subnets matching all of them
+        if self.catalogue or not terms:
+            catalogue = self._get_catalogue()
+            return [self._subnets[subnet_id] for subnet_id in catalogue.search(query)]
+        matches = self._filter_subnets(terms[0])
+        for term in terms[1:]:
+            if not matches:
+                break
+            found = {subnet['id'] for subnet in self._filter_subnets(term)}
+            matches = [subnet for subnet in matches if subnet['id'] in found]
+        return matches
+
+    def _filter_subnets(self, term: str) -> list[dict]:
+        """Server side partial match on the description plus subnets of matching VLANs"""
+        vlans = self._get_vlans()
+        response = self.get(
+            '/subnets/',
+            params={
+                'filter_by': 'description',
+                'filter_value': term,
+                'filter_match': 'partial',
+            },
+        )
+        subnets = response.json()['data'] if response.status_code == 200 else []
+        for vlan_id, vlan in vlans.items():
+            if term in self._vlan_text(vlan):
+                response = self.get(f'/vlans/{vlan_id}/subnets/')
+                if response.status_code == 200:
+                    subnets += response.json()['data']
+        self._remember_subnets(subnets)
+        matches: dict[int, dict] = {}
+        for subnet in subnets:
+            # older phpIPAM versions ignore unknown filters, verify every match
+            if term in self._subnet_text(subnet, vlans):
+                matches.setdefault(int(subnet['id']), subnet)
+        return sorted(matches.values(), key=lambda subnet: int(subnet['id']))
+
+    def _get_catalogue(self) -> TrigramIndex[int]:
+        """Search index over all subnets, built once per connector"""
+        if self._catalogue is None:
+            vlans = self._get_vlans()
+            catalogue: TrigramIndex[int] = TrigramIndex()
+            for subnet in self._get_all_subnets():
+                catalogue.add(int(subnet['id']), self._subnet_text(subnet, vlans))
+            self._catalogue = catalogue
+        return self._catalogue
+
+    def _get_vlans(self) -> dict[int, dict]:
+        if self._vlans is None:
+            response = self.get('/vlans/')
+            vlans = self._data(response)
+            self._vlans = {int(vlan['vlanId']): vlan for vlan in vlans}
+        return self._vlans
+
+    @staticmethod
+    def _vlan_text(vlan: dict) -> str:
+        return f'vlan{vlan["number"]} {vlan["number"]} {vlan["name"] or ""}'.lower()
+
+    def _subnet_text(self, subnet: dict, vlans: dict[int, dict]) -> str:
+        text = subnet['description'] or ''
+        vlan = vlans.get(int(subnet.get('vlanId') or 0))
+        if vlan:
+            text += ' ' + self._vlan_text(vlan)
+        return text.lower()
+
+    def iter_prefixes(self, changes: Optional[Changes] = None) -> Iterator[dict]:
+        """Subnets for the local snapshot, `changes` tracks the newest edit"""
+        for subnet in self._get_real_subnets():
+            if changes:
+                changes.track(subnet.get('editDate'))
+            yield self._prefix_row(subnet)
+
+    def iter_addresses(self, changes: Optional[Changes] = None) -> Iterator[dict]:
+        """Addresses of all subnets for the local snapshot"""
+        yield from self._subnet_address_rows(self._get_real_subnets(), changes)
+
+    def export_partitions(self, type: str, size: int) -> list[dict]:
+        """
+        Subnets are listed with one request, addresses are split into ranges
+        of subnets whose sizes add up to about `size` addresses. phpIPAM
+        doesn't count addresses, so a subnet counts as full.
+        """
+        if type == 'prefix':
+            return [{}]
+        subnets = sorted(
+            (
+                (
+                    ip_network(f'{subnet["subnet"]}/{subnet["mask"]}', strict=False),
+                    subnet,
                 )
-        return results
+                for subnet in self._get_real_subnets()
+            ),
+            key=lambda item: (item[0].version, item[0]),
+        )
+        partitions: list[dict] = []
+        addresses = size
+        for network, subnet in subnets:
+            if addresses + min(network.num_addresses, size) > size:
+                partitions.append({'subnets': []})
+                addresses = 0
+            partitions[-1]['subnets'].append(int(subnet['id']))
+            addresses += min(network.num_addresses, size)
+        return partitions
 
-    def query_host_by_ip(self, ip: Union[IPv4Address, IPv6Address]) -> PhpIpamIpTable:
+    def export_rows(self, type: str, partition: dict) -> Iterator[dict]:
+        """Rows of a partition of `export_partitions`"""
+        if type == 'prefix':
+            return self.iter_prefixes()
+        ids = set(partition['subnets'])
+        return self._subnet_address_rows(
+            [subnet for subnet in self._get_real_subnets() if int(subnet['id']) in ids]
+        )
+
+    def changes_since(
+        self, high_water: str, known_prefixes: set[str], known_addresses: set[str]
+    ) -> Changes:
+        """
+        phpIPAM has no changelog and doesn't update the `editDate` of a subnet
+        when its addresses change. The subnet list and the address lists of
+        all subnets are compared with the ids of the snapshot, only new,
+        edited and deleted rows are written.
+        """
+        changes = Changes(high_water)
+        subnets = self._get_real_subnets()
+        changes.prefix_ids = {str(subnet['id']) for subnet in subnets}
+        changed = set()
+        for subnet in subnets:
+            if (
+                str(subnet['id']) not in known_prefixes
+                or (subnet.get('editDate') or '') > high_water
+            ):
+                changes.track(subnet.get('editDate'))
+                changes.prefixes.append(self._prefix_row(subnet))
+                changed.add(str(subnet['id']))
+        pages = self.get_paged(
+            f'/subnets/{subnet["id"]}/addresses/' for subnet in subnets
+        )
+        seen = set()
+        for subnet, addresses in zip(subnets, pages):
+            section = self._get_section(subnet['sectionId'])
+            for address in addresses:
+                seen.add(str(address['id']))
+                # addresses of edited subnets are rewritten, their mask may differ
+                if (
+                    str(address['id']) in known_addresses
+                    and str(subnet['id']) not in changed
+                    and (address.get('editDate') or '') <= high_water
+                ):
+                    continue
+                changes.track(address.get('editDate'))
+                changes.addresses.append(
+                    self._snapshot_address_row(subnet, section, address)
+                )
+        changes.deleted_addresses = known_addresses - seen
+        return changes
+
+    def _prefix_row(self, subnet: dict) -> dict:
+        section = self._get_section(subnet['sectionId'])
+        return {
+            'id': subnet['id'],
+            'prefix': subnet['subnet'] + '/' + subnet['mask'],
+            'section': section['name'],
+            'description': subnet['description'],
+            'link': self._build_link(f'/subnets/{section["id"]}/{subnet["id"]}/'),
+        }
+
+    def _subnet_address_rows(
+        self,
+        subnets: list[dict],
+        changes: Optional[Changes] = None,
+        params: dict = {},
+    ) -> Iterator[dict]:
+        pages = self.get_paged(
+            (f'/subnets/{subnet["id"]}/addresses/' for subnet in subnets), params
+        )
+        for subnet, addresses in zip(subnets, pages):
+            section = self._get_section(subnet['sectionId'])
+            for address in addresses:
+                if changes:
+                    changes.track(address.get('editDate'))
+                yield self._snapshot_address_row(subnet, section, address)
+
+    def _snapshot_address_row(self, subnet: dict, section: dict, address: dict) -> dict:
+        return {
+            'id': address['id'],
+            'address': address['ip'] + '/' + subnet['mask'],
+            'hostname': address['hostname'],
+            'section': section['name'],
+            'description': address['description'],
+            'container': subnet['id'],
+            'link': self._build_link(
+                f'/subnets/{section["id"]}/{subnet["id"]}'
+                + f'/address-details/{address["id"]}'
+            ),
+        }
+
+    def query_host_by_ip(self, ip: Union[IPv4Address, IPv6Address]) -> Iterator[dict]:
         return self.query_ip(ip)
 
+    def query_subnet_by_cidr(
+        self, cidr: Union[IPv4Network, IPv6Network], include_unassigned: bool = False
+    ) -> Iterator[dict]:
+        """
+        Addresses in `cidr`, from the address lists of the subnets overlapping
+        it which are fetched ahead like pages. phpIPAM addresses aren't bound
+        to interfaces, addresses without hostname count as unassigned.
+        """
+        overlapping = [
+            subnet
+            for subnet in self._get_data(f'/subnets/overlapping/{cidr}/')
+            if subnet['subnet'] and subnet.get('isFolder') != '1'
+        ]
+        self._remember_subnets(overlapping)
+        networks = {
+            subnet['id']: ip_network(
+                subnet['subnet'] + '/' + subnet['mask'], strict=False
+            )
+            for subnet in overlapping
+        }
+        subnets = sorted(overlapping, key=lambda subnet: networks[subnet['id']])
+        # addresses without hostname are left out by phpIPAM already
+        params = {} if include_unassigned else HOSTNAME_FILTER
+        seen = set()
+        for row in self._subnet_address_rows(subnets, params=params):
+            address = ip_interface(row['address'])
+            if address.ip not in cidr or row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            if not include_unassigned and not row['hostname']:
+                continue
+            yield {
+                'address': str(address.ip),
+                'hostname': row['hostname'],
+                'section': row['section'],
+                'description': row['description'],
+                'link': row['link'],
+            }
+
+    def _get_sections(self) -> dict[int, dict]:
+        with self._lock:
+            if self._sections is None:
+                response = self.get('/sections/')
+                sections = self._data(response)
+                self._sections = {int(section['id']): section for section in sections}
+            return self._sections
+
     def _get_section(self, section: int) -> dict:
-        endpoint = f'/sections/{section}/'
-        response = self.get(endpoint)
-        return response.json()['data']
+        sections = self._get_sections()
+        if int(section) not in sections:
+            response = self.get(f'/sections/{section}/')
+            sections[int(section)] = response.json()['data']
+        return sections[int(section)]
 
     def _get_subnet(self, subnet_id: int) -> dict:
-        endpoint = f'/subnets/{subnet_id}/'
-        response = self.get(endpoint)
-        return response.json()['data']
+        subnet_id = int(subnet_id)
+        with self._lock:
+            lock = self._subnet_locks.setdefault(subnet_id, Lock())
+        # concurrent lookups of the same subnet wait for the first request
+        with lock:
+            if subnet_id not in self._subnets:
+                response = self.get(f'/subnets/{subnet_id}/')
+                self._subnets[subnet_id] = response.json()['data']
+            return self._subnets[subnet_id]
+
+    def _get_all_subnets(self) -> list[dict]:
+        if self._all_subnets is not None:
+            return self._all_subnets
+        self._all_subnets = self._data(self.get('/subnets/'))
+        self._remember_subnets(self._all_subnets)
+        return self._all_subnets
+
+    def _get_real_subnets(self) -> list[dict]:
+        """Subnets without folders"""
+        return [
+            subnet
+            for subnet in self._get_all_subnets()
+            if subnet['subnet'] and subnet.get('isFolder') != '1'
+        ]
+
+    def _remember_subnets(self, subnets: list[dict]):
+        """Reuse subnet objects from search responses for later lookups"""
+        for subnet in subnets:
+            self._subnets.setdefault(int(subnet['id']), subnet)
 
     def _get_section_for_subnet(self, subnet_id: int) -> dict:
         subnet = self._get_subnet(subnet_id)
@@ -1,14 +1,211 @@
+import socket
+import sys
 from ipaddress import IPv4Address, IPv6Address
-from typing import Union
+from itertools import chain, groupby
+from typing import Any, Iterable, Iterator, Optional
 
-from pydantic import BaseModel
+# columns filled from whichever backend knows them when results are merged
+TEXT_FIELDS = (
+    'hostname',
+    'device',
+    'site',
+    'tenant',
+    'vrf',
+    'section',
+    'description',
+)
+# (backend, ipam) pairs, stored once per backend
+_sources: dict[tuple[str, str], tuple[str, str]] = {}
 
 
-class IPQuery(BaseModel):
-    origin: str
-    ip: Union[IPv4Address, IPv6Address]
-    description: str
-    link: str
+def _source(backend: str, ipam: str) -> tuple[str, str]:
+    return _sources.setdefault((backend, ipam), (backend, ipam))
 
-    def __str__(self):
-        return f'{self.ip} - {self.description} - {self.link}'
+
+def _parse(text: str) -> tuple[int, int, Optional[int]]:
+    '''Version, integer and prefix length of an address with optional prefix'''
+    address, _, prefixlen = text.partition('/')
+    if ':' in address:
+        version, packed = 6, socket.inet_pton(socket.AF_INET6, address)
+    else:
+        version, packed = 4, socket.inet_pton(socket.AF_INET, address)
+    return version, int.from_bytes(packed, 'big'), int(prefixlen) if prefixlen else None
+
+
+class Result:
+    '''
+    An address or network found in an IPAM, compact enough to hold millions
+    of them: addresses are stored as integers and repeated strings are
+    shared between results.
+
+    `source` is the (backend, ipam) pair the result was found in first and
+    `link` its link there, `others` holds (backend, ipam, link) of the
+    IPAMs merged into it.
+    '''
+
+    __slots__ = (
+        'network',
+        'version',
+        'value',
+        'prefixlen',
+        'source',
+        'link',
+        'others',
+        *TEXT_FIELDS,
+    )
+
+    def __init__(
+        self,
+        network: bool,
+        version: int,
+        value: Optional[int],
+        prefixlen: Optional[int],
+        source: tuple[str, str],
+        link: str,
+        hostname: str = '',
+        device: str = '',
+        site: str = '',
+        tenant: str = '',
+        vrf: str = '',
+        section: str = '',
+        description: str = '',
+    ):
+        self.network = network
+        self.version = version
+        self.value = value
+        self.prefixlen = prefixlen
+        self.source = source
+        self.link = link
+        self.others: tuple[tuple[str, str, str], ...] = ()
+        self.hostname = hostname
+        self.device = device
+        self.site = site
+        self.tenant = tenant
+        self.vrf = vrf
+        self.section = section
+        self.description = description
+
+    @classmethod
+    def from_row(cls, backend: str, ipam: str, row: dict) -> 'Result':
+        '''Parse a row of a connector query method'''
+        network = 'network' in row
+        text = row.get('network' if network else 'address')
+        version, value, prefixlen = _parse(text) if text else (0, None, None)
+        return cls(
+            network,
+            version,
+            value,
+            prefixlen,
+            _source(backend, ipam),
+            row.get('link') or '',
+            row.get('hostname') or '',
+            # repeated values are shared, sys.intern releases unused ones
+            sys.intern(row.get('device') or ''),
+            sys.intern(row.get('site') or ''),
+            sys.intern(row.get('tenant') or ''),
+            sys.intern(row.get('vrf') or ''),
+            sys.intern(row.get('section') or ''),
+            row.get('description') or '',
+        )
+
+    @property
+    def sources(self) -> list[tuple[str, str, str]]:
+        '''(backend, ipam, link) of every IPAM that knows the result'''
+        return [(*self.source, self.link), *self.others]
+
+    @property
+    def address(self) -> str:
+        if self.value is None:
+            return ''
+        ip = IPv4Address(self.value) if self.version == 4 else IPv6Address(self.value)
+        return str(ip) if self.prefixlen is None else f'{ip}/{self.prefixlen}'
+
+    def key(self) -> Any:
+        '''
+        Results with the same key are the same object in different IPAMs.
+        Keys of results with an address are integers in address order, keys
+        of results without one are names.
+        '''
+        if self.value is None:
+            return (self.network, (self.device or self.hostname).lower())
+        # the prefix length of addresses differs between IPAMs and is ignored
+        prefixlen = self.prefixlen or 0 if self.network else 0
+        return (
+            (self.version == 6) << 138 | self.value << 9 | self.network << 8 | prefixlen
+        )
+
+    def accepts(self, other: 'Result') -> bool:
+        '''
+        Whether `other` can be the same object, different objects of one
+        backend (e.g. an address in two VRFs) are never merged
+        '''
+        if self.vrf and other.vrf and self.vrf != other.vrf:
+            return False
+        sources = self.sources
+        backends = {backend for backend, _, _ in sources}
+        return all(
+            source in sources or source[0] not in backends for source in other.sources
+        )
+
+    def merge(self, other: 'Result'):
+        '''Add the sources of `other` and fill in the fields only it knows'''
+        for field in TEXT_FIELDS:
+            if not getattr(self, field):
+                setattr(self, field, getattr(other, field))
+        if self.prefixlen is None:
+            self.prefixlen = other.prefixlen
+        sources = self.sources
+        self.others += tuple(
+            source for source in other.sources if source not in sources
+        )
+
+    def to_row(self) -> dict:
+        '''A row with the columns of `ipams.output.FIELDS`'''
+        sources = self.sources
+        return {
+            'backend': ','.join(backend for backend, _, _ in sources),
+            'ipam': ','.join(dict.fromkeys(ipam for _, ipam, _ in sources)),
+            'address': '' if self.network else self.address,
+            'network': self.address if self.network else '',
+            **{field: getattr(self, field) for field in TEXT_FIELDS},
+            'link': ' '.join(link for _, _, link in sources),
+        }
+
+    def __repr__(self) -> str:
+        name = self.address or self.device or self.hostname
+        return f'<Result {name} {[backend for backend, _, _ in self.sources]}>'
+
+
+def results(batches: Iterable[tuple[str, str, list[dict]]]) -> Iterator[Result]:
+    '''Results of the (backend, ipam, rows) batches of a query'''
+    for backend, ipam, rows in batches:
+        for row in rows:
+            yield Result.from_row(backend, ipam, row)
+
+
+def merge(items: Iterable[Result]) -> list[Result]:
+    '''
+    One result per address or network, with the sources of all IPAMs that
+    know it, sorted by address. Exact duplicates of a backend collapse.
+    '''
+    addressed: list[Result] = []
+    named: list[Result] = []
+    for result in items:
+        (named if result.value is None else addressed).append(result)
+    # sorting brings the results of all IPAMs for an address together, which
+    # needs much less memory than an index of all results
+    addressed.sort(key=Result.key)
+    named.sort(key=Result.key)
+    merged: list[Result] = []
+    for _, group in groupby(chain(addressed, named), key=Result.key):
+        # several objects with the same address, e.g. in two VRFs
+        distinct: list[Result] = []
+        for result in group:
+            for existing in distinct:
+                if existing.accepts(result):
+                    existing.merge(result)
+                    break
+            else:
+                distinct.append(result)
+        merged.extend(distinct)
+    return merged
@@ -0,0 +1,318 @@
+import hmac
+import json
+import os
+import secrets
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import BaseServer, ThreadingUnixStreamServer
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+from ipams.cache import ResponseCache, create_private
+from ipams.config import Config, parse_config
+from ipams.daemon import CONFIG_HEADER, ServeConfig
+from ipams.logging import logger
+
+COMMANDS = ('ip', 'host', 'network', 'subnet')
+# the HTTP API answers with the credentials of the config, so it isn't
+# reachable from other hosts
+LOOPBACK = '127.0.0.1'
+
+
+class ConnectorPool:
+    '''
+    Connectors shared by all requests of the daemon, so HTTP keep-alive
+    pools, phpIPAM tokens and memoized sections, subnets and devices are
+    reused. Connectors are rebuilt after `ttl` seconds, which bounds how
+    stale the memoized lookups get.
+    '''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._connectors: dict[str, tuple[Any, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._connectors)
+
+    def factory(self, name: str, factory: Callable[[], Any]) -> Callable[[], Any]:
+        def get() -> Any:
+            with self._lock:
+                entry = self._connectors.get(name)
+                if entry is None or monotonic() - entry[1] > self.ttl:
+                    entry = (factory(), monotonic())
+                    self._connectors[name] = entry
+                return entry[0]
+
+        return get
+
+
+class QueryService:
+    '''Answers queries with warm connectors, the config is reloaded when it changes'''
+
+    def __init__(self, config_path: Path):
+        self.config_path = config_path.resolve()
+        self.started = monotonic()
+        self._lock = Lock()
+        self._stamp: Optional[tuple[int, int]] = None
+        self._state: tuple[Config, Optional[ResponseCache], ConnectorPool]
+        self._current()
+
+    def _current(self) -> tuple[Config, Optional[ResponseCache], ConnectorPool]:
+        stat = self.config_path.stat()
+        with self._lock:
+            if self._stamp != (stat.st_mtime_ns, stat.st_size):
+                if self._stamp is not None:
+                    logger.info(f'Reloading changed config {self.config_path}')
+                parsed_config = parse_config(self.config_path)
+                cache = None
+                if parsed_config.cache.enabled:
+                    cache = ResponseCache(parsed_config.cache)
+                pool = ConnectorPool(parsed_config.serve.connector_ttl)
+                self._state = (parsed_config, cache, pool)
+                self._stamp = (stat.st_mtime_ns, stat.st_size)
+            return self._state
+
+    @property
+    def config(self) -> Config:
+        return self._current()[0]
+
+    def query(
+        self,
+        command: str,
+        query: str,
+        ordered: bool,
+        include_unassigned: bool = False,
+        limit: Optional[int] = None,
+        first: bool = False,
+        prioritize: bool = False,
+    ) -> Iterator[dict]:
+        from ipams.cli import _query_batches, _resolve
+
+        parsed_config, cache, pool = self._current()
+        method, args = _resolve(command, query, include_unassigned)
+        for name, kind, rows in _query_batches(
+            parsed_config,
+            method,
+            args,
+            ordered,
+            cache=cache,
+            pool=pool,
+            limit=limit,
+            first=first,
+            prioritize=prioritize,
+        ):
+            yield {'backend': name, 'ipam': kind, 'rows': rows}
+
+    def lookup(self, lines: Iterable[str]) -> Iterator[dict]:
+        from ipams.cli import _bulk_lookup, _read_addresses
+
+        parsed_config, cache, pool = self._current()
+        for chunk in _bulk_lookup(
+            parsed_config, _read_addresses(lines), cache=cache, pool=pool
+        ):
+            for address, matches in chunk:
+                yield {'query': address, 'matches': matches}
+
+    def status(self) -> dict:
+        parsed_config, _, pool = self._current()
+        return {
+            'config': str(self.config_path),
+            'backends': [
+                b.name for b in parsed_config.netboxes + parsed_config.phpipams
+            ],
+            'connectors': len(pool),
+            'uptime': round(monotonic() - self.started, 1),
+        }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''
+    GET /<ip|host|network|subnet>?q=<query>[&ordered=1][&include_unassigned=1]
+        [&limit=<n>][&first=1][&prioritize=1]
+    streams a JSON document per batch of rows, POST /ip with one address per
+    line streams one per address. GET /status describes the daemon.
+    Requests over HTTP need the token of the daemon.
+    '''
+
+    server: '_Server'
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        command = url.path.strip('/')
+        if command == 'status':
+            return self._send(200, self.server.service.status())
+        if command not in COMMANDS:
+            return self._send(404, {'error': f'Unknown command "{command}"'})
+        if not self._config_matches():
+            return
+        ordered = params.get('ordered', ['0'])[0] in ('1', 'true')
+        unassigned = params.get('include_unassigned', ['0'])[0] in ('1', 'true')
+        limit = params.get('limit', [''])[0]
+        if limit and not (limit.isdigit() and int(limit) > 0):
+            return self._send(400, {'error': f'Invalid limit "{limit}"'})
+        messages = self.server.service.query(
+            command,
+            params.get('q', [''])[0],
+            ordered,
+            unassigned,
+            int(limit) if limit else None,
+            params.get('first', ['0'])[0] in ('1', 'true'),
+            params.get('prioritize', ['0'])[0] in ('1', 'true'),
+        )
+        self._stream(messages)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if urlsplit(self.path).path.strip('/') != 'ip':
+            return self._send(404, {'error': 'Only /ip accepts addresses'})
+        if not self._config_matches():
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._stream(self.server.service.lookup(body.decode().splitlines()))
+
+    def _authorized(self) -> bool:
+        '''The socket is only accessible to its owner, HTTP clients send the token'''
+        token = self.server.token
+        if token is None:
+            return True
+        scheme, _, value = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(
+            value.strip().encode(), token.encode()
+        ):
+            return True
+        self._send(401, {'error': 'Missing or wrong token'})
+        return False
+
+    def _config_matches(self) -> bool:
+        '''Clients of another config file query their IPAMs themselves'''
+        client_config = self.headers.get(CONFIG_HEADER)
+        service = self.server.service
+        if client_config is None or Path(client_config) == service.config_path:
+            return True
+        self._send(409, {'error': f'Serving {service.config_path}'})
+        return False
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, messages: Iterator[dict]):
+        '''Invalid queries are answered with 400 before the stream starts'''
+        try:
+            first = next(messages, None)
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            if first is not None:
+                self.wfile.write(json.dumps(first).encode() + b'\n')
+                self.wfile.flush()
+            for message in messages:
+                self.wfile.write(json.dumps(message).encode() + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f'Client went away during "{self.requestline}"')
+
+    def log_message(self, format: str, *args):
+        logger.debug(f'{self.requestline}: {format % args}')
+
+
+class _Server(BaseServer):
+    service: QueryService
+    # required from clients as bearer token, None if the listener needs none
+    token: Optional[str] = None
+
+
+class _HTTPServer(_Server, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(_Server, ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _unlink_stale(path: Path):
+    '''Remove a socket left behind by a daemon that didn't exit cleanly'''
+    if not path.is_socket():
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except OSError:
+        path.unlink()
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f'Another daemon is listening on {path}')
+
+
+def serve(
+    config_path: Path,
+    port: Optional[int] = None,
+    on_ready: Callable[[list[str]], None] = lambda addresses: None,
+):
+    '''
+    Serve until interrupted, on the unix socket and the HTTP port if set.
+    The HTTP API only listens on the loopback interface and requires a token,
+    a new one is written to the owner-only `token_file` on every start.
+    Raises OSError if the socket or the port can't be bound.
+    '''
+    service = QueryService(config_path)
+    config: ServeConfig = service.config.serve
+    socket_path = config.socket
+    port = port if port is not None else config.port
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+    _unlink_stale(socket_path)
+    servers: list[Union[_UnixServer, _HTTPServer]] = []
+    addresses = [str(socket_path)]
+    try:
+        servers.append(_UnixServer(str(socket_path), QueryHandler))
+        # the daemon answers with the credentials of the config, like the config file
+        os.chmod(socket_path, 0o600)
+        if port is not None:
+            http = _HTTPServer((LOOPBACK, port), QueryHandler)
+            servers.append(http)
+            http.token = secrets.token_urlsafe(32)
+            create_private(config.token_file)
+            config.token_file.write_text(http.token)
+            addresses.append(f'http://{LOOPBACK}:{port}')
+    except OSError:
+        for server in servers:
+            server.server_close()
+        # the socket file is only removed if this process created it
+        if servers:
+            socket_path.unlink(missing_ok=True)
+        raise
+
+    threads = []
+    for server in servers:
+        server.service = service
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        threads.append(thread)
+    on_ready(addresses)
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        socket_path.unlink(missing_ok=True)
+        if port is not None:
+            config.token_file.unlink(missing_ok=True)
@@ -0,0 +1,470 @@
+import sqlite3
+from ipaddress import (
+    IPv4Address,
+    IPv4Network,
+    IPv6Address,
+    IPv6Network,
+    ip_interface,
+    ip_network,
+)
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, Iterable, Iterator, Literal, Optional, Union
+
+from pydantic import BaseModel
+
+from ipams.cache import create_private, default_cache_dir
+from ipams.index import PrefixIndex, decode, encode, network_range
+from ipams.logging import logger
+
+_backend_kind = Literal['netbox', 'phpipam']
+
+# rows written per transaction while syncing
+BATCH_SIZE = 1000
+
+PREFIX_COLUMNS = ('id', 'vrf', 'tenant', 'section', 'description', 'link')
+ADDRESS_COLUMNS = (
+    'id',
+    'hostname',
+    'tenant',
+    'vrf',
+    'section',
+    'device',
+    'site',
+    'device_tenant',
+    'device_link',
+    'description',
+    'link',
+    # phpIPAM subnet id the address belongs to
+    'container',
+)
+
+
+def _like_escaped(text: str) -> str:
+    '''`text` matched literally by a LIKE pattern with `ESCAPE '\\'`'''
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SnapshotConfig(BaseModel):
+    path: Path = default_cache_dir.joinpath('snapshot.sqlite')
+
+
+class Changes:
+    '''Objects of a backend changed since a previous sync'''
+
+    def __init__(self, high_water: str):
+        # inserted or updated rows
+        self.prefixes: list[dict] = []
+        self.addresses: list[dict] = []
+        self.deleted_prefixes: set[str] = set()
+        self.deleted_addresses: set[str] = set()
+        # complete set of prefix ids, others are removed with their addresses
+        self.prefix_ids: Optional[set[str]] = None
+        # containers whose complete address list is part of `addresses`
+        self.containers: set[str] = set()
+        self.high_water = high_water
+
+    def track(self, timestamp: Optional[str]):
+        '''Advance the high water mark, timestamps of a backend sort as strings'''
+        if timestamp and str(timestamp) > self.high_water:
+            self.high_water = str(timestamp)
+
+
+class SnapshotStore:
+    '''
+    Local copy of the prefixes and addresses of every backend.
+
+    Addresses are stored as fixed width big endian blobs, so the SQLite index
+    answers exact and containment lookups with a range scan. Prefixes are
+    loaded into a `PrefixIndex` for longest prefix matching.
+    '''
+
+    def __init__(self, config: SnapshotConfig):
+        self.config = config
+        self._lock = Lock()
+        # per backend: prefix index and its entries by id for in place updates
+        self._indexes: dict[str, tuple[PrefixIndex[dict], dict[str, tuple]]] = {}
+        create_private(config.path)
+        self._db = sqlite3.connect(config.path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._migrate()
+        self._db.executescript(
+            f'''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS syncs (
+                backend TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                high_water TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS prefixes (
+                backend TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                start BLOB NOT NULL,
+                prefixlen INTEGER NOT NULL,
+                {', '.join(f'{c} TEXT' for c in PREFIX_COLUMNS)},
+                synced REAL NOT NULL,
+                PRIMARY KEY (backend, id)
+            );
+            CREATE TABLE IF NOT EXISTS addresses (
+                backend TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                address BLOB NOT NULL,
+                prefixlen INTEGER NOT NULL,
+                {', '.join(f'{c} TEXT' for c in ADDRESS_COLUMNS)},
+                synced REAL NOT NULL,
+                PRIMARY KEY (backend, id)
+            );
+            CREATE INDEX IF NOT EXISTS addresses_address
+                ON addresses (backend, version, address);
+            CREATE INDEX IF NOT EXISTS addresses_container
+                ON addresses (backend, container);
+            '''
+        )
+
+    def _migrate(self):
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(addresses)')}
+        if columns and not columns >= set(ADDRESS_COLUMNS):
+            logger.warning(
+                'Snapshot format changed, run "ipams sync --full" to rebuild it'
+            )
+            self._db.executescript(
+                '''DROP TABLE IF EXISTS syncs;
+                DROP TABLE IF EXISTS prefixes;
+                DROP TABLE IF EXISTS addresses;'''
+            )
+
+    def high_water(self, backend: str) -> Optional[str]:
+        '''Newest change timestamp seen by the last sync, None without a sync'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT high_water FROM syncs WHERE backend = ?', (backend,)
+            ).fetchone()
+        return row[0] if row and row[0] else None
+
+    def prefix_ids(self, backend: str) -> set[str]:
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id FROM prefixes WHERE backend = ?', (backend,)
+            )
+            return {row[0] for row in rows}
+
+    def address_ids(self, backend: str) -> set[str]:
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id FROM addresses WHERE backend = ?', (backend,)
+            )
+            return {row[0] for row in rows}
+
+    def synced_at(self, backend: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT synced_at FROM syncs WHERE backend = ?', (backend,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def replace(
+        self,
+        backend: str,
+        kind: _backend_kind,
+        prefixes: Iterable[dict],
+        addresses: Iterable[dict],
+        high_water: Callable[[], str] = str,
+    ) -> tuple[int, int]:
+        '''
+        Replace the snapshot of a backend. Rows are written in small batches
+        while they are fetched, rows not seen during this sync are removed
+        at the end. `high_water` is called once all rows are fetched. If
+        fetching fails, the error is raised before anything is removed and
+        the previous sync stays recorded.
+        '''
+        synced = time()
+        prefix_count = self._upsert('prefixes', backend, prefixes, synced)
+        address_count = self._upsert('addresses', backend, addresses, synced)
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM prefixes WHERE backend = ? AND synced < ?',
+                (backend, synced),
+            )
+            self._db.execute(
+                'DELETE FROM addresses WHERE backend = ? AND synced < ?',
+                (backend, synced),
+            )
+            self._set_synced(backend, kind, synced, high_water())
+            self._db.commit()
+            self._indexes.pop(backend, None)
+        return prefix_count, address_count
+
+    def apply(
+        self, backend: str, kind: _backend_kind, changes: Changes
+    ) -> tuple[int, int]:
+        '''Apply incremental changes to the stored rows and a loaded prefix index'''
+        synced = time()
+        self._upsert('prefixes', backend, changes.prefixes, synced)
+        self._upsert('addresses', backend, changes.addresses, synced)
+        with self._lock:
+            deleted_prefixes = set(changes.deleted_prefixes)
+            if changes.prefix_ids is not None:
+                rows = self._db.execute(
+                    'SELECT id FROM prefixes WHERE backend = ?', (backend,)
+                )
+                gone = {row[0] for row in rows} - changes.prefix_ids
+                deleted_prefixes |= gone
+                changes.containers |= gone
+            for container in changes.containers:
+                self._db.execute(
+                    '''DELETE FROM addresses
+                    WHERE backend = ? AND container = ? AND synced < ?''',
+                    (backend, container, synced),
+                )
+            self._db.executemany(
+                'DELETE FROM prefixes WHERE backend = ? AND id = ?',
+                [(backend, id) for id in deleted_prefixes],
+            )
+            self._db.executemany(
+                'DELETE FROM addresses WHERE backend = ? AND id = ?',
+                [(backend, id) for id in changes.deleted_addresses],
+            )
+            self._set_synced(backend, kind, synced, changes.high_water)
+            self._db.commit()
+            if backend in self._indexes:
+                self._update_index(backend, changes.prefixes, deleted_prefixes)
+        return (
+            len(changes.prefixes) + len(deleted_prefixes),
+            len(changes.addresses) + len(changes.deleted_addresses),
+        )
+
+    def _set_synced(
+        self, backend: str, kind: _backend_kind, synced: float, high_water: str
+    ):
+        self._db.execute(
+            '''INSERT OR REPLACE INTO syncs (backend, kind, synced_at, high_water)
+            VALUES (?, ?, ?, ?)''',
+            (backend, kind, synced, high_water),
+        )
+
+    def _update_index(self, backend: str, prefixes: list[dict], deleted: set[str]):
+        index, entries = self._indexes[backend]
+        for id in deleted | {str(prefix['id']) for prefix in prefixes}:
+            if id in entries:
+                index.remove(*entries.pop(id))
+        for prefix in prefixes:
+            network = ip_network(prefix['prefix'], strict=False)
+            item = {c: str(prefix.get(c) or '') for c in PREFIX_COLUMNS}
+            item['prefix'] = network.compressed
+            index.add(network, item)
+            entries[item['id']] = (network, item)
+
+    def _upsert(
+        self, table: str, backend: str, rows: Iterable[dict], synced: float
+    ) -> int:
+        columns: tuple[str, ...]
+        if table == 'prefixes':
+            columns = ('backend', 'version', 'start', 'prefixlen') + PREFIX_COLUMNS
+        else:
+            columns = ('backend', 'version', 'address', 'prefixlen') + ADDRESS_COLUMNS
+        statement = (
+            f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}, synced) '
+            + f'VALUES ({", ".join("?" for _ in columns)}, ?)'
+        )
+        count = 0
+        iterator = iter(rows)
+        while batch := list(islice(iterator, BATCH_SIZE)):
+            values = [
+                self._row_values(table, backend, row) + (synced,) for row in batch
+            ]
+            with self._lock:
+                self._db.executemany(statement, values)
+                self._db.commit()
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def _row_values(table: str, backend: str, row: dict) -> tuple:
+        if table == 'prefixes':
+            network = ip_network(row['prefix'], strict=False)
+            return (
+                backend,
+                network.version,
+                encode(network.network_address),
+                network.prefixlen,
+            ) + tuple(str(row.get(c) or '') for c in PREFIX_COLUMNS)
+        interface = ip_interface(row['address'])
+        return (
+            backend,
+            interface.version,
+            encode(interface.ip),
+            interface.network.prefixlen,
+        ) + tuple(str(row.get(c) or '') for c in ADDRESS_COLUMNS)
+
+    def prefix_index(self, backend: str) -> PrefixIndex[dict]:
+        with self._lock:
+            if backend not in self._indexes:
+                index: PrefixIndex[dict] = PrefixIndex()
+                entries: dict[str, tuple] = {}
+                for row in self._db.execute(
+                    'SELECT * FROM prefixes WHERE backend = ?', (backend,)
+                ):
+                    prefix = self._prefix(row)
+                    network = ip_network(prefix['prefix'])
+                    index.add(network, prefix)
+                    entries[prefix['id']] = (network, prefix)
+                self._indexes[backend] = (index, entries)
+            return self._indexes[backend][0]
+
+    def prefixes_matching(self, backend: str, query: str) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT * FROM prefixes WHERE backend = ?
+                AND description LIKE ? ESCAPE '\\' ORDER BY start''',
+                (backend, f'%{_like_escaped(query)}%'),
+            ).fetchall()
+        return [self._prefix(row) for row in rows]
+
+    def addresses_in(
+        self,
+        backend: str,
+        network: Union[IPv4Network, IPv6Network, IPv4Address, IPv6Address],
+    ) -> list[dict]:
+        network = ip_network(network)
+        first, last = network_range(network)
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT * FROM addresses WHERE backend = ? AND version = ?
+                AND address BETWEEN ? AND ? ORDER BY address''',
+                (backend, network.version, first, last),
+            ).fetchall()
+        return [self._address(row) for row in rows]
+
+    def entries(
+        self, backend: str, type: Literal['prefix', 'address']
+    ) -> Iterator[tuple[int, bytes, int, str, str, str]]:
+        '''
+        (version, encoded address, prefix length, hostname, description,
+        link) of all prefixes or addresses of a backend, for bulk comparisons
+        '''
+        if type == 'prefix':
+            query = '''SELECT version, start, prefixlen, '', description, link
+                FROM prefixes WHERE backend = ?'''
+        else:
+            query = '''SELECT version, address, prefixlen, hostname, description, link
+                FROM addresses WHERE backend = ?'''
+        with self._lock:
+            rows = self._db.execute(query, (backend,)).fetchall()
+        return iter(rows)
+
+    @staticmethod
+    def _prefix(row: sqlite3.Row) -> dict:
+        prefix = dict(row)
+        prefix['prefix'] = f'{decode(row["start"], row["version"])}/{row["prefixlen"]}'
+        return prefix
+
+    @staticmethod
+    def _address(row: sqlite3.Row) -> dict:
+        address = dict(row)
+        address['ip'] = str(decode(row['address'], row['version']))
+        address['address'] = f'{address["ip"]}/{row["prefixlen"]}'
+        return address
+
+
+class SnapshotConnector:
+    '''Answers queries of a single backend from the local snapshot'''
+
+    def __init__(self, store: SnapshotStore, config, kind: _backend_kind):
+        self.store = store
+        self.name = config.name
+        self.kind = kind
+        if store.synced_at(self.name) is None:
+            logger.warning(f'No snapshot for "{self.name}", run "ipams sync" first')
+
+    def query_ip(self, ip: Union[IPv4Address, IPv6Address]) -> Iterator[dict]:
+        return self._address_rows(self.store.addresses_in(self.name, ip))
+
+    def query_ips(
+        self, ips: list[Union[IPv4Address, IPv6Address]]
+    ) -> dict[str, list[dict]]:
+        context = ('vrf', 'tenant') if self.kind == 'netbox' else ('section',)
+        return {
+            str(ip): [
+                {
+                    'address': address['address' if self.kind == 'netbox' else 'ip'],
+                    'hostname': address['hostname'],
+                    **{column: address[column] for column in context},
+                    'description': address['description'],
+                    'link': address['link'],
+                }
+                for address in self.store.addresses_in(self.name, ip)
+            ]
+            for ip in ips
+        }
+
+    def query_subnet_by_cidr(
+        self, cidr: Union[IPv4Network, IPv6Network], include_unassigned: bool = False
+    ) -> Iterator[dict]:
+        addresses = self.store.addresses_in(self.name, cidr)
+        if self.kind == 'phpipam':
+            yield from self._address_rows(
+                address
+                for address in addresses
+                if include_unassigned or address['hostname']
+            )
+            return
+        for address in addresses:
+            if address['device'] or include_unassigned:
+                yield {
+                    # like NetBox, the tenant of the device if there is one
+                    'tenant': address['device_tenant'] or address['tenant'],
+                    'site': address['site'],
+                    'device': address['device'],
+                    'address': address['address'],
+                    'link': address['device_link'] or address['link'],
+                }
+
+    def query_network_by_address(
+        self, network: Union[IPv4Network, IPv6Network]
+    ) -> Iterator[dict]:
+        index = self.store.prefix_index(self.name)
+        return self._network_rows(prefix for _, prefix in index.covering(network))
+
+    def query_network_by_string(self, query: str) -> Iterator[dict]:
+        return self._network_rows(self.store.prefixes_matching(self.name, query))
+
+    def _address_rows(self, addresses: Iterable[dict]) -> Iterator[dict]:
+        for address in addresses:
+            if self.kind == 'netbox':
+                yield {
+                    'vrf': address['vrf'],
+                    'tenant': address['tenant'],
+                    'address': address['address'],
+                    'hostname': address['hostname'],
+                    'description': address['description'],
+                    'link': address['link'],
+                }
+            else:
+                yield {
+                    'address': address['ip'],
+                    'hostname': address['hostname'],
+                    'section': address['section'],
+                    'description': address['description'],
+                    'link': address['link'],
+                }
+
+    def _network_rows(self, prefixes: Iterable[dict]) -> Iterator[dict]:
+        for prefix in prefixes:
+            if self.kind == 'netbox':
+                yield {
+                    'network': prefix['prefix'],
+                    'vrf': prefix['vrf'],
+                    'tenant': prefix['tenant'],
+                    'description': prefix['description'],
+                    'link': prefix['link'],
+                }
+            else:
+                yield {
+                    'network': prefix['prefix'],
+                    'section': prefix['section'],
+                    'description': prefix['description'],
+                    'link': prefix['link'],
+                }
@@ -0,0 +1,81 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Optional
+
+from ipams.cache import default_cache_dir
+from ipams.logging import logger
+
+default_token_path = default_cache_dir.joinpath('tokens.json')
+
+# tokens expiring within this many seconds are not reused
+EXPIRY_MARGIN = 60
+
+
+class TokenStore:
+    '''
+    API tokens with their expiry, persisted between CLI invocations.
+    The file is only readable by the current user.
+    '''
+
+    def __init__(self, path: Path = default_token_path):
+        self.path = path
+        self._lock = Lock()
+        self._login_locks: dict[str, Lock] = {}
+        self._tokens: Optional[dict[str, dict]] = None
+
+    def login_lock(self, key: str) -> Lock:
+        '''Held while logging in, so connectors of the same IPAM log in once'''
+        with self._lock:
+            return self._login_locks.setdefault(key, Lock())
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or entry['expires'] - EXPIRY_MARGIN < time():
+            return None
+        return entry['token']
+
+    def set(self, key: str, token: str, expires: float):
+        with self._lock:
+            self._load()[key] = {'token': token, 'expires': expires}
+            self._save()
+
+    def invalidate(self, key: str, token: str):
+        '''Forget `token` unless it was already replaced by a fresh one'''
+        with self._lock:
+            tokens = self._load()
+            if tokens.get(key, {}).get('token') == token:
+                del tokens[key]
+                self._save()
+
+    def _load(self) -> dict[str, dict]:
+        if self._tokens is None:
+            try:
+                self._tokens = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                self._tokens = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring unreadable token store "{self.path}": {e}')
+                self._tokens = {}
+        return self._tokens
+
+    def _save(self):
+        now = time()
+        tokens = {
+            key: entry
+            for key, entry in (self._tokens or {}).items()
+            if entry['expires'] > now
+        }
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        temporary = self.path.with_suffix('.tmp')
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temporary, self.path)
+
+
+# shared by all connectors of the process
+token_store = TokenStore()
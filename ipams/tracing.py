@@ -0,0 +1,218 @@
+from contextlib import contextmanager
+from threading import Lock, current_thread, local
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Iterator, Optional
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    import requests
+
+# set on responses served from the response cache
+CACHE_HEADER = 'X-Ipams-Cache'
+# set on responses of retried requests to the number of retries
+RETRY_HEADER = 'X-Ipams-Retries'
+
+
+def endpoint(url: str, api_path: str) -> str:
+    '''Path of a request below the API, ids and addresses replaced by `{id}`'''
+    path = urlsplit(url).path.removeprefix(api_path)
+    segments = [
+        '{id}' if segment.isdigit() or '.' in segment or ':' in segment else segment
+        for segment in path.split('/')
+        if segment
+    ]
+    return '/' + '/'.join(segments) + '/'
+
+
+class Tracer:
+    '''
+    Collects a span per HTTP request of the connectors, nested in a span per
+    backend query and the span of the command. Disabled unless started, the
+    connectors then don't hook their sessions at all.
+    '''
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = Lock()
+        self._local = local()
+        self._spans: list[dict] = []
+        # backend name -> id of its running query span
+        self._running: dict[str, int] = {}
+        # backend name -> path of its API
+        self._api_paths: dict[str, str] = {}
+        self._started = 0.0
+        self._started_at = 0.0
+
+    def start(self, name: str):
+        self.enabled = True
+        self._started = perf_counter()
+        self._started_at = time()
+        self._spans = [
+            {'id': 0, 'parent': None, 'name': name, 'kind': 'command', 'start': 0.0}
+        ]
+
+    def finish(self) -> dict:
+        '''The trace of the command, spans are in seconds since it started'''
+        with self._lock:
+            spans = [dict(span) for span in self._spans]
+        spans[0]['duration'] = perf_counter() - self._started
+        return {'started_at': self._started_at, 'spans': spans}
+
+    @contextmanager
+    def span(self, backend: str) -> Iterator[None]:
+        '''Time the query of a backend, requests made meanwhile are nested in it'''
+        if not self.enabled:
+            yield
+            return
+        span = self._add({'parent': 0, 'name': backend, 'kind': 'backend'})
+        with self._lock:
+            self._running[backend] = span['id']
+        try:
+            yield
+        finally:
+            span['duration'] = self._now() - span['start']
+            with self._lock:
+                if self._running.get(backend) == span['id']:
+                    del self._running[backend]
+
+    @contextmanager
+    def retry(self) -> Iterator[None]:
+        '''Requests of this thread are marked as retries'''
+        self._local.retry = True
+        try:
+            yield
+        finally:
+            self._local.retry = False
+
+    def attempt(
+        self,
+        backend: str,
+        request: 'requests.PreparedRequest',
+        status: Optional[int],
+        duration: float,
+        retry: bool,
+    ):
+        '''
+        Record a failed attempt of a request that is retried, `status` is None
+        for connection errors and timeouts
+        '''
+        if not self.enabled:
+            return
+        self._request(backend, request, status, 0, False, retry, duration)
+
+    def instrument(self, session: 'requests.Session', backend: str, api_url: str):
+        '''Record a span per response of `session`'''
+        if not self.enabled:
+            return
+        with self._lock:
+            self._api_paths[backend] = urlsplit(api_url).path.rstrip('/')
+
+        def hook(response: 'requests.Response', *args, **kwargs):
+            download = 0.0
+            if kwargs.get('stream'):
+                size = int(response.headers.get('Content-Length') or 0)
+            else:
+                started = perf_counter()
+                size = len(response.content)
+                download = perf_counter() - started
+            duration = response.elapsed.total_seconds() + download
+            self._request(
+                backend,
+                response.request,
+                response.status_code,
+                size,
+                CACHE_HEADER in response.headers,
+                getattr(self._local, 'retry', False)
+                or RETRY_HEADER in response.headers,
+                duration,
+            )
+            return response
+
+        session.hooks['response'].append(hook)
+
+    def _request(
+        self,
+        backend: str,
+        request: 'requests.PreparedRequest',
+        status: Optional[int],
+        size: int,
+        cached: bool,
+        retry: bool,
+        duration: float,
+    ):
+        with self._lock:
+            parent = self._running.get(backend, 0)
+            api_path = self._api_paths.get(backend, '')
+        self._add(
+            {
+                'parent': parent,
+                'name': f'{request.method} {endpoint(request.url or "", api_path)}',
+                'kind': 'request',
+                'backend': backend,
+                'url': request.url,
+                'status': status,
+                'bytes': size,
+                'cached': cached,
+                'retry': retry,
+                'thread': current_thread().name,
+            },
+            duration,
+        )
+
+    def summary(self) -> list[dict]:
+        '''Requests per backend and endpoint, slowest total first'''
+        rows: dict[tuple[str, str], dict] = {}
+        with self._lock:
+            requests = [span for span in self._spans if span['kind'] == 'request']
+        for span in requests:
+            row = rows.setdefault(
+                (span['backend'], span['name']),
+                {
+                    'backend': span['backend'],
+                    'endpoint': span['name'],
+                    'requests': 0,
+                    'cached': 0,
+                    'retries': 0,
+                    'errors': 0,
+                    'bytes': 0,
+                    'seconds': 0.0,
+                    'slowest': 0.0,
+                },
+            )
+            row['requests'] += 1
+            row['cached'] += span['cached']
+            row['retries'] += span['retry']
+            row['errors'] += span['status'] is None or span['status'] >= 400
+            row['bytes'] += span['bytes']
+            row['seconds'] += span['duration']
+            row['slowest'] = max(row['slowest'], span['duration'])
+        return sorted(rows.values(), key=lambda row: -row['seconds'])
+
+    def backends(self) -> dict[str, float]:
+        '''Wall time of each backend, summed over its queries'''
+        seconds: dict[str, float] = {}
+        with self._lock:
+            for span in self._spans:
+                if span['kind'] == 'backend' and 'duration' in span:
+                    seconds[span['name']] = (
+                        seconds.get(span['name'], 0.0) + span['duration']
+                    )
+        return seconds
+
+    def _now(self) -> float:
+        return perf_counter() - self._started
+
+    def _add(self, span: dict, duration: Optional[float] = None) -> dict:
+        now = self._now()
+        with self._lock:
+            span['id'] = len(self._spans)
+            if duration is None:
+                span['start'] = now
+            else:
+                span['start'] = now - duration
+                span['duration'] = duration
+            self._spans.append(span)
+        return span
+
+
+tracer = Tracer()
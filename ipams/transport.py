@@ -0,0 +1,275 @@
+import json
+import os
+import random
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from ipams.cache import ResponseCache, default_cache_dir
+from ipams.logging import logger
+from ipams.tracing import CACHE_HEADER, RETRY_HEADER, tracer
+
+# responses worth remembering, phpIPAM answers searches without results with 404
+CACHEABLE_STATUS = (200, 404)
+# idempotent requests are retried on these statuses and on connection errors
+RETRY_METHODS = ('GET', 'HEAD')
+RETRY_STATUS = (429, 502, 503, 504)
+# seconds before the first retry, doubled per attempt, half of it is jitter
+BACKOFF = 0.5
+MAX_BACKOFF = 10.0
+# failed attempts in a row after which the circuit of a backend opens
+FAILURE_THRESHOLD = 3
+# seconds requests to a backend with an open circuit fail right away
+OPEN_SECONDS = 60
+
+default_breaker_path = default_cache_dir.joinpath('breakers.json')
+
+
+class BackendUnavailable(requests.ConnectionError):
+    '''A request to a backend whose circuit is open, it is not sent'''
+
+
+class CircuitBreakers:
+    '''
+    Consecutive failures (connection errors, timeouts and server errors) per
+    backend. After `FAILURE_THRESHOLD` of them the circuit of the backend
+    opens and its requests fail immediately for `OPEN_SECONDS`. Open circuits
+    are persisted, so following invocations skip the backend as well. Then
+    requests are sent again, a success closes the circuit.
+    '''
+
+    def __init__(self, path: Path = default_breaker_path):
+        self.path = path
+        self._lock = Lock()
+        self._failures: dict[str, int] = {}
+        # backend url -> time until which its circuit is open
+        self._open: Optional[dict[str, float]] = None
+
+    def check(self, key: str, name: str):
+        with self._lock:
+            until = self._load().get(key, 0.0)
+        if until > time():
+            raise BackendUnavailable(
+                f'"{name}" is unavailable after repeated failures, '
+                + f'skipped for another {until - time():.0f}s'
+            )
+
+    def failure(self, key: str, name: str):
+        with self._lock:
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            if failures < FAILURE_THRESHOLD:
+                return
+            self._failures[key] = 0
+            self._load()[key] = time() + OPEN_SECONDS
+            self._save()
+        logger.warning(
+            f'"{name}" failed {failures} times, skipping it for {OPEN_SECONDS}s'
+        )
+
+    def success(self, key: str):
+        with self._lock:
+            self._failures.pop(key, None)
+            if key in self._load():
+                del self._load()[key]
+                self._save()
+
+    def _load(self) -> dict[str, float]:
+        if self._open is None:
+            try:
+                self._open = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                self._open = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f'Ignoring unreadable circuit state "{self.path}": {e}')
+                self._open = {}
+        return self._open
+
+    def _save(self):
+        now = time()
+        circuits = {
+            key: until for key, until in (self._open or {}).items() if until > now
+        }
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            temporary = self.path.with_suffix('.tmp')
+            temporary.write_text(json.dumps(circuits))
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.debug(f'Could not save circuit state in {self.path}: {e}')
+
+
+class RateLimiter:
+    '''Spaces the requests of a backend at least 1 / `rate` seconds apart'''
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._lock = Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+
+# shared by all connectors of the process
+breakers = CircuitBreakers()
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = Lock()
+
+
+def _limiter(key: str, rate: Optional[float]) -> Optional[RateLimiter]:
+    if not rate:
+        return None
+    with _limiters_lock:
+        return _limiters.setdefault(key, RateLimiter(rate))
+
+
+class TransportAdapter(HTTPAdapter):
+    '''
+    Requests of a backend with connect and read timeouts, retries of
+    idempotent requests with jittered exponential backoff, the rate limit of
+    the backend and its circuit breaker
+    '''
+
+    def __init__(self, backend, pool_size: int):
+        super().__init__(pool_maxsize=pool_size)
+        self.backend = backend
+        self.key = backend.url.rstrip('/')
+        self.limiter = _limiter(self.key, backend.rate_limit)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (
+                self.backend.connect_timeout,
+                self.backend.read_timeout,
+            )
+        retries = self.backend.retries if request.method in RETRY_METHODS else 0
+        attempt = 0
+        while True:
+            breakers.check(self.key, self.backend.name)
+            if self.limiter:
+                self.limiter.wait()
+            retry_after = None
+            started = monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breakers.failure(self.key, self.backend.name)
+                if attempt >= retries:
+                    raise
+                reason = str(e)
+                status = None
+            else:
+                if response.status_code >= 500:
+                    breakers.failure(self.key, self.backend.name)
+                else:
+                    breakers.success(self.key)
+                if response.status_code not in RETRY_STATUS or attempt >= retries:
+                    if attempt:
+                        response.headers[RETRY_HEADER] = str(attempt)
+                    return response
+                reason = f'status {response.status_code}'
+                status = response.status_code
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+            # the session's hooks only see the last attempt
+            tracer.attempt(
+                self.backend.name, request, status, monotonic() - started, attempt > 0
+            )
+            delay = self._backoff(attempt, retry_after)
+            logger.debug(f'Retrying "{request.url}" in {delay:.1f}s: {reason}')
+            sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+        delay = min(BACKOFF * 2**attempt, MAX_BACKOFF)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CachingAdapter(TransportAdapter):
+    '''Serves GET requests of a backend from the response cache when fresh'''
+
+    def __init__(self, cache: ResponseCache, backend, api_url: str, pool_size: int):
+        super().__init__(backend, pool_size)
+        self.cache = cache
+        self.api_path = urlsplit(api_url).path.rstrip('/')
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+
+        endpoint, params = self._endpoint(request.url)
+        ttl = self.cache.ttl(self.backend, endpoint)
+        key = f'{self.backend.name}|{endpoint}|{params}'
+        cached = self.cache.get(key, ttl)
+        if cached is not None:
+            logger.debug(f'Cache hit for "{request.url}"')
+            return self._build_response(
+                request, cached.status, cached.headers, cached.body
+            )
+
+        response = super().send(request, **kwargs)
+        if ttl > 0 and response.status_code in CACHEABLE_STATUS:
+            self.cache.set(
+                key,
+                self.backend.name,
+                endpoint,
+                response.status_code,
+                {'Content-Type': response.headers.get('Content-Type', '')},
+                response.content,
+            )
+        return response
+
+    def _endpoint(self, url: str) -> tuple[str, str]:
+        parts = urlsplit(url)
+        path = parts.path.removeprefix(self.api_path)
+        path = '/' + '/'.join(s for s in path.split('/') if s) + '/'
+        return path, urlencode(sorted(parse_qsl(parts.query)))
+
+    @staticmethod
+    def _build_response(request, status: int, headers: dict, body: bytes):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({**headers, CACHE_HEADER: 'hit'})
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        response.reason = 'Cached'
+        return response
+
+
+def mount_transport(
+    session: requests.Session,
+    backend,
+    api_url: str,
+    cache: Optional[ResponseCache] = None,
+    *,
+    pool_size: int,
+):
+    '''
+    Send the requests of `session` to the backend through a `TransportAdapter`,
+    those to `api_url` through the response cache first if there is one.
+    `pool_size` connections are kept alive, as many as requests are sent at once.
+    '''
+    session.verify = backend.verify_ssl
+    session.mount(
+        backend.url.rstrip('/') + '/', TransportAdapter(backend, pool_size=pool_size)
+    )
+    if cache is None:
+        return
+    adapter = CachingAdapter(cache, backend, api_url, pool_size=pool_size)
+    session.mount(api_url.rstrip('/') + '/', adapter)
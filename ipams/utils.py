@@ -0,0 +1,33 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
+
+A = TypeVar('A')
+R = TypeVar('R')
+
+
+def chunks(items: Iterable, size: int) -> Iterator[list]:
+    '''Split `items` into lists of at most `size` elements, consuming lazily'''
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def prefetched(func: Callable[[A], R], items: Iterable[A], ahead: int) -> Iterator[R]:
+    '''
+    `map(func, items)` in order, with up to `ahead` calls running in the
+    background while the caller consumes the previous results.
+    '''
+    pool = ThreadPoolExecutor(max_workers=max(1, ahead))
+    pending: deque[Future[R]] = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) > ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # a consumer that stops early doesn't wait for the remaining calls
+        pool.shutdown(wait=False, cancel_futures=True)
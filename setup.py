@@ -31,6 +31,7 @@ setup(
     license='MIT',
     packages=['ipams'],
     install_requires=required,
+    extras_require={'diff': ['numpy'], 'brotli': ['brotli'], 'parquet': ['pyarrow']},
     entry_points={'console_scripts': ['ipams = ipams.__main__:main']},
     classifiers=[
         'Programming Language :: Python :: 3.6',
@@ -0,0 +1,95 @@
+import numpy as np
+
+from ipams.diff import Inventory, _unique, diff, join
+
+
+def keys(*values: int) -> list[np.ndarray]:
+    return [np.array(values, np.uint32)]
+
+
+def test_join_matches_and_one_sided_keys():
+    only_left, only_right, pairs_left, pairs_right = join(keys(5, 1, 3), keys(3, 4, 1))
+    assert only_left.tolist() == [0]
+    assert only_right.tolist() == [1]
+    assert pairs_left.tolist() == [1, 2]
+    assert pairs_right.tolist() == [2, 0]
+
+
+def test_join_with_an_empty_side():
+    only_left, only_right, pairs_left, pairs_right = join(keys(2, 1), keys())
+    assert only_left.tolist() == [1, 0]
+    assert only_right.tolist() == []
+    assert pairs_left.tolist() == pairs_right.tolist() == []
+
+    only_left, only_right, pairs_left, pairs_right = join(keys(), keys(7))
+    assert only_left.tolist() == []
+    assert only_right.tolist() == [0]
+    assert pairs_left.tolist() == pairs_right.tolist() == []
+
+
+def test_join_compares_all_key_columns():
+    # IPv6 keys: the high words are equal, the low words differ
+    high = np.array([1, 1], np.uint64)
+    left = [high, np.array([2, 3], np.uint64)]
+    right = [high[:1], np.array([3], np.uint64)]
+    only_left, only_right, pairs_left, pairs_right = join(left, right)
+    assert only_left.tolist() == [0]
+    assert only_right.tolist() == []
+    assert list(zip(pairs_left.tolist(), pairs_right.tolist())) == [(1, 0)]
+
+
+def test_unique_keeps_the_first_entry_per_key():
+    assert _unique(keys(4, 2, 4, 2, 9)).tolist() == [1, 0, 4]
+    assert _unique(keys()).tolist() == []
+
+
+def test_unique_prefixes_differ_by_length():
+    addresses = np.array([10, 10, 10], np.uint32)
+    prefixlens = np.array([24, 16, 24], np.uint8)
+    assert _unique([addresses, prefixlens]).tolist() == [1, 0]
+
+
+def test_join_of_duplicates_after_unique():
+    left, right = keys(1, 1, 2), keys(2, 2, 3)
+    left_index, right_index = _unique(left), _unique(right)
+    only_left, only_right, pairs_left, pairs_right = join(
+        [column[left_index] for column in left],
+        [column[right_index] for column in right],
+    )
+    assert left_index[only_left].tolist() == [0]
+    assert right_index[only_right].tolist() == [2]
+    assert left_index[pairs_left].tolist() == [2]
+    assert right_index[pairs_right].tolist() == [0]
+
+
+def inventory(name: str, rows: list[dict]) -> Inventory:
+    inventory = Inventory(name)
+    inventory.add_rows('address', rows)
+    return inventory
+
+
+def test_diff_reports_missing_and_mismatching_entries():
+    left = inventory(
+        'left',
+        [
+            {'address': '10.0.0.1/24', 'hostname': 'a.example.'},
+            {'address': '10.0.0.2/24', 'hostname': 'b'},
+            # the same address in another VRF counts once
+            {'address': '10.0.0.2/24', 'hostname': 'other'},
+            {'address': '2001:db8::1/64', 'hostname': 'v6'},
+        ],
+    )
+    right = inventory(
+        'right',
+        [
+            {'address': '10.0.0.1/32', 'hostname': 'A.example'},
+            {'address': '10.0.0.2/32', 'hostname': 'c'},
+            {'address': '2001:db8::2/64', 'hostname': 'v6'},
+        ],
+    )
+    rows = [(row['address'], row['issue']) for row in diff(left, right)]
+    assert rows == [
+        ('10.0.0.2', 'hostname'),
+        ('2001:db8::1', 'missing in right'),
+        ('2001:db8::2', 'missing in left'),
+    ]
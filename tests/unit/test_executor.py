@@ -0,0 +1,107 @@
+from threading import Event
+from time import monotonic, sleep
+
+from ipams.executor import BackendTask, QueryExecutor
+
+
+def returning(value, seconds: float = 0.0):
+    def func():
+        sleep(seconds)
+        return value
+
+    return func
+
+
+def names(results) -> list[tuple[str, object]]:
+    return [(task.name, result) for task, result in results]
+
+
+def test_results_arrive_as_tasks_complete():
+    tasks = [
+        BackendTask('slow', returning('a', 0.2)),
+        BackendTask('fast', returning('b')),
+    ]
+    assert names(QueryExecutor().run(tasks)) == [('fast', 'b'), ('slow', 'a')]
+
+
+def test_ordered_results_follow_the_tasks():
+    tasks = [
+        BackendTask('slow', returning('a', 0.2)),
+        BackendTask('fast', returning('b')),
+    ]
+    results = QueryExecutor(ordered=True).run(tasks)
+    assert names(results) == [('slow', 'a'), ('fast', 'b')]
+
+
+def test_first_yields_the_first_task_with_results():
+    tasks = [
+        BackendTask('slow', returning(['a'], 0.2)),
+        BackendTask('empty', returning([])),
+        BackendTask('fast', returning(['b'], 0.05)),
+    ]
+    started = monotonic()
+    results = QueryExecutor(first=True).run(tasks)
+    assert names(results) == [('fast', ['b'])]
+    # the slow task isn't waited for
+    assert monotonic() - started < 0.2
+
+
+def test_first_ignores_ordered():
+    tasks = [
+        BackendTask('slow', returning(['a'], 0.2)),
+        BackendTask('fast', returning(['b'])),
+    ]
+    results = QueryExecutor(ordered=True, first=True).run(tasks)
+    assert names(results) == [('fast', ['b'])]
+
+
+def test_timed_out_tasks_are_abandoned():
+    tasks = [
+        BackendTask('hanging', returning('a', 2), timeout=0.1),
+        BackendTask('fast', returning('b'), timeout=0.1),
+    ]
+    started = monotonic()
+    assert names(QueryExecutor().run(tasks)) == [('fast', 'b')]
+    assert monotonic() - started < 1
+
+
+def test_failed_tasks_are_skipped():
+    def fail():
+        raise ValueError('unreachable')
+
+    tasks = [BackendTask('broken', fail), BackendTask('working', returning('b'))]
+    assert names(QueryExecutor(ordered=True).run(tasks)) == [('working', 'b')]
+
+
+def test_stream_batches_items():
+    tasks = [BackendTask('rows', returning(range(5)))]
+    batches = QueryExecutor().stream(tasks, batch_size=2)
+    assert names(batches) == [('rows', [0, 1]), ('rows', [2, 3]), ('rows', [4])]
+
+
+def test_closing_the_results_cancels_the_tasks():
+    release = Event()
+    closed = Event()
+    queued = Event()
+
+    def rows():
+        try:
+            yield 1
+            release.wait()
+            yield 2
+        finally:
+            closed.set()
+
+    def other():
+        queued.set()
+        return [3]
+
+    tasks = [BackendTask('streaming', rows), BackendTask('queued', other)]
+    batches = QueryExecutor(concurrency=1).stream(tasks, batch_size=1)
+    assert names([next(batches)]) == [('streaming', [1])]
+    batches.close()
+    release.set()
+    # the streaming task stops paging and the queued one never starts
+    assert closed.wait(1)
+    sleep(0.1)
+    assert not queued.is_set()
@@ -0,0 +1,97 @@
+from ipaddress import ip_network
+
+from ipams.free import Allocations
+
+
+def usage(parent: str, prefixes: list[str] = [], addresses: list[str] = []):
+    network = ip_network(parent)
+    allocations = Allocations([network])
+    allocations.add_rows('prefix', [{'prefix': prefix} for prefix in prefixes])
+    allocations.add_rows('address', [{'address': address} for address in addresses])
+    return allocations.usage(network)
+
+
+def prefixes(rows) -> list[str]:
+    return [row['prefix'] for row in rows]
+
+
+def test_aligned_gaps():
+    result = usage('10.0.0.0/24', ['10.0.0.0/26', '10.0.0.128/26'])
+    assert result.allocated == 128
+    assert result.utilization == 0.5
+    assert prefixes(result.rows()) == ['10.0.0.64/26', '10.0.0.192/26']
+    assert prefixes(result.rows(27)) == [
+        '10.0.0.64/27',
+        '10.0.0.96/27',
+        '10.0.0.192/27',
+        '10.0.0.224/27',
+    ]
+    assert result.count(27) == 4
+    assert result.count(25) == 0
+
+
+def test_unaligned_gaps():
+    # addresses carry the prefix length of their interface, it is ignored
+    result = usage('10.0.0.0/29', addresses=['10.0.0.1/24'])
+    assert result.allocated == 1
+    assert result.free == [(0x0A000000, 0x0A000000), (0x0A000002, 0x0A000007)]
+    assert prefixes(result.rows()) == ['10.0.0.0/32', '10.0.0.2/31', '10.0.0.4/30']
+    assert prefixes(result.rows(30)) == ['10.0.0.4/30']
+    assert result.count(30) == 1
+    assert prefixes(result.rows(31)) == ['10.0.0.2/31', '10.0.0.4/31', '10.0.0.6/31']
+    assert result.count(31) == 3
+
+
+def test_parent_fully_allocated():
+    # overlapping allocations count once
+    result = usage(
+        '10.0.0.0/24',
+        ['10.0.0.0/25', '10.0.0.128/25', '10.0.0.128/26'],
+        ['10.0.0.130'],
+    )
+    assert result.allocated == 256
+    assert result.utilization == 1
+    assert result.free == []
+    assert list(result.rows()) == []
+    assert result.count(32) == 0
+
+
+def test_prefix_equal_to_the_parent():
+    result = usage('10.0.0.0/24', ['10.0.0.0/24'])
+    assert result.allocated == 0
+    assert prefixes(result.rows()) == ['10.0.0.0/24']
+
+
+def test_nested_parents():
+    outer, inner = ip_network('10.0.0.0/23'), ip_network('10.0.0.0/24')
+    allocations = Allocations([outer, inner])
+    allocations.add_rows('prefix', [{'prefix': '10.0.0.0/24'}])
+    allocations.add_rows('address', [{'address': '10.0.0.5/24'}])
+    # the inner parent allocates space in the outer one, not in itself
+    assert prefixes(allocations.usage(outer).rows()) == ['10.0.1.0/24']
+    assert allocations.usage(inner).allocated == 1
+
+
+def test_allocations_outside_the_parents_are_ignored():
+    result = usage('10.0.0.0/30', ['10.0.1.0/24', '10.0.0.0/16'], ['10.0.0.9', '::1'])
+    assert result.allocated == 0
+    assert prefixes(result.rows()) == ['10.0.0.0/30']
+
+
+def test_ipv6_48_blocks():
+    result = usage('2001:db8::/46', ['2001:db8::/48', '2001:db8:3:8000::/49'])
+    assert result.allocated == 3 << 79
+    assert prefixes(result.rows()) == [
+        '2001:db8:1::/48',
+        '2001:db8:2::/48',
+        '2001:db8:3::/49',
+    ]
+    assert prefixes(result.rows(48)) == ['2001:db8:1::/48', '2001:db8:2::/48']
+    assert result.count(48) == 2
+    assert result.count(47) == 0
+    assert result.count(49) == 5
+
+
+def test_ipv6_addresses():
+    result = usage('2001:db8::/126', addresses=['2001:db8::1/64'])
+    assert prefixes(result.rows()) == ['2001:db8::/128', '2001:db8::2/127']
@@ -0,0 +1,80 @@
+from ipams.query import Result, merge
+
+
+def result(backend: str, address: str, **fields) -> Result:
+    row = {'address': address, 'link': f'{backend}/{address}', **fields}
+    return Result.from_row(backend, 'netbox', row)
+
+
+def backends(result: Result) -> list[str]:
+    return [backend for backend, _, _ in result.sources]
+
+
+def test_merge_combines_backends_of_an_address():
+    merged = merge(
+        [
+            result('nb', '10.0.0.1/24', hostname='host1'),
+            result('php', '10.0.0.1', description='first'),
+        ]
+    )
+    assert len(merged) == 1
+    assert backends(merged[0]) == ['nb', 'php']
+    # the prefix length of addresses is ignored but kept when known
+    assert merged[0].address == '10.0.0.1/24'
+    assert (merged[0].hostname, merged[0].description) == ('host1', 'first')
+
+
+def test_merge_collapses_exact_duplicates():
+    merged = merge([result('nb', '10.0.0.1'), result('nb', '10.0.0.1')])
+    assert len(merged) == 1
+    assert backends(merged[0]) == ['nb']
+
+
+def test_merge_keeps_objects_of_one_backend_apart():
+    first = result('nb', '10.0.0.1')
+    second = Result.from_row('nb', 'netbox', {'address': '10.0.0.1', 'link': 'other'})
+    merged = merge([first, second, result('php', '10.0.0.1')])
+    assert [backends(r) for r in merged] == [['nb', 'php'], ['nb']]
+
+
+def test_merge_sorts_by_address():
+    merged = merge(
+        [
+            result('nb', '10.0.0.10'),
+            result('nb', '2001:db8::1'),
+            result('nb', '10.0.0.9'),
+        ]
+    )
+    assert [r.address for r in merged] == ['10.0.0.9', '10.0.0.10', '2001:db8::1']
+
+
+def test_merge_matches_results_without_address_by_name():
+    merged = merge(
+        [
+            Result.from_row('nb', 'netbox', {'hostname': 'Router1', 'link': 'a'}),
+            Result.from_row('php', 'phpipam', {'hostname': 'router1', 'link': 'b'}),
+        ]
+    )
+    assert len(merged) == 1
+    assert backends(merged[0]) == ['nb', 'php']
+
+
+def test_accepts_other_vrfs_only_when_one_is_unknown():
+    red = result('nb', '10.0.0.1', vrf='red')
+    assert red.accepts(result('php', '10.0.0.1', vrf='red'))
+    assert red.accepts(result('php', '10.0.0.1'))
+    assert not red.accepts(result('php', '10.0.0.1', vrf='blue'))
+
+
+def test_merge_keeps_vrfs_apart():
+    merged = merge(
+        [
+            result('nb', '10.0.0.1', vrf='red'),
+            result('php', '10.0.0.1', vrf='blue'),
+            result('other', '10.0.0.1'),
+        ]
+    )
+    assert [(r.vrf, backends(r)) for r in merged] == [
+        ('red', ['nb', 'other']),
+        ('blue', ['php']),
+    ]